@@ -0,0 +1,46 @@
+"""Added latency histograms and response time percentiles to service metrics
+
+Revision ID: 3f9a2c7d1e44
+Revises: add_workpiece_groups
+Create Date: 2026-10-18 09:12:41.318207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a2c7d1e44'
+down_revision: Union[str, None] = 'add_workpiece_groups'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'latencyhistogram',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('minute', sa.DateTime(), nullable=False),
+        sa.Column('method', sa.String(), nullable=False),
+        sa.Column('route', sa.String(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Float(), nullable=False),
+        sa.Column('max', sa.Float(), nullable=False),
+        sa.Column('buckets', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_latencyhistogram_minute'), 'latencyhistogram', ['minute'], unique=False)
+
+    op.add_column('servicemetrics', sa.Column('p50_response_time', sa.Numeric(precision=10, scale=3), nullable=False, server_default='0'))
+    op.add_column('servicemetrics', sa.Column('p95_response_time', sa.Numeric(precision=10, scale=3), nullable=False, server_default='0'))
+    op.add_column('servicemetrics', sa.Column('p99_response_time', sa.Numeric(precision=10, scale=3), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    op.drop_column('servicemetrics', 'p99_response_time')
+    op.drop_column('servicemetrics', 'p95_response_time')
+    op.drop_column('servicemetrics', 'p50_response_time')
+    op.drop_index(op.f('ix_latencyhistogram_minute'), table_name='latencyhistogram')
+    op.drop_table('latencyhistogram')
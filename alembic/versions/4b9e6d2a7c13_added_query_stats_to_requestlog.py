@@ -0,0 +1,32 @@
+"""Added query stats to requestlog
+
+Revision ID: 4b9e6d2a7c13
+Revises: 7f2a9c4e1b86
+Create Date: 2026-10-18 19:12:40.215683
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b9e6d2a7c13'
+down_revision: Union[str, None] = '7f2a9c4e1b86'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Added to the partitioned parent, the monthly partitions inherit the columns
+    op.add_column('requestlog', sa.Column('query_count', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('requestlog', sa.Column('query_time', sa.Numeric(precision=10, scale=3), nullable=False,
+                                          server_default='0'))
+    op.add_column('requestlog', sa.Column('repeated_queries', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('requestlog', 'repeated_queries')
+    op.drop_column('requestlog', 'query_time')
+    op.drop_column('requestlog', 'query_count')
@@ -0,0 +1,47 @@
+"""Added the upload ledger
+
+Revision ID: 5b8d2f61c0e7
+Revises: a4e1c9d37b52
+Create Date: 2026-10-18 15:21:08.914722
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8d2f61c0e7'
+down_revision: Union[str, None] = 'a4e1c9d37b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'uploadledger',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False),
+        sa.Column('upload_type', sa.String(), nullable=False),
+        sa.Column('sheet_names', sa.String(), nullable=True),
+        sa.Column('header_row', sa.Integer(), nullable=True),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('watermark', sa.DateTime(), nullable=True),
+        sa.Column('total_records', sa.Integer(), nullable=False),
+        sa.Column('inserted', sa.Integer(), nullable=False),
+        sa.Column('upload_job_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_uploadledger_content_hash'), 'uploadledger', ['content_hash'], unique=False)
+
+    op.add_column('uploadjob', sa.Column('content_hash', sa.String(), nullable=True))
+    op.add_column('uploadjob', sa.Column('watermark', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('uploadjob', 'watermark')
+    op.drop_column('uploadjob', 'content_hash')
+    op.drop_index(op.f('ix_uploadledger_content_hash'), table_name='uploadledger')
+    op.drop_table('uploadledger')
@@ -0,0 +1,57 @@
+"""Added the daily fact cube of the reports
+
+Revision ID: 7f2a9c4e1b86
+Revises: e3c7a5914d28
+Create Date: 2026-10-18 18:05:12.480317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7f2a9c4e1b86'
+down_revision: Union[str, None] = 'e3c7a5914d28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'dailyfact',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('tool_id', sa.Integer(), nullable=True),
+        sa.Column('tool_position_id', sa.Integer(), nullable=True),
+        sa.Column('machine_id', sa.Integer(), nullable=True),
+        sa.Column('workpiece_id', sa.Integer(), nullable=True),
+        sa.Column('consumption_records', sa.Integer(), nullable=False),
+        sa.Column('consumption_quantity', sa.Integer(), nullable=False),
+        sa.Column('consumption_value', sa.Numeric(precision=14, scale=2), nullable=False),
+        sa.Column('life_count', sa.Integer(), nullable=False),
+        sa.Column('life_sum', sa.Integer(), nullable=False),
+        sa.Column('completions', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'tool_id', 'tool_position_id', 'machine_id', 'workpiece_id',
+                            name='uq_dailyfact_cell', postgresql_nulls_not_distinct=True)
+    )
+    op.create_index(op.f('ix_dailyfact_day'), 'dailyfact', ['day'], unique=False)
+    op.create_index(op.f('ix_dailyfact_tool_id'), 'dailyfact', ['tool_id'], unique=False)
+    op.create_index(op.f('ix_dailyfact_tool_position_id'), 'dailyfact', ['tool_position_id'], unique=False)
+
+    op.create_table(
+        'reportcubestate',
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('reportcubestate')
+    op.drop_index(op.f('ix_dailyfact_tool_position_id'), table_name='dailyfact')
+    op.drop_index(op.f('ix_dailyfact_tool_id'), table_name='dailyfact')
+    op.drop_index(op.f('ix_dailyfact_day'), table_name='dailyfact')
+    op.drop_table('dailyfact')
@@ -0,0 +1,57 @@
+"""Added hourly and daily heartbeat rollups
+
+Revision ID: 9c41e7b2a5d3
+Revises: 3f9a2c7d1e44
+Create Date: 2026-10-18 10:02:17.540912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c41e7b2a5d3'
+down_revision: Union[str, None] = '3f9a2c7d1e44'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'heartbeathourly',
+        sa.Column('log_device_id', sa.Integer(), nullable=False),
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['log_device_id'], ['logdevice.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('log_device_id', 'hour')
+    )
+    op.create_table(
+        'heartbeatdaily',
+        sa.Column('log_device_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.DateTime(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['log_device_id'], ['logdevice.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('log_device_id', 'day')
+    )
+
+    # Backfill the rollups from the existing heartbeats
+    op.execute("""
+        INSERT INTO heartbeathourly (log_device_id, hour, count)
+        SELECT log_device_id, date_trunc('hour', timestamp), count(*)
+        FROM heartbeat
+        WHERE log_device_id IS NOT NULL
+        GROUP BY 1, 2
+    """)
+    op.execute("""
+        INSERT INTO heartbeatdaily (log_device_id, day, count)
+        SELECT log_device_id, date_trunc('day', hour), sum(count)
+        FROM heartbeathourly
+        GROUP BY 1, 2
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('heartbeatdaily')
+    op.drop_table('heartbeathourly')
@@ -0,0 +1,52 @@
+"""Added upload jobs
+
+Revision ID: a4e1c9d37b52
+Revises: d72b8e0f6a19
+Create Date: 2026-10-18 14:02:17.540391
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4e1c9d37b52'
+down_revision: Union[str, None] = 'd72b8e0f6a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'uploadjob',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('upload_type', sa.String(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('sheet_names', sa.String(), nullable=True),
+        sa.Column('header_row', sa.Integer(), nullable=True),
+        sa.Column('load_mode', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('rows_total', sa.Integer(), nullable=True),
+        sa.Column('rows_read', sa.Integer(), nullable=False),
+        sa.Column('total_records', sa.Integer(), nullable=False),
+        sa.Column('inserted', sa.Integer(), nullable=False),
+        sa.Column('skipped', sa.Integer(), nullable=False),
+        sa.Column('bad_data', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_uploadjob_status'), 'uploadjob', ['status'], unique=False)
+    op.create_index(op.f('ix_uploadjob_created_at'), 'uploadjob', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_uploadjob_created_at'), table_name='uploadjob')
+    op.drop_index(op.f('ix_uploadjob_status'), table_name='uploadjob')
+    op.drop_table('uploadjob')
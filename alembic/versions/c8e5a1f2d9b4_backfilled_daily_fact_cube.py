@@ -0,0 +1,59 @@
+"""Backfilled the daily fact cube of the reports
+
+Revision ID: c8e5a1f2d9b4
+Revises: 4b9e6d2a7c13
+Create Date: 2026-10-18 21:40:03.918254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e5a1f2d9b4'
+down_revision: Union[str, None] = '4b9e6d2a7c13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Start over, a refresh may already have run since the cube was added
+    op.execute("DELETE FROM dailyfact")
+    op.execute("DELETE FROM reportcubestate")
+
+    # Marks taken before the backfill, rows committed meanwhile are recomputed by the first refresh
+    op.execute("""
+        INSERT INTO reportcubestate (source, last_id)
+        SELECT 'toolconsumption', coalesce(max(id), 0) FROM toolconsumption
+        UNION ALL SELECT 'toollife', coalesce(max(id), 0) FROM toollife
+        UNION ALL SELECT 'ordercompletion', coalesce(max(id), 0) FROM ordercompletion
+    """)
+
+    # Same rows as refresh_days of app/report_cube.py, for all days at once
+    op.execute("""
+        INSERT INTO dailyfact (day, tool_id, tool_position_id, machine_id, workpiece_id, consumption_records,
+                               consumption_quantity, consumption_value, life_count, life_sum, completions)
+        SELECT day, tool_id, tool_position_id, machine_id, workpiece_id, sum(consumption_records),
+               sum(consumption_quantity), sum(consumption_value), sum(life_count), sum(life_sum), sum(completions)
+        FROM (
+            SELECT datetime::date AS day, tool_id, tool_position_id, machine_id, workpiece_id,
+                   1 AS consumption_records, quantity AS consumption_quantity, value AS consumption_value,
+                   0 AS life_count, 0 AS life_sum, 0 AS completions
+            FROM toolconsumption
+            UNION ALL
+            SELECT toollife.timestamp::date, toollife.tool_id, toollife.tool_position_id, toollife.machine_id,
+                   coalesce(toollife.workpiece_id, recipe.workpiece_id), 0, 0, 0, 1, toollife.reached_life, 0
+            FROM toollife LEFT OUTER JOIN recipe ON recipe.id = toollife.recipe_id
+            UNION ALL
+            SELECT date, NULL, NULL, NULL, workpiece_id, 0, 0, 0, 0, 0, quantity
+            FROM ordercompletion
+        ) AS facts
+        GROUP BY day, tool_id, tool_position_id, machine_id, workpiece_id
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM dailyfact")
+    op.execute("DELETE FROM reportcubestate")
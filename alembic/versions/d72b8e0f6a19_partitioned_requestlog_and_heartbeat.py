@@ -0,0 +1,99 @@
+"""Partitioned requestlog and heartbeat by month
+
+Revision ID: d72b8e0f6a19
+Revises: 9c41e7b2a5d3
+Create Date: 2026-10-18 11:26:53.207114
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd72b8e0f6a19'
+down_revision: Union[str, None] = '9c41e7b2a5d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Partitions created ahead of the current month, the scheduler keeps extending them
+MONTHS_AHEAD = 3
+
+COLUMNS = {
+    'heartbeat': """
+        id INTEGER NOT NULL DEFAULT nextval('heartbeat_id_seq'),
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        log_device_id INTEGER REFERENCES logdevice (id) ON DELETE CASCADE
+    """,
+    'requestlog': """
+        id INTEGER NOT NULL DEFAULT nextval('requestlog_id_seq'),
+        method VARCHAR NOT NULL,
+        endpoint VARCHAR NOT NULL,
+        status_code INTEGER NOT NULL,
+        response_time NUMERIC(10, 3) NOT NULL,
+        timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL
+    """,
+}
+
+COLUMN_NAMES = {
+    'heartbeat': 'id, timestamp, log_device_id',
+    'requestlog': 'id, method, endpoint, status_code, response_time, timestamp',
+}
+
+INDEXES = {
+    'heartbeat': [('ix_heartbeat_log_device_id_timestamp', 'log_device_id, timestamp')],
+    'requestlog': [('ix_requestlog_timestamp', 'timestamp')],
+}
+
+
+def month_start(date: datetime, months: int = 0) -> datetime:
+    month_index = date.year * 12 + date.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def rename_old_table(table: str) -> None:
+    op.rename_table(table, f'{table}_old')
+    op.execute(f'ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey')
+    for index, _ in INDEXES[table]:
+        op.execute(f'ALTER INDEX IF EXISTS {index} RENAME TO {index}_old')
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    now = datetime.now()
+
+    for table in ('heartbeat', 'requestlog'):
+        rename_old_table(table)
+
+        # Keep using the existing id sequence, so ids stay unique across the copied rows
+        op.execute(f'CREATE TABLE {table} ({COLUMNS[table]}, PRIMARY KEY (id, timestamp)) PARTITION BY RANGE (timestamp)')
+        for index, columns in INDEXES[table]:
+            op.execute(f'CREATE INDEX {index} ON {table} ({columns})')
+
+        # One partition per month from the oldest row up to a few months ahead
+        oldest = connection.execute(sa.text(f'SELECT min(timestamp) FROM {table}_old')).scalar() or now
+        month = month_start(oldest)
+        while month <= month_start(now, MONTHS_AHEAD):
+            op.execute(
+                f"CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{month_start(month, 1):%Y-%m-%d}')"
+            )
+            month = month_start(month, 1)
+
+        op.execute(f'INSERT INTO {table} ({COLUMN_NAMES[table]}) SELECT {COLUMN_NAMES[table]} FROM {table}_old')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        op.drop_table(f'{table}_old')
+
+
+def downgrade() -> None:
+    for table in ('heartbeat', 'requestlog'):
+        rename_old_table(table)
+
+        op.execute(f'CREATE TABLE {table} ({COLUMNS[table]}, PRIMARY KEY (id))')
+        for index, columns in INDEXES[table]:
+            op.execute(f'CREATE INDEX {index} ON {table} ({columns})')
+        op.execute(f'INSERT INTO {table} ({COLUMN_NAMES[table]}) SELECT {COLUMN_NAMES[table]} FROM {table}_old')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        op.drop_table(f'{table}_old')
@@ -0,0 +1,39 @@
+"""Added a unique constraint on the production hour slot
+
+Revision ID: e3c7a5914d28
+Revises: 5b8d2f61c0e7
+Create Date: 2026-10-18 16:40:33.672105
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3c7a5914d28'
+down_revision: Union[str, None] = '5b8d2f61c0e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep the latest row of each slot before the constraint is added
+    op.execute("""
+        DELETE FROM production p
+        USING production newer
+        WHERE p.date = newer.date
+          AND p.start_time = newer.start_time
+          AND p.workpiece_id = newer.workpiece_id
+          AND p.line_id IS NOT DISTINCT FROM newer.line_id
+          AND p.id < newer.id
+    """)
+    op.create_unique_constraint(
+        'uq_production_slot', 'production', ['date', 'start_time', 'workpiece_id', 'line_id'],
+        postgresql_nulls_not_distinct=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_production_slot', 'production', type_='unique')
@@ -1,4 +1,6 @@
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 from dotenv import dotenv_values
 
 env = dotenv_values('.env')
@@ -6,10 +8,42 @@ env = dotenv_values('.env')
 # SQLAlchemy settings
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool settings, overridable in the .env file. Every web and upload worker process has its own
+# pool, so (size + overflow) * processes has to stay below the max_connections of the server
+DB_POOL_SIZE = int(env.get('DB_POOL_SIZE') or 10)
+DB_MAX_OVERFLOW = int(env.get('DB_MAX_OVERFLOW') or 20)
+DB_POOL_TIMEOUT = int(env.get('DB_POOL_TIMEOUT') or 30)  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(env.get('DB_POOL_RECYCLE') or 1800)  # seconds, replaces connections dropped by firewalls
+DB_POOL_PRE_PING = env.get('DB_POOL_PRE_PING', '1') != '0'
+# Server side limit per statement in milliseconds, 0 leaves the server default
+DB_STATEMENT_TIMEOUT_MS = int(env.get('DB_STATEMENT_TIMEOUT_MS') or 0)
+
+# Pool of the async engine, it serves the kiosk requests and websockets only
+DB_ASYNC_POOL_SIZE = int(env.get('DB_ASYNC_POOL_SIZE') or 10)
+DB_ASYNC_MAX_OVERFLOW = int(env.get('DB_ASYNC_MAX_OVERFLOW') or 10)
+
+POOL_SETTINGS = dict(
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args={'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'} if DB_STATEMENT_TIMEOUT_MS else {},
+)
+
 # Create engine
 engine = create_engine(
     env['DATABASE_URL'],
-    future=True
+    future=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    **POOL_SETTINGS,
+)
+
+# Async engine of the hot paths, psycopg runs the same URL on the event loop instead of blocking it
+async_engine = create_async_engine(
+    env['DATABASE_URL'],
+    pool_size=DB_ASYNC_POOL_SIZE,
+    max_overflow=DB_ASYNC_MAX_OVERFLOW,
+    **POOL_SETTINGS,
 )
 
 # Create session factory
@@ -17,10 +51,38 @@ engine = create_engine(
 
 # Create SessionLocal
 def get_session():
+    """
+    Session of a request. FastAPI caches dependencies per request, so the auth dependencies and the handler
+    share this session and a request checks out one connection at a time.
+    """
     with Session(engine) as session:
         yield session
 
 
+async def get_async_session():
+    """
+    Async session of a request, shared by the auth dependencies and the handler like get_session.
+
+    Objects aren't expired on commit and lazy loads can't run on the event loop, so everything a handler
+    reads has to be loaded with the query (selectinload) or fetched explicitly.
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def pool_status() -> dict:
+    """Occupancy of the connection pools of this process, sync and async engine together"""
+    pools = [(engine.pool, DB_MAX_OVERFLOW), (async_engine.sync_engine.pool, DB_ASYNC_MAX_OVERFLOW)]
+    return {
+        "size": sum(pool.size() for pool, _ in pools),
+        "max": sum(pool.size() + max_overflow for pool, max_overflow in pools),
+        "checked_out": sum(pool.checkedout() for pool, _ in pools),
+        "idle": sum(pool.checkedin() for pool, _ in pools),
+        "overflow": sum(max(pool.overflow(), 0) for pool, _ in pools),
+        "async_checked_out": async_engine.sync_engine.pool.checkedout(),
+    }
+
+
 # Initialize database
 def init_db():
     SQLModel.metadata.create_all(bind=engine)
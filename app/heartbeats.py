@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import dotenv_values
+from sqlalchemy import insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.database_config import engine
+from app.models import Heartbeat, HeartbeatHourly, HeartbeatDaily, LogDevice
+
+env = dotenv_values('.env')
+
+# Durability window: heartbeats received within this many seconds are lost if the server crashes
+HEARTBEAT_FLUSH_SECONDS = float(env.get('HEARTBEAT_FLUSH_SECONDS') or 5)
+# Resolved device tokens are trusted this long, so tokens replaced in another worker stop resolving
+HEARTBEAT_DEVICE_CACHE_SECONDS = float(env.get('HEARTBEAT_DEVICE_CACHE_SECONDS') or 300)
+# Tokens and names kept resolved at most, the least recently used are dropped first
+HEARTBEAT_DEVICE_CACHE_SIZE = int(env.get('HEARTBEAT_DEVICE_CACHE_SIZE') or 10000)
+
+
+class HeartbeatBuffer:
+    """
+    Collect device heartbeats in memory and write them in bulk.
+
+    Device tokens (or names) are resolved to device ids and cached for `cache_seconds`. Every `flush_seconds` all
+    buffered Heartbeat rows are inserted with one statement, added to the hourly/daily rollup counts and
+    the `last_seen`/`ip_address` updates are coalesced to one row per device.
+    """
+
+    def __init__(self, flush_seconds: float = HEARTBEAT_FLUSH_SECONDS,
+                 cache_seconds: float = HEARTBEAT_DEVICE_CACHE_SECONDS, cache_size: int = HEARTBEAT_DEVICE_CACHE_SIZE):
+        self.flush_seconds = flush_seconds
+        self.cache_seconds = cache_seconds
+        self.cache_size = cache_size
+        # {token or name: (device id, resolved at)}, least recently used first
+        self.device_ids: OrderedDict[str, Tuple[int, float]] = OrderedDict()
+        self.heartbeats: List[Dict] = []
+        self.devices: Dict[int, Dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush task and write everything still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def cached_device_id(self, key: str) -> Optional[int]:
+        """Device id a token or name was resolved to, None if it isn't cached or expired"""
+        entry = self.device_ids.get(key)
+        if entry is None:
+            return None
+        device_id, resolved_at = entry
+        if time.monotonic() - resolved_at >= self.cache_seconds:
+            del self.device_ids[key]
+            return None
+        self.device_ids.move_to_end(key)
+        return device_id
+
+    def cache_device_id(self, key: str, device_id: int):
+        self.device_ids[key] = (device_id, time.monotonic())
+        self.device_ids.move_to_end(key)
+        while len(self.device_ids) > self.cache_size:
+            self.device_ids.popitem(last=False)
+
+    def forget_device(self, device_id: int):
+        """Drop the cached tokens of a device, e.g. when it authenticates again and gets a new token"""
+        for key in [key for key, (cached_id, _) in self.device_ids.items() if cached_id == device_id]:
+            del self.device_ids[key]
+
+    async def resolve(self, session: AsyncSession, device_token: str) -> Optional[int]:
+        """Get the id of the device with the given token, or name (MAC address) as a fallback"""
+        device_id = self.cached_device_id(device_token)
+        if device_id is not None:
+            return device_id
+
+        device_id = (await session.exec(select(LogDevice.id).where(LogDevice.token == device_token))).one_or_none()
+        if device_id is None:
+            device_id = (await session.exec(select(LogDevice.id).where(LogDevice.name == device_token))).one_or_none()
+        if device_id is not None:
+            self.cache_device_id(device_token, device_id)
+        return device_id
+
+    def record(self, device_id: int, ip_address: Optional[str] = None, timestamp: Optional[datetime] = None):
+        """Buffer a heartbeat of a device, only the latest last_seen/ip per device is written"""
+        timestamp = timestamp or datetime.now()
+        self.heartbeats.append({"timestamp": timestamp, "log_device_id": device_id})
+        device = self.devices.setdefault(device_id, {"id": device_id})
+        device["last_seen"] = timestamp
+        if ip_address:
+            device["ip_address"] = ip_address
+
+    async def flush(self):
+        if not self.heartbeats and not self.devices:
+            return
+        heartbeats, devices = self.heartbeats, list(self.devices.values())
+        self.heartbeats, self.devices = [], {}
+        try:
+            await asyncio.to_thread(self._write, heartbeats, devices)
+        except Exception as e:
+            # Most likely a device was deleted, resolve the tokens again and retry without it
+            self.device_ids.clear()
+            print(f"Error writing {len(heartbeats)} heartbeats, retrying for existing devices: {e}")
+            try:
+                await asyncio.to_thread(self._write_existing, heartbeats, devices)
+            except Exception as e:
+                print(f"Error writing {len(heartbeats)} heartbeats: {e}")
+
+    def _write(self, heartbeats: List[Dict], devices: List[Dict]):
+        with Session(engine) as session:
+            if heartbeats:
+                session.execute(insert(Heartbeat), heartbeats)
+                self._add_to_rollups(session, heartbeats)
+            # Bulk UPDATE by primary key, grouped by the set of columns given
+            if devices:
+                session.execute(update(LogDevice), devices)
+            session.commit()
+
+    def _add_to_rollups(self, session: Session, heartbeats: List[Dict]):
+        """Add the heartbeats to the hourly and daily counts of their devices"""
+        hourly, daily = Counter(), Counter()
+        for heartbeat in heartbeats:
+            hour = heartbeat["timestamp"].replace(minute=0, second=0, microsecond=0)
+            hourly[(heartbeat["log_device_id"], hour)] += 1
+            daily[(heartbeat["log_device_id"], hour.replace(hour=0))] += 1
+
+        for model, column, counts in ((HeartbeatHourly, "hour", hourly), (HeartbeatDaily, "day", daily)):
+            statement = pg_insert(model).values([
+                {"log_device_id": device_id, column: period, "count": count}
+                for (device_id, period), count in sorted(counts.items())
+            ])
+            session.execute(statement.on_conflict_do_update(
+                index_elements=["log_device_id", column],
+                set_={"count": model.count + statement.excluded["count"]}
+            ))
+
+    def _write_existing(self, heartbeats: List[Dict], devices: List[Dict]):
+        with Session(engine) as session:
+            device_ids = set(session.exec(select(LogDevice.id)).all())
+        self._write([heartbeat for heartbeat in heartbeats if heartbeat["log_device_id"] in device_ids],
+                    [device for device in devices if device["id"] in device_ids])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+
+heartbeat_buffer = HeartbeatBuffer()
@@ -7,21 +7,28 @@ from sqlmodel import Session, select
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from contextlib import asynccontextmanager
+from dotenv import dotenv_values
 from fastapi_tailwind import tailwind
 
 from app.templates.jinja_functions import templates
-from app.database_config import init_db, get_session
+from app.database_config import init_db, get_session, async_engine
 from app.router import base, dashboard, device, unprotected
 from app.router.engineer import _engineer
 from app.router.operator import _operator
-from app.models import UserRole, ServiceMetrics, Heartbeat, LogDevice
-from auth import authenticate_or_create_device, authenticate_operator, require_role
+from app.models import UserRole, ServiceMetrics, LogDevice
+from auth import authenticate_or_create_device, authenticate_operator, require_role, require_async_role
 from starlette.middleware.base import BaseHTTPMiddleware
-from datetime import datetime, timedelta
+from datetime import datetime
 
 from . import event_listener # keep, as its necessary to register the event listeners
 
 from app.broadcast import broadcast
+from app.monitoring import request_log_writer
+from app.heartbeats import heartbeat_buffer
+from app.retention import retention_job
+from app.partitions import ensure_partitions_job
+from app.upload_jobs import upload_jobs
+from app.report_cube import rebuild_report_cube_job
 
 static_files = StaticFiles(directory = "app/static")
 
@@ -32,12 +39,15 @@ static_files = StaticFiles(directory = "app/static")
 async def lifespan(app: FastAPI):
     # Connect to broadcaster for real-time updates
     await broadcast.connect()
+    # Make sure the time partitions for the coming months exist before anything is logged
+    await ensure_partitions_job()
     # Schedule background tasks
     schedule_tasks()
     scheduler.start()
 
     # Initialize service metrics
     db = next(get_session())
+    metrics_id = None
     try:
         # Delete any existing metrics to ensure a fresh start
         statement = select(ServiceMetrics)
@@ -56,9 +66,16 @@ async def lifespan(app: FastAPI):
         )
         db.add(metrics)
         db.commit()
+        metrics_id = metrics.id
     finally:
         db.close()
 
+    # Request logs, service metrics and heartbeats are written in the background
+    request_log_writer.start(SERVER_START_TIME, metrics_id)
+    heartbeat_buffer.start()
+    # Uploads are imported in worker processes, queued jobs of the last run are picked up again
+    upload_jobs.start()
+
     # Compile Tailwind CSS
     process = tailwind.compile(
         static_files.directory + "/css/style.css",
@@ -69,7 +86,11 @@ async def lifespan(app: FastAPI):
         yield
     finally:
         process.terminate()
+        await request_log_writer.stop()
+        await heartbeat_buffer.stop()
+        await upload_jobs.stop()
         await broadcast.disconnect()
+        await async_engine.dispose()
 
 app = FastAPI(
     lifespan = lifespan
@@ -101,15 +122,13 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 # Initialize database
 init_db()
 
-# Add monitoring middleware
+# Add monitoring middleware, can be switched off with REQUEST_LOGGING=0 (e.g. for benchmarks/request_logging.py)
+REQUEST_LOGGING = dotenv_values('.env').get('REQUEST_LOGGING', '1') != '0'
+
 @app.middleware("http")
 async def monitoring_middleware(request: Request, call_next):
-    if not request.url.path.startswith("/static"):  # Skip static files
-        db = next(get_session())
-        try:
-            return await dashboard.requests.log_request(request, call_next, db)
-        finally:
-            db.close()
+    if REQUEST_LOGGING and not request.url.path.startswith("/static"):  # Skip static files
+        return await dashboard.requests.log_request(request, call_next)
     return await call_next(request)
 
 # Store server start time
@@ -139,7 +158,8 @@ app.include_router(
 )
 app.include_router(
     _operator.router,
-    dependencies=[Depends(require_role(UserRole.OPERATOR))],
+    # The kiosk routers run on the async session, so does their auth
+    dependencies=[Depends(require_async_role(UserRole.OPERATOR))],
     prefix="/operator",
     tags=["operator"]
 )
@@ -181,14 +201,14 @@ async def authenticate_device(request: Request, db: Session = Depends(get_sessio
         return JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)
 
 @app.post("/authenticateOperator")
-async def authenticate_operator_route(request: Request):
+async def authenticate_operator_route(request: Request, db: Session = Depends(get_session)):
     form_data = await request.form()
     initials = form_data.get("initials")
     pin = form_data.get("pin")
     if not initials or not pin:
         raise HTTPException(status_code=400, detail="Initials and PIN are required")
     try:
-        return await authenticate_operator(initials, pin)
+        return await authenticate_operator(initials, pin, db)
     except HTTPException as e:
         return JSONResponse(content={"error": str(e.detail)}, status_code=e.status_code)
 
@@ -203,34 +223,25 @@ scheduler = AsyncIOScheduler()
 def schedule_tasks():
     """Schedule background tasks for heartbeat monitoring and cleanup"""
     scheduler.add_job(heartbeat, 'interval', minutes=1)
-    scheduler.add_job(delete_old_heartbeats, CronTrigger(hour=0, minute=0))
+    scheduler.add_job(retention_job, CronTrigger(hour=0, minute=0))
+    scheduler.add_job(ensure_partitions_job, CronTrigger(hour=0, minute=5))
+    scheduler.add_job(rebuild_report_cube_job, CronTrigger(hour=0, minute=10))
 
 async def heartbeat():
     session = next(get_session())
     try:
-        log_device: LogDevice = session.exec(select(LogDevice).filter(LogDevice.name == 'Server')).one_or_none()
-        if log_device is None:
-            log_device = LogDevice(name='Server')
-            session.add(log_device)
-            session.commit()
-
-        # Create a new Heartbeat record
-        logged_heartbeat = Heartbeat(timestamp=datetime.now(), log_device_id=log_device.id)
-        log_device.last_seen = datetime.now()
-        session.add(log_device)
-        session.add(logged_heartbeat)
-        session.commit()
-    finally:
-        session.close()
-
-def delete_old_heartbeats():
-    session = next(get_session())
-    try:
-        older_than_a_month = datetime.now() - timedelta(days=30)
-        heartbeats = session.exec(select(Heartbeat).where(Heartbeat.timestamp < older_than_a_month)).all()
-        for heartbeat in heartbeats:
-            session.delete(heartbeat)
-        session.commit()
+        server_id = heartbeat_buffer.cached_device_id('Server')
+        if server_id is None:
+            log_device: LogDevice = session.exec(select(LogDevice).filter(LogDevice.name == 'Server')).one_or_none()
+            if log_device is None:
+                log_device = LogDevice(name='Server')
+                session.add(log_device)
+                session.commit()
+            server_id = log_device.id
+            heartbeat_buffer.cache_device_id('Server', server_id)
+
+        # Buffer a new Heartbeat record, written with the devices' heartbeats
+        heartbeat_buffer.record(server_id)
     finally:
         session.close()
 
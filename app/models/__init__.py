@@ -1,4 +1,4 @@
-from .monitoring import RequestLog, ServiceMetrics
+from .monitoring import RequestLog, ServiceMetrics, LatencyHistogram
 
 from .machine import (Machine, MachineBase, MachineCreate, MachineUpdate, MachineRead, MachineFilter,
                       Measureable, MeasureableBase, MeasureableCreate, MeasureableUpdate, MeasureableRead,
@@ -39,11 +39,15 @@ from .workpiece import (Workpiece, WorkpieceBase, WorkpieceCreate, WorkpieceUpda
 
 from .manufacturer import Manufacturer, ManufacturerBase, ManufacturerCreate, ManufacturerUpdate, ManufacturerRead, ManufacturerFilter
 
-from .log_device import LogDevice, LogDeviceSetMachine, Heartbeat
+from .log_device import LogDevice, LogDeviceSetMachine, Heartbeat, HeartbeatHourly, HeartbeatDaily
+
+from .upload_job import UploadJob, UploadLedger
+
+from .report_cube import DailyFact, ReportCubeState
 
 __all__ = [
     # Monitoring
-    "RequestLog", "ServiceMetrics",
+    "RequestLog", "ServiceMetrics", "LatencyHistogram",
     
     # Machine
     "Machine", "MachineBase", "MachineCreate", "MachineUpdate", "MachineRead", "MachineFilter",
@@ -90,5 +94,11 @@ __all__ = [
     "Manufacturer", "ManufacturerBase", "ManufacturerCreate", "ManufacturerUpdate", "ManufacturerRead", "ManufacturerFilter",
     
     # Log Device
-    "LogDevice", "LogDeviceSetMachine", "Heartbeat"   
+    "LogDevice", "LogDeviceSetMachine", "Heartbeat", "HeartbeatHourly", "HeartbeatDaily",
+
+    # Upload Job
+    "UploadJob", "UploadLedger",
+
+    # Report Cube
+    "DailyFact", "ReportCubeState"
 ]
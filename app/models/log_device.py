@@ -8,14 +8,29 @@ if TYPE_CHECKING:
 
 
 class Heartbeat(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    timestamp: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=False))
+    # Partitioned by month on timestamp, which therefore is part of the primary key
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    timestamp: datetime = Field(sa_column=Column(DateTime(timezone=False), nullable=False, primary_key=True))
     log_device_id: Optional[int] = Field(default=None, foreign_key="logdevice.id", ondelete="CASCADE")
     log_device: "LogDevice" = Relationship(back_populates="heartbeats")
 
     __table_args__ = (Index("ix_heartbeat_log_device_id_timestamp", "log_device_id", "timestamp"),)
 
 
+class HeartbeatHourly(SQLModel, table=True):
+    """Number of heartbeats per device and hour, maintained by the heartbeat buffer"""
+    log_device_id: int = Field(foreign_key="logdevice.id", primary_key=True, ondelete="CASCADE")
+    hour: datetime = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
+class HeartbeatDaily(SQLModel, table=True):
+    """Number of heartbeats per device and day, maintained by the heartbeat buffer"""
+    log_device_id: int = Field(foreign_key="logdevice.id", primary_key=True, ondelete="CASCADE")
+    day: datetime = Field(primary_key=True)
+    count: int = Field(default=0)
+
+
 class LogDevice(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True, unique=True)
@@ -1,15 +1,20 @@
-from typing import Optional
-from sqlmodel import Field, SQLModel
+from typing import Optional, Dict
+from sqlmodel import Field, SQLModel, Column, JSON
 from decimal import Decimal
 from datetime import datetime
 
 class RequestLog(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
+    # Partitioned by month on timestamp, which therefore is part of the primary key
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
     method: str
     endpoint: str
     status_code: int
     response_time: Decimal = Field(max_digits=10, decimal_places=3)  # in seconds
-    timestamp: datetime = Field(default_factory=datetime.now)
+    # SQL statements of the request, their total time in seconds and the fingerprints repeated within it
+    query_count: int = Field(default=0)
+    query_time: Decimal = Field(default=0, max_digits=10, decimal_places=3)
+    repeated_queries: Optional[Dict] = Field(default=None, sa_column=Column(JSON))
+    timestamp: datetime = Field(default_factory=datetime.now, primary_key=True, index=True)
 
 
 class ServiceMetrics(SQLModel, table=True):
@@ -18,4 +23,20 @@ class ServiceMetrics(SQLModel, table=True):
     total_requests: int = Field(default=0)
     total_errors: int = Field(default=0)
     avg_response_time: Decimal = Field(default=0, max_digits=10, decimal_places=3)
+    # Percentiles of the last hour, in seconds
+    p50_response_time: Decimal = Field(default=0, max_digits=10, decimal_places=3)
+    p95_response_time: Decimal = Field(default=0, max_digits=10, decimal_places=3)
+    p99_response_time: Decimal = Field(default=0, max_digits=10, decimal_places=3)
     last_updated: datetime = Field(default_factory=datetime.now)
+
+
+class LatencyHistogram(SQLModel, table=True):
+    """Response time histogram of one route for one minute, buckets are stored sparse as {bucket index: count}"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    minute: datetime = Field(index=True)
+    method: str
+    route: str
+    count: int
+    total: float  # sum of the response times in seconds
+    max: float
+    buckets: Dict = Field(default_factory=dict, sa_column=Column(JSON))
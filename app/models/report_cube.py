@@ -0,0 +1,36 @@
+from typing import Optional
+from sqlmodel import Field, SQLModel
+from sqlalchemy import UniqueConstraint
+from decimal import Decimal
+from datetime import date
+
+
+class DailyFact(SQLModel, table=True):
+    """
+    Daily totals of the fact tables per tool, position, machine and workpiece, the reports sum these rows.
+
+    Completions only have a workpiece, their rows have no tool, position or machine.
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    day: date = Field(index=True)
+    tool_id: Optional[int] = Field(default=None, index=True)
+    tool_position_id: Optional[int] = Field(default=None, index=True)
+    machine_id: Optional[int] = None
+    workpiece_id: Optional[int] = None
+    consumption_records: int = Field(default=0)
+    consumption_quantity: int = Field(default=0)
+    consumption_value: Decimal = Field(default=0, max_digits=14, decimal_places=2)
+    life_count: int = Field(default=0)
+    life_sum: int = Field(default=0)
+    completions: int = Field(default=0)
+
+    __table_args__ = (
+        UniqueConstraint('day', 'tool_id', 'tool_position_id', 'machine_id', 'workpiece_id',
+                         name='uq_dailyfact_cell', postgresql_nulls_not_distinct=True),
+    )
+
+
+class ReportCubeState(SQLModel, table=True):
+    """Id of a fact table up to which all rows are included in the daily facts"""
+    source: str = Field(primary_key=True)
+    last_id: int = Field(default=0)
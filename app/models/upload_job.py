@@ -0,0 +1,44 @@
+from typing import Optional, List
+from sqlmodel import Field, SQLModel, Column, JSON
+from datetime import datetime
+
+
+class UploadJob(SQLModel, table=True):
+    """An upload imported in a background worker, the worker writes its progress to the row while it runs"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    upload_type: str
+    filename: str
+    path: str  # stored upload file, removed once the job has finished
+    content_hash: Optional[str] = None  # set for the upload types recorded in the ledger
+    sheet_names: Optional[str] = None
+    header_row: Optional[int] = None
+    load_mode: str = Field(default='insert')
+    watermark: Optional[datetime] = None  # rows dated before it were imported by earlier uploads and are skipped
+    status: str = Field(default='queued', index=True)  # queued, running, done, failed
+    rows_total: Optional[int] = None  # estimated from the sheet dimensions
+    rows_read: int = Field(default=0)
+    total_records: int = Field(default=0)
+    inserted: int = Field(default=0)
+    skipped: int = Field(default=0)
+    bad_data: int = Field(default=0)
+    errors: List = Field(default_factory=list, sa_column=Column(JSON))  # the first validation errors only
+    error: Optional[str] = None  # why the job failed
+    created_at: datetime = Field(default_factory=datetime.now, index=True)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class UploadLedger(SQLModel, table=True):
+    """A successfully imported file, used to skip exact re-uploads and rows older than the last import"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    content_hash: str = Field(index=True)  # sha256 of the file content
+    upload_type: str
+    sheet_names: Optional[str] = None
+    header_row: Optional[int] = None
+    filename: str
+    # Latest row date (TransDate/Document Date) imported from the file
+    watermark: Optional[datetime] = None
+    total_records: int = Field(default=0)
+    inserted: int = Field(default=0)
+    upload_job_id: Optional[int] = None
+    created_at: datetime = Field(default_factory=datetime.now)
@@ -1,6 +1,7 @@
 from typing import Optional, List, TYPE_CHECKING
 import datetime as dt
 from sqlmodel import Field, SQLModel, Relationship
+from sqlalchemy import UniqueConstraint
 
 if TYPE_CHECKING:
     from .recipe import Recipe
@@ -146,6 +147,10 @@ class Production(ProductionBase, table=True):
     workpiece: Workpiece = Relationship(back_populates='productions')
     line: Optional['Line'] = Relationship(back_populates='productions')
 
+    # One row per hour slot, uploads of the same tracker update it. Rows without a line are unique as well
+    __table_args__ = (UniqueConstraint('date', 'start_time', 'workpiece_id', 'line_id',
+                                       name='uq_production_slot', postgresql_nulls_not_distinct=True),)
+
 class ProductionCreate(ProductionBase):
     pass
 
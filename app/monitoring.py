@@ -0,0 +1,342 @@
+import asyncio
+import time
+from datetime import datetime
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from dotenv import dotenv_values
+from sqlalchemy import insert, update
+from sqlmodel import Session
+
+from app.database_config import engine, pool_status
+from app.models import RequestLog, ServiceMetrics, LatencyHistogram
+from app.query_stats import QueryStats
+
+env = dotenv_values('.env')
+
+# Request log pipeline settings, overridable in the .env file
+REQUEST_LOG_FLUSH_MS = int(env.get('REQUEST_LOG_FLUSH_MS') or 500)
+REQUEST_LOG_BATCH_SIZE = int(env.get('REQUEST_LOG_BATCH_SIZE') or 500)
+REQUEST_LOG_QUEUE_SIZE = int(env.get('REQUEST_LOG_QUEUE_SIZE') or 10000)
+SERVICE_METRICS_FLUSH_SECONDS = int(env.get('SERVICE_METRICS_FLUSH_SECONDS') or 10)
+
+
+# Histogram resolution: each power of two range is split into this many linear sub-buckets (~1.5% precision)
+SUB_BUCKETS = 64
+LATENCY_WINDOWS = {'1m': 1, '5m': 5, '1h': 60}  # window name: minutes
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class Histogram:
+    """
+    HDR-style log-linear histogram of response times with microsecond resolution.
+
+    Values below SUB_BUCKETS microseconds get one bucket each, above that every power of two range is
+    split into SUB_BUCKETS linear buckets, so the relative error stays constant while the number of
+    buckets only grows with the logarithm of the largest value. Buckets are kept sparse.
+    """
+
+    def __init__(self, buckets: Optional[Dict[int, int]] = None, count: int = 0, total: float = 0, max: float = 0):
+        self.buckets: Dict[int, int] = buckets or {}
+        self.count = count
+        self.total = total
+        self.max = max
+
+    @staticmethod
+    def bucket_index(seconds: float) -> int:
+        micros = int(seconds * 1_000_000)
+        if micros < SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - SUB_BUCKETS.bit_length()
+        return (shift + 1) * SUB_BUCKETS + (micros >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def bucket_value(index: int) -> float:
+        """Middle of the bucket in seconds"""
+        if index < SUB_BUCKETS:
+            return index / 1_000_000
+        shift = index // SUB_BUCKETS - 1
+        lower = (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+        return (lower + (1 << shift) / 2) / 1_000_000
+
+    def record(self, seconds: float):
+        index = self.bucket_index(seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: 'Histogram'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> float:
+        if not self.count:
+            return 0
+        rank = percentile / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def summary(self) -> Dict:
+        summary = {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0,
+            "max": self.max,
+        }
+        for percentile in LATENCY_PERCENTILES:
+            summary[f"p{percentile}"] = self.percentile(percentile)
+        return summary
+
+
+class LatencyTracker:
+    """
+    Rolling response time histograms per (method, route template).
+
+    Requests are recorded into a histogram per minute, the 1m/5m/1h windows are merged from the
+    last 1/5/60 of them. Completed minutes are handed out once by `completed_minutes` to be persisted.
+    """
+
+    def __init__(self):
+        self.minutes: Dict[int, Dict[tuple, Histogram]] = {}
+        self._persisted_minute = int(time.time() // 60) - 1
+
+    def record(self, method: str, route: str, seconds: float):
+        minute = int(time.time() // 60)
+        histograms = self.minutes.get(minute)
+        if histograms is None:
+            histograms = self.minutes[minute] = {}
+            # Drop the minutes that fell out of the longest window
+            oldest = minute - max(LATENCY_WINDOWS.values())
+            for old_minute in [m for m in self.minutes if m <= oldest]:
+                del self.minutes[old_minute]
+        key = (method, route)
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].record(seconds)
+
+    def window(self, minutes: int) -> Dict[tuple, Histogram]:
+        """Merged histograms per route of the last `minutes` minutes, including the current one"""
+        since = int(time.time() // 60) - minutes
+        merged: Dict[tuple, Histogram] = {}
+        for minute, histograms in self.minutes.items():
+            if minute <= since:
+                continue
+            for key, histogram in histograms.items():
+                merged.setdefault(key, Histogram()).merge(histogram)
+        return merged
+
+    def overall(self, minutes: int) -> Histogram:
+        """Histogram of all routes of the last `minutes` minutes"""
+        merged = Histogram()
+        for histogram in self.window(minutes).values():
+            merged.merge(histogram)
+        return merged
+
+    def summary(self) -> List[Dict]:
+        """Percentiles per route and window, slowest routes (1h p99) first"""
+        windows = {name: self.window(minutes) for name, minutes in LATENCY_WINDOWS.items()}
+        routes = []
+        for method, route in windows['1h']:
+            routes.append({
+                "method": method,
+                "route": route,
+                "windows": {
+                    name: histograms[(method, route)].summary() if (method, route) in histograms else None
+                    for name, histograms in windows.items()
+                }
+            })
+        routes.sort(key=lambda route: route['windows']['1h']['p99'], reverse=True)
+        return routes
+
+    def completed_minutes(self) -> Dict[int, Dict[tuple, Histogram]]:
+        """Minutes that are over and weren't handed out yet"""
+        current = int(time.time() // 60)
+        completed = {minute: histograms for minute, histograms in self.minutes.items()
+                     if self._persisted_minute < minute < current}
+        self._persisted_minute = current - 1
+        return completed
+
+
+class RequestLogWriter:
+    """
+    Write request logs in the background so the request path only has to enqueue them.
+
+    Logs are bulk-inserted every `flush_ms` milliseconds or as soon as `batch_size` of them are queued.
+    Service metrics and per route latency histograms are aggregated in memory and written to the
+    ServiceMetrics row and the LatencyHistogram table every `metrics_seconds`. If the database can't keep up and the queue is full, new logs are dropped
+    and counted instead of slowing down the requests.
+    """
+
+    def __init__(self, flush_ms: int = REQUEST_LOG_FLUSH_MS, batch_size: int = REQUEST_LOG_BATCH_SIZE,
+                 queue_size: int = REQUEST_LOG_QUEUE_SIZE, metrics_seconds: int = SERVICE_METRICS_FLUSH_SECONDS):
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.metrics_interval = metrics_seconds
+        self.queue: Optional[asyncio.Queue] = None
+        self.listeners: List[Callable[[List[Dict]], Awaitable]] = []
+        self.start_time = datetime.now()
+        self.total_requests = 0
+        self.total_errors = 0
+        self.total_response_time = 0.0
+        self.over_budget = 0
+        self.dropped = 0
+        self.latency = LatencyTracker()
+        self._metrics_id = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, start_time: datetime, metrics_id: int):
+        """Start the writer tasks, metrics are written to the ServiceMetrics row with the given id"""
+        self.start_time = start_time
+        self._metrics_id = metrics_id
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._write_logs()),
+            asyncio.create_task(self._write_metrics()),
+        ]
+
+    async def stop(self):
+        """Stop the writer tasks and flush whatever is still queued"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.queue is not None:
+            batch = []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self._flush_logs(batch)
+        await self._flush_metrics()
+
+    def log(self, method: str, endpoint: str, route: str, status_code: int, response_time: float,
+            query_stats: Optional[QueryStats] = None):
+        """Record a finished request, never blocks. `route` is the route template, e.g. /tools/{tool_id}"""
+        query_stats = query_stats or QueryStats()
+        self.total_requests += 1
+        if query_stats.over_budget():
+            self.over_budget += 1
+        self.latency.record(method, route, response_time)
+        self.total_response_time += response_time
+        if status_code >= 400:
+            self.total_errors += 1
+
+        if self.queue is None:
+            return
+        try:
+            self.queue.put_nowait({
+                "method": method,
+                "endpoint": endpoint,
+                "status_code": status_code,
+                "response_time": Decimal(f"{response_time:.3f}"),
+                "query_count": query_stats.count,
+                "query_time": Decimal(f"{query_stats.seconds:.3f}"),
+                "repeated_queries": query_stats.repeated() or None,
+                "timestamp": datetime.now(),
+            })
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def metrics(self) -> Dict:
+        """Current in-memory service metrics, percentiles are over the last hour"""
+        last_hour = self.latency.overall(LATENCY_WINDOWS['1h'])
+        metrics = {
+            "uptime": (datetime.now() - self.start_time).total_seconds(),
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+            "avg_response_time": self.total_response_time / self.total_requests if self.total_requests else 0,
+            "over_budget_requests": self.over_budget,
+            "dropped_logs": self.dropped,
+            "queued_logs": self.queue.qsize() if self.queue is not None else 0,
+            "db_pool": pool_status(),
+        }
+        for percentile in LATENCY_PERCENTILES:
+            metrics[f"p{percentile}_response_time"] = last_hour.percentile(percentile)
+        return metrics
+
+    async def _write_logs(self):
+        while True:
+            # Wait for the first log, then collect until the batch is full or the flush interval is over
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush_logs(batch)
+
+    async def _flush_logs(self, batch: List[Dict]):
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self._insert_logs, batch)
+        except Exception as e:
+            print(f"Error writing {len(batch)} request logs: {e}")
+            return
+
+        for listener in self.listeners:
+            try:
+                await listener(batch)
+            except Exception as e:
+                print(f"Error notifying request log listener: {e}")
+
+    def _insert_logs(self, batch: List[Dict]):
+        with Session(engine) as session:
+            session.execute(insert(RequestLog), batch)
+            session.commit()
+
+    async def _write_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            await self._flush_metrics()
+
+    async def _flush_metrics(self):
+        if self._metrics_id is None:
+            return
+        metrics = self.metrics()
+        completed_minutes = self.latency.completed_minutes()
+        try:
+            await asyncio.to_thread(self._update_metrics, metrics, completed_minutes)
+        except Exception as e:
+            print(f"Error writing service metrics: {e}")
+
+    def _update_metrics(self, metrics: Dict, completed_minutes: Dict[int, Dict[tuple, Histogram]]):
+        with Session(engine) as session:
+            histograms = [{
+                "minute": datetime.fromtimestamp(minute * 60),
+                "method": method,
+                "route": route,
+                "count": histogram.count,
+                "total": histogram.total,
+                "max": histogram.max,
+                "buckets": histogram.buckets,
+            } for minute, histograms in completed_minutes.items() for (method, route), histogram in histograms.items()]
+            if histograms:
+                session.execute(insert(LatencyHistogram), histograms)
+            session.execute(
+                update(ServiceMetrics)
+                .where(ServiceMetrics.id == self._metrics_id)
+                .values(
+                    total_requests=metrics["total_requests"],
+                    total_errors=metrics["total_errors"],
+                    avg_response_time=Decimal(f"{metrics['avg_response_time']:.3f}"),
+                    p50_response_time=Decimal(f"{metrics['p50_response_time']:.3f}"),
+                    p95_response_time=Decimal(f"{metrics['p95_response_time']:.3f}"),
+                    p99_response_time=Decimal(f"{metrics['p99_response_time']:.3f}"),
+                    last_updated=datetime.now(),
+                )
+            )
+            session.commit()
+
+
+request_log_writer = RequestLogWriter()
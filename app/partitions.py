@@ -0,0 +1,105 @@
+import asyncio
+import re
+from datetime import datetime
+from typing import List
+
+from dotenv import dotenv_values
+from sqlalchemy import text
+
+from app.database_config import engine
+
+env = dotenv_values('.env')
+
+# Tables partitioned by month on their timestamp column (see the partition migration)
+PARTITIONED_TABLES = ['heartbeat', 'requestlog']
+# Months to create partitions for in advance, inserts fail if there is no partition for their month
+PARTITION_MONTHS_AHEAD = int(env.get('PARTITION_MONTHS_AHEAD') or 3)
+
+
+def month_start(date: datetime, months: int = 0) -> datetime:
+    """First day of the month `months` months after the month of date"""
+    month_index = date.year * 12 + date.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection, table: str) -> bool:
+    return connection.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar() or False
+
+
+def list_partitions(connection, table: str) -> List[str]:
+    return list(connection.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+        ORDER BY child.relname
+    """), {"table": table}).scalars())
+
+
+def ensure_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Create the monthly partitions from the current month up to `months_ahead` months ahead"""
+    created = []
+    now = datetime.now()
+    with engine.begin() as connection:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(connection, table):
+                continue
+            existing = set(list_partitions(connection, table))
+            for months in range(months_ahead + 1):
+                start = month_start(now, months)
+                name = partition_name(table, start)
+                if name in existing:
+                    continue
+                connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{month_start(start, 1):%Y-%m-%d}')"
+                ))
+                created.append(name)
+    if created:
+        print(f"Partitions: created {', '.join(created)}")
+    return created
+
+
+def detach_pending(connection, name: str) -> bool:
+    """Check if a partition was left half detached by an interrupted DETACH PARTITION CONCURRENTLY"""
+    return connection.execute(
+        text("SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass(:name)"), {"name": name}
+    ).scalar() or False
+
+
+def drop_partitions_before(table: str, cutoff: datetime) -> List[str]:
+    """
+    Drop the monthly partitions of table that only contain rows older than cutoff.
+
+    A partition is detached concurrently before it is dropped. DROP TABLE on an attached partition locks the
+    parent table exclusively, which would block the heartbeat and request log writers and every reader.
+    DETACH ... CONCURRENTLY can't run in a transaction block, so every statement commits on its own.
+    """
+    dropped = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for name in list_partitions(connection, table):
+            match = re.fullmatch(rf"{table}_p(\d{{4}})_(\d{{2}})", name)
+            if not match:
+                continue
+            end = month_start(datetime(int(match.group(1)), int(match.group(2)), 1), 1)
+            if end <= cutoff:
+                if detach_pending(connection, name):
+                    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} FINALIZE"))
+                else:
+                    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} CONCURRENTLY"))
+                # Detached, the drop only locks the old partition itself
+                connection.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+    return dropped
+
+
+async def ensure_partitions_job() -> List[str]:
+    """Scheduler entry point, runs the DDL in a worker thread"""
+    return await asyncio.to_thread(ensure_partitions)
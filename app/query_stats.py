@@ -0,0 +1,117 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from dotenv import dotenv_values
+from sqlalchemy import event
+
+from app.database_config import async_engine, engine
+
+env = dotenv_values('.env')
+
+# Requests running more statements than this are flagged
+QUERY_BUDGET = int(env.get('QUERY_BUDGET') or 50)
+# A statement fingerprint repeated this often within one request is reported as a likely N+1
+QUERY_REPEAT_THRESHOLD = int(env.get('QUERY_REPEAT_THRESHOLD') or 5)
+# Length the fingerprints are cut to in the request log
+FINGERPRINT_LENGTH = 300
+
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Statement text with its parameters and literals replaced, so the executions of one query compare equal"""
+    statement = _PARAMETER.sub('?', statement)
+    statement = _PARAMETER_LIST.sub('?, ...', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+class QueryStats:
+    """Statements executed within one request (or `count_queries` block): count, database time and fingerprints"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.fingerprints: Counter = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> Dict[str, int]:
+        """Fingerprints executed at least `threshold` times, most repeated first"""
+        return {statement[:FINGERPRINT_LENGTH]: count
+                for statement, count in self.fingerprints.most_common() if count >= threshold}
+
+    def over_budget(self, budget: int = QUERY_BUDGET) -> bool:
+        return self.count > budget
+
+    def server_timing(self, response_time: float) -> str:
+        """Server-Timing header value with the database and total time in milliseconds"""
+        return f'db;dur={self.seconds * 1000:.1f};desc="{self.count} statements", total;dur={response_time * 1000:.1f}'
+
+    def report(self) -> str:
+        repeated = '; '.join(f"{count}x {statement}" for statement, count in self.repeated().items())
+        return f"{self.count} statements in {self.seconds * 1000:.1f}ms" + (f", repeated: {repeated}" if repeated else '')
+
+
+# Stats of the request being handled, tasks and worker threads started by it inherit them
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar('current_query_stats', default=None)
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+
+def drop_query_timer(exception_context):
+    # after_cursor_execute isn't called for failed statements
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+# The async engine runs its statements through a sync engine as well, SQLAlchemy carries the context over
+for instrumented_engine in (engine, async_engine.sync_engine):
+    event.listen(instrumented_engine, "before_cursor_execute", start_query_timer)
+    event.listen(instrumented_engine, "after_cursor_execute", record_query)
+    event.listen(instrumented_engine, "handle_error", drop_query_timer)
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """Collect the statements executed in the block, e.g. around a request"""
+    stats = QueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_query_stats.reset(token)
+
+
+@contextmanager
+def assert_max_queries(max_count: int, label: str = 'block') -> Iterator[QueryStats]:
+    """Fail with the executed statements if the block runs more than `max_count` of them"""
+    with count_queries() as stats:
+        yield stats
+    if stats.count > max_count:
+        raise AssertionError(f"{label} ran {stats.count} statements, at most {max_count} expected: "
+                             f"{stats.report()}")
+
+
+def statement_count(headers) -> Optional[int]:
+    """Statement count of a response from its Server-Timing header, None if it wasn't instrumented"""
+    match = re.search(r'db;[^,]*desc="(\d+) statements"', headers.get('server-timing', ''))
+    return int(match.group(1)) if match else None
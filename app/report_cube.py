@@ -0,0 +1,168 @@
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable
+
+from dotenv import dotenv_values
+from sqlalchemy import Date, cast, delete, distinct, func, literal_column, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from app.database_config import engine
+from app.models import DailyFact, OrderCompletion, Recipe, ReportCubeState, ToolConsumption, ToolLife
+
+env = dotenv_values('.env')
+
+# Days the nightly rebuild recomputes, which picks up edited and deleted fact rows
+REPORT_CUBE_REBUILD_DAYS = int(env.get('REPORT_CUBE_REBUILD_DAYS') or 31)
+# Advisory lock serializing the refreshes of the web and upload worker processes
+REPORT_CUBE_LOCK = 720301
+
+# Fact tables of the cube: model and the column their day is taken from
+FACT_SOURCES = {
+    'toolconsumption': (ToolConsumption, ToolConsumption.datetime),
+    'toollife': (ToolLife, ToolLife.timestamp),
+    'ordercompletion': (OrderCompletion, OrderCompletion.date),
+}
+
+MEASURES = ['consumption_records', 'consumption_quantity', 'consumption_value', 'life_count', 'life_sum', 'completions']
+DIMENSIONS = ['day', 'tool_id', 'tool_position_id', 'machine_id', 'workpiece_id']
+
+
+def on_days(statement, column, days: list):
+    """Restrict a fact statement to the given days, the range lets the timestamp index do the work"""
+    return (statement
+            .where(column >= days[0], column < days[-1] + timedelta(days=1))
+            .where(cast(column, Date).in_(days)))
+
+
+def daily_facts(days: list):
+    """The fact rows of the given days in the column layout of DailyFact, before grouping"""
+    zero, one, null = literal_column('0'), literal_column('1'), literal_column('NULL')
+    consumption = on_days(select(
+        cast(ToolConsumption.datetime, Date).label('day'),
+        ToolConsumption.tool_id,
+        ToolConsumption.tool_position_id,
+        ToolConsumption.machine_id,
+        ToolConsumption.workpiece_id,
+        one.label('consumption_records'),
+        ToolConsumption.quantity.label('consumption_quantity'),
+        ToolConsumption.value.label('consumption_value'),
+        zero.label('life_count'),
+        zero.label('life_sum'),
+        zero.label('completions'),
+    ), ToolConsumption.datetime, days)
+    lifes = on_days(select(
+        cast(ToolLife.timestamp, Date),
+        ToolLife.tool_id,
+        ToolLife.tool_position_id,
+        ToolLife.machine_id,
+        func.coalesce(ToolLife.workpiece_id, Recipe.workpiece_id),
+        zero, zero, zero,
+        one,
+        ToolLife.reached_life,
+        zero,
+    ).outerjoin(Recipe, Recipe.id == ToolLife.recipe_id), ToolLife.timestamp, days)
+    completions = on_days(select(
+        OrderCompletion.date,
+        null, null, null,
+        OrderCompletion.workpiece_id,
+        zero, zero, zero, zero, zero,
+        OrderCompletion.quantity,
+    ), OrderCompletion.date, days)
+    return union_all(consumption, lifes, completions).subquery()
+
+
+def refresh_days(connection, days: Iterable[date]) -> int:
+    """Recompute the cube rows of the given days from the fact tables, returns the rows written"""
+    days = sorted(set(days))
+    if not days:
+        return 0
+    facts = daily_facts(days)
+    grouped = (
+        select(*[facts.c[name] for name in DIMENSIONS], *[func.sum(facts.c[name]) for name in MEASURES])
+        .group_by(*[facts.c[name] for name in DIMENSIONS])
+    )
+    connection.execute(delete(DailyFact).where(DailyFact.day.in_(days)))
+    return connection.execute(insert(DailyFact).from_select(DIMENSIONS + MEASURES, grouped)).rowcount
+
+
+def settled_id(connection, model, last_id: int, max_id: int, others_running: bool) -> int:
+    """
+    Highest id up to which every row of the fact table is visible, the next refresh scans the ids above it.
+
+    Ids are drawn from a sequence when a row is inserted, but the rows become visible when their transaction
+    commits, so a running upload can commit ids below `max_id` after this refresh. Without other running
+    transactions that can't happen. Otherwise the refresh only advances over the gapless run of ids after
+    `last_id`, the rows above the first gap are scanned again until it is filled or nothing else is running.
+    """
+    if not others_running:
+        return max_id
+    ids = select(model.id, (model.id - func.row_number().over(order_by=model.id)).label('offset')).where(
+        model.id > last_id, model.id <= max_id).subquery()
+    return connection.execute(select(func.max(ids.c.id)).where(ids.c.offset == last_id)).scalar() or last_id
+
+
+def refresh_report_cube() -> Dict:
+    """
+    Recompute the days of the fact rows added since the last refresh.
+
+    Scans the ids above the one settled by the previous refresh per fact table, so rows added by any writer
+    (uploads, COPY, tool life logs) are picked up, also when they commit out of id order (see settled_id).
+    Edited and deleted rows are left to the nightly rebuild.
+    """
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(select(func.pg_advisory_xact_lock(REPORT_CUBE_LOCK)))
+        last_ids = dict(connection.execute(select(ReportCubeState.source, ReportCubeState.last_id)).all())
+        # Transactions of other sessions in progress when the statement's snapshot is taken
+        running = func.pg_snapshot_xip(func.pg_current_snapshot()).table_valued('xid')
+        others_running = select(func.count()).select_from(running).where(
+            running.c.xid != func.pg_current_xact_id()).scalar_subquery() > 0
+        days, new_last_ids = set(), {}
+        for source, (model, column) in FACT_SOURCES.items():
+            last_id = last_ids.get(source, 0)
+            # One statement, so the highest id and the running transactions are read from the same snapshot
+            max_id, running_now = connection.execute(select(func.max(model.id), others_running)).one()
+            max_id = max_id or 0
+            if max_id > last_id:
+                # Settled before the days are read, so every row up to it is visible to the later statement
+                settled = settled_id(connection, model, last_id, max_id, running_now)
+                days.update(connection.execute(
+                    select(distinct(cast(column, Date))).where(model.id > last_id, model.id <= max_id)
+                ).scalars())
+                if settled > last_id:
+                    new_last_ids[source] = settled
+        rows = refresh_days(connection, days)
+        if new_last_ids:
+            statement = insert(ReportCubeState).values(
+                [{'source': source, 'last_id': last_id} for source, last_id in new_last_ids.items()])
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=['source'], set_={'last_id': statement.excluded.last_id}))
+    return {"days": len(days), "rows": rows, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def rebuild_report_cube(days: int = REPORT_CUBE_REBUILD_DAYS) -> Dict:
+    """Recompute the last `days` days, including days whose fact rows were all deleted"""
+    start = time.perf_counter()
+    today = datetime.now().date()
+    with engine.begin() as connection:
+        connection.execute(select(func.pg_advisory_xact_lock(REPORT_CUBE_LOCK)))
+        rows = refresh_days(connection, [today - timedelta(days=n) for n in range(days + 1)])
+    return {"days": days + 1, "rows": rows, "seconds": round(time.perf_counter() - start, 3)}
+
+
+async def refresh_report_cube_job():
+    """Refresh the cube in a worker thread, e.g. after a tool life was logged"""
+    try:
+        await asyncio.to_thread(refresh_report_cube)
+    except Exception as e:
+        print(f"Report cube: error refreshing: {e}")
+
+
+async def rebuild_report_cube_job():
+    """Scheduler entry point of the nightly rebuild"""
+    try:
+        result = await asyncio.to_thread(rebuild_report_cube)
+        print(f"Report cube: rebuilt {result['days']} days ({result['rows']} rows) in {result['seconds']}s")
+    except Exception as e:
+        print(f"Report cube: error rebuilding: {e}")
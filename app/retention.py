@@ -0,0 +1,100 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from dotenv import dotenv_values
+from sqlalchemy import delete, select, tuple_
+
+from app.database_config import engine
+from app.models import Heartbeat, HeartbeatHourly, HeartbeatDaily, RequestLog, LatencyHistogram, UploadJob
+from app.partitions import drop_partitions_before, is_partitioned
+
+env = dotenv_values('.env')
+
+# Rows deleted per statement, every batch is its own short transaction
+RETENTION_BATCH_SIZE = int(env.get('RETENTION_BATCH_SIZE') or 10000)
+# Pause between batches so other writers get the table in between
+RETENTION_BATCH_PAUSE_SECONDS = 0.1
+
+# Tables that are cleaned up nightly: model, timestamp column and days to keep.
+# Partitioned tables drop whole months once all their rows are past retention.
+RETENTION_POLICIES = [
+    {"model": Heartbeat, "column": Heartbeat.timestamp, "days": int(env.get('HEARTBEAT_RETENTION_DAYS') or 30),
+     "partitioned": True},
+    # The rollups outlive the raw heartbeats, the dashboard reads 7 days of hourly and 30 days of daily counts
+    {"model": HeartbeatHourly, "column": HeartbeatHourly.hour,
+     "days": int(env.get('HEARTBEAT_HOURLY_RETENTION_DAYS') or 30)},
+    {"model": HeartbeatDaily, "column": HeartbeatDaily.day,
+     "days": int(env.get('HEARTBEAT_DAILY_RETENTION_DAYS') or 90)},
+    {"model": RequestLog, "column": RequestLog.timestamp, "days": int(env.get('REQUEST_LOG_RETENTION_DAYS') or 90),
+     "partitioned": True},
+    {"model": LatencyHistogram, "column": LatencyHistogram.minute, "days": int(env.get('REQUEST_LOG_RETENTION_DAYS') or 90)},
+    {"model": UploadJob, "column": UploadJob.created_at, "days": int(env.get('UPLOAD_JOB_RETENTION_DAYS') or 90)},
+]
+
+
+def purge_table(model, column, days: int, batch_size: int = RETENTION_BATCH_SIZE) -> Dict:
+    """Delete the rows older than `days` days in batches of `batch_size`, returns rows removed and duration"""
+    cutoff = datetime.now() - timedelta(days=days)
+    start = time.perf_counter()
+    removed = 0
+    # The rollups have a composite primary key
+    key = model.__table__.primary_key.columns
+    while True:
+        with engine.begin() as connection:
+            result = connection.execute(
+                delete(model).where(tuple_(*key).in_(
+                    select(*key).where(column < cutoff).limit(batch_size)
+                ))
+            )
+        removed += result.rowcount
+        if result.rowcount < batch_size:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE_SECONDS)
+
+    return {
+        "table": model.__tablename__,
+        "cutoff": cutoff,
+        "rows": removed,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def drop_old_partitions(model, days: int) -> Dict:
+    """Drop the monthly partitions of model that are completely older than `days` days"""
+    cutoff = datetime.now() - timedelta(days=days)
+    start = time.perf_counter()
+    dropped = drop_partitions_before(model.__tablename__, cutoff)
+    return {
+        "table": model.__tablename__,
+        "cutoff": cutoff,
+        "partitions": dropped,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def run_retention() -> List[Dict]:
+    """Apply all retention policies, a failing table doesn't stop the others"""
+    results = []
+    for policy in RETENTION_POLICIES:
+        try:
+            with engine.connect() as connection:
+                partitioned = policy.get("partitioned") and is_partitioned(connection, policy["model"].__tablename__)
+            if partitioned:
+                result = drop_old_partitions(policy["model"], policy["days"])
+                print(f"Retention: dropped partitions {result['partitions'] or 'none'} of {result['table']} "
+                      f"older than {result['cutoff']:%Y-%m-%d %H:%M} in {result['seconds']}s")
+            else:
+                result = purge_table(policy["model"], policy["column"], policy["days"])
+                print(f"Retention: removed {result['rows']} rows from {result['table']} "
+                      f"older than {result['cutoff']:%Y-%m-%d %H:%M} in {result['seconds']}s")
+            results.append(result)
+        except Exception as e:
+            print(f"Retention: error cleaning up {policy['model'].__tablename__}: {e}")
+    return results
+
+
+async def retention_job() -> List[Dict]:
+    """Scheduler entry point, runs the blocking deletes in a worker thread"""
+    return await asyncio.to_thread(run_retention)
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SharedResultCache:
+    """
+    Share the result of an expensive dashboard computation between all clients asking for the same key.
+
+    Concurrent requests for a key that is currently being computed await the same task (single flight),
+    so N websockets with identical filters cost one computation. Entries expire after `ttl` seconds or
+    when `invalidate` is called.
+    """
+
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._generation = 0
+        self._entries: Dict[Hashable, tuple] = {}
+
+    async def get(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and self._is_valid(entry, now):
+            self.hits += 1
+            return await asyncio.shield(entry[2])
+
+        self.misses += 1
+        self._prune(now)
+        task = asyncio.ensure_future(compute())
+        self._entries[key] = (self._generation, now, task)
+        try:
+            # shield the shared task, a disconnecting client must not cancel it for the others
+            return await asyncio.shield(task)
+        except Exception:
+            if key in self._entries and self._entries[key][2] is task:
+                del self._entries[key]
+            raise
+
+    def invalidate(self):
+        """Drop all entries, the next request per key recomputes"""
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+        }
+
+    def _is_valid(self, entry: tuple, now: float) -> bool:
+        generation, created, task = entry
+        if generation != self._generation or now - created >= self.ttl:
+            return False
+        if task.done() and (task.cancelled() or task.exception() is not None):
+            return False
+        return True
+
+    def _prune(self, now: float):
+        for key in [key for key, entry in self._entries.items() if not self._is_valid(entry, now)]:
+            del self._entries[key]
@@ -7,7 +7,8 @@ from datetime import datetime, timedelta
 from app.broadcast import broadcast
 
 from app.templates.jinja_functions import templates
-from app.database_config import get_session
+from app.database_config import get_session, async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.models import Workpiece, WorkpieceGroup, Machine, ToolConsumption, Recipe, ChangeOver, Tool, ToolOrder, OrderDelivery, Line
 from collections import defaultdict
 
@@ -83,31 +84,31 @@ async def get_dashboard_filter(request: Request,
 async def machine_status_websocket(websocket: WebSocket):
     """WebSocket endpoint for machine status updates"""
     await websocket.accept()
-    # Send initial data to the client
-    session = next(get_session())
-    machines = session.exec(select(Machine).options(
-        selectinload(Machine.current_recipe).selectinload(Recipe.workpiece),
-        selectinload(Machine.current_recipe).selectinload(Recipe.workpiece_group)
-    )).all()
-
-    # get the most current changeover for each machine
-    subq = (select(ChangeOver.machine_id,
-            func.max(ChangeOver.timestamps).label("max_timestamp")
-        )
-            .group_by(ChangeOver.machine_id)
-            .subquery()
-        )
-    stmt = (select(ChangeOver)
-        .join(
-            subq,
-            and_(
-                ChangeOver.machine_id == subq.c.machine_id,
-                ChangeOver.timestamps == subq.c.max_timestamp
+    # Send initial data to the client, queried on the event loop without blocking the other connections
+    async with AsyncSession(async_engine) as session:
+        machines = (await session.exec(select(Machine).options(
+            selectinload(Machine.current_recipe).selectinload(Recipe.workpiece),
+            selectinload(Machine.current_recipe).selectinload(Recipe.workpiece_group)
+        ))).all()
+
+        # get the most current changeover for each machine
+        subq = (select(ChangeOver.machine_id,
+                func.max(ChangeOver.timestamps).label("max_timestamp")
             )
+                .group_by(ChangeOver.machine_id)
+                .subquery()
+            )
+        stmt = (select(ChangeOver)
+            .join(
+                subq,
+                and_(
+                    ChangeOver.machine_id == subq.c.machine_id,
+                    ChangeOver.timestamps == subq.c.max_timestamp
+                )
+            )
+            .where(ChangeOver.machine_id.in_([machine.id for machine in machines]))
         )
-        .where(ChangeOver.machine_id.in_([machine.id for machine in machines]))
-    )
-    changeovers = session.exec(stmt).all()
+        changeovers = (await session.exec(stmt)).all()
     changeovers = {changeover.machine_id: changeover for changeover in changeovers}
 
     # Determine workpiece or group name for each machine
@@ -141,15 +142,15 @@ async def machine_status_websocket(websocket: WebSocket):
         async for event in subscriber:
             message = json.loads(event.message)
             # get the current workpiece or workpiece group from the database
-            session = next(get_session())
-            recipe = session.exec(
-                select(Recipe)
-                .where(Recipe.id == message['data']['current_recipe_id'])
-                .options(
-                    selectinload(Recipe.workpiece),
-                    selectinload(Recipe.workpiece_group)
-                )
-            ).one_or_none()
+            async with AsyncSession(async_engine) as session:
+                recipe = (await session.exec(
+                    select(Recipe)
+                    .where(Recipe.id == message['data']['current_recipe_id'])
+                    .options(
+                        selectinload(Recipe.workpiece),
+                        selectinload(Recipe.workpiece_group)
+                    )
+                )).one_or_none()
             
             if recipe is None:
                 workpiece_name = "No Recipe selected"
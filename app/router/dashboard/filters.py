@@ -0,0 +1,161 @@
+import json
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Query
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+from sqlalchemy import event, true
+from sqlmodel import Session, select
+
+from app.models import Recipe, RecipeTool, ToolLife
+
+# Resolved recipe/tool ids of a selection are reused this long, recipe edits through the ORM drop them right away
+FILTER_CACHE_SECONDS = 300
+
+# {(resolver, operations, products): (resolved at, ids)}
+_resolved: Dict[tuple, tuple] = {}
+
+
+def parse_ids(value) -> Tuple[int, ...]:
+    """Sorted unique ids of a JSON list like '["1", "2"]', a list or a single id"""
+    if value is None or value in ('', 'null'):
+        return ()
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not isinstance(value, (list, tuple, set, frozenset)):
+        value = [value]
+    return tuple(sorted({int(id) for id in value}))
+
+
+class DashboardFilter(BaseModel):
+    """
+    Date range and operation/product selection of a dashboard request, parsed and validated once.
+
+    The filter is immutable and hashable, so it also is the cache key of the dashboard results. The recipe
+    and tool ids of a selection are resolved once and shared by all requests with the same selection.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    operations: Tuple[int, ...] = ()
+    products: Tuple[int, ...] = ()
+
+    @field_validator('operations', 'products', mode='before')
+    @classmethod
+    def parse_selection(cls, value):
+        return parse_ids(value)
+
+    @field_validator('start_date', 'end_date', mode='before')
+    @classmethod
+    def parse_empty_date(cls, value):
+        return None if value in ('', 'null') else value
+
+    @field_validator('start_date', 'end_date')
+    @classmethod
+    def make_naive(cls, value):
+        # The database timestamps are naive
+        return value.replace(tzinfo=None) if value else value
+
+    @property
+    def has_selection(self) -> bool:
+        return bool(self.operations or self.products)
+
+    def _resolve(self, resolver: str, db: Session, statement) -> Tuple[int, ...]:
+        key = (resolver, self.operations, self.products)
+        now = time.monotonic()
+        entry = _resolved.get(key)
+        if entry is not None and now - entry[0] < FILTER_CACHE_SECONDS:
+            return entry[1]
+        ids = tuple(sorted(set(db.exec(statement).all())))
+        for stale in [key for key, (resolved_at, _) in _resolved.items() if now - resolved_at >= FILTER_CACHE_SECONDS]:
+            del _resolved[stale]
+        _resolved[key] = (now, ids)
+        return ids
+
+    def recipe_ids(self, db: Session) -> Tuple[int, ...]:
+        """Recipes of the selected operations and products, all recipes without a selection"""
+        statement = select(Recipe.id)
+        if self.operations:
+            statement = statement.where(Recipe.machine_id.in_(self.operations))
+        if self.products:
+            statement = statement.where(Recipe.workpiece_id.in_(self.products))
+        return self._resolve('recipes', db, statement)
+
+    def product_recipe_ids(self, db: Session) -> Tuple[int, ...]:
+        """Recipes of the selected products, for records that carry their own machine"""
+        statement = select(Recipe.id)
+        if self.products:
+            statement = statement.where(Recipe.workpiece_id.in_(self.products))
+        return self._resolve('product_recipes', db, statement)
+
+    def tool_ids(self, db: Session) -> Tuple[int, ...]:
+        """Tools used by the recipes of the selection, all recipe tools without a selection"""
+        statement = select(RecipeTool.tool_id)
+        if self.has_selection:
+            statement = statement.where(RecipeTool.recipe_id.in_(self.recipe_ids(db)))
+        return self._resolve('tools', db, statement)
+
+    def recipe_predicate(self, column, db: Session):
+        """Restrict a recipe id column to the selection, no restriction without a selection"""
+        if not self.has_selection:
+            return true()
+        return column.in_(self.recipe_ids(db))
+
+    def tool_life_predicates(self, db: Session) -> list:
+        """Predicates restricting a statement selecting from ToolLife to the filter"""
+        predicates = []
+        if self.start_date:
+            predicates.append(ToolLife.timestamp >= self.start_date)
+        if self.end_date:
+            predicates.append(ToolLife.timestamp <= self.end_date)
+        if self.operations:
+            predicates.append(ToolLife.machine_id.in_(self.operations))
+        if self.products:
+            predicates.append(ToolLife.recipe_id.in_(self.product_recipe_ids(db)))
+        return predicates
+
+    def matches_tool_life(self, record: Dict) -> bool:
+        """Check if a published tool life falls into the filter"""
+        timestamp = datetime.fromisoformat(record['timestamp'])
+        if self.start_date and timestamp < self.start_date:
+            return False
+        if self.end_date and timestamp > self.end_date:
+            return False
+        if self.operations and record['machine_id'] not in self.operations:
+            return False
+        if self.products and record['workpiece_id'] not in self.products:
+            return False
+        return True
+
+
+def get_dashboard_filter(
+    selected_operations: str = Query(''),
+    selected_products: str = Query(''),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+) -> DashboardFilter:
+    """Dependency parsing the filter query parameters shared by the dashboard endpoints"""
+    try:
+        return DashboardFilter(start_date=start_date, end_date=end_date,
+                               operations=selected_operations, products=selected_products)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+
+def get_dated_dashboard_filter(dashboard_filter: DashboardFilter = Depends(get_dashboard_filter)) -> DashboardFilter:
+    """Dependency of the endpoints that need a complete date range, a missing date is rejected like an invalid one"""
+    missing = [name for name in ('start_date', 'end_date') if getattr(dashboard_filter, name) is None]
+    if missing:
+        raise HTTPException(status_code=422, detail=[
+            {'type': 'missing', 'loc': ['query', name], 'msg': 'Field required', 'input': None} for name in missing
+        ])
+    return dashboard_filter
+
+
+@event.listens_for(Session, 'after_flush')
+def drop_resolved_selections(session, flush_context):
+    """Recipe edits change the ids a selection resolves to"""
+    if any(isinstance(obj, (Recipe, RecipeTool)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        _resolved.clear()
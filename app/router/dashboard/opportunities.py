@@ -1,16 +1,14 @@
 from fastapi import APIRouter, Request, Depends
 from sqlmodel import Session, select, func
-import json
-from typing import Optional
-from datetime import datetime
 from statistics import mean, stdev
 from decimal import Decimal
-from app.models.recipe import ToolPosition, Recipe
+from app.models.recipe import ToolPosition
 from app.models.tool import ToolLife, Tool
 from app.models.workpiece import OrderCompletion
 
 from app.database_config import get_session
 from app.templates.jinja_functions import templates
+from .filters import DashboardFilter, get_dated_dashboard_filter
 
 router = APIRouter(
     prefix="/opportunities",
@@ -28,10 +26,7 @@ async def dashboard(request: Request):
 @router.get("/api/ranked")
 async def get_ranked_opportunities(
     request: Request, 
-    start_date: Optional[datetime],
-    end_date: Optional[datetime], 
-    selected_operations: str = '',
-    selected_products: str = '',
+    dashboard_filter: DashboardFilter = Depends(get_dated_dashboard_filter),
     db: Session = Depends(get_session)
     ):
     """
@@ -40,26 +35,14 @@ async def get_ranked_opportunities(
     based on OrderCompletion volume over the past 365 days.
     """
 
-    selected_operations = json.loads(selected_operations) if selected_operations else []
-    selected_products = json.loads(selected_products) if selected_products else []
-    # Convert selected operations and products to lists of integers
-    selected_operations = [int(op) for op in selected_operations]
-    selected_products = [int(product) for product in selected_products]
-    
+    start_date, end_date = dashboard_filter.start_date, dashboard_filter.end_date
+
     # Query tool positions with expected life
     statement = select(ToolPosition).where(
         ToolPosition.selected == True).where(
         ToolPosition.expected_life != None,
     )
-    if selected_operations:
-        statement = statement.where(ToolPosition.recipe.machine_id.in_(selected_operations))
-    if selected_products:
-        statement = (
-            statement
-            .join(Recipe, ToolPosition.recipe_id == Recipe.id)
-            .join(Recipe.workpiece)
-            .where(Recipe.workpiece_id.in_(selected_products))
-        )
+    statement = statement.where(dashboard_filter.recipe_predicate(ToolPosition.recipe_id, db))
     statement = statement.order_by(ToolLife.timestamp.asc())
     positions = db.exec(statement).all()
 
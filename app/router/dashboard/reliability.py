@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Request, Depends, Body
 from app.templates.jinja_functions import templates
-from datetime import datetime, timedelta
-from sqlmodel import Session, select
+from datetime import datetime
+from sqlmodel import Session, select, func
+from sqlalchemy import Date, Float, cast, literal_column
+from collections import defaultdict
 from app.database_config import get_session
-from app.models import ToolLife, Machine, ToolConsumption
+from app.models import ToolLife, Machine, ToolConsumption, Tool, User, Shift
 from typing import Dict, List, Optional
 from . import tool_lifes_cards as tc
 
@@ -13,127 +15,76 @@ router = APIRouter(
     tags=["Reliability"],
 )
 
-async def machine_reliability(db: Session, machine_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Dict[str, str]]:
-    # Fetch machine reliability data from the database
-    machine = db.get(Machine, machine_id)
-    query = (select(ToolConsumption)
-             .where(ToolConsumption.machine_id == machine_id))
+def reliability_week(column):
+    """Sunday before the Monday to Sunday week of a timestamp, the x axis of the reliability charts"""
+    # Inlined constants, bound parameters would make the grouped expression differ from the selected one
+    return cast(func.date_trunc(literal_column("'week'"), column) - literal_column("interval '1 day'"), Date)
+
+def load_reliability(db: Session, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict[int, Dict]:
+    """
+    Weekly reliability aggregates of all machines, one grouped query per fact table.
+
+    Returns:
+        Dict: {machine_id: {week: {'tool_consumption': quantity, <shift name>: sum of tool_count / max_uses}}}
+    """
+    match_by_machine = defaultdict(dict)
+
+    week = reliability_week(ToolLife.timestamp)
+    shift_name = func.coalesce(Shift.name, literal_column("'Unknown Shift'"))
+    query = (select(ToolLife.machine_id, week, shift_name, func.sum(ToolLife.tool_count / cast(Tool.max_uses, Float)))
+             .join(Tool, Tool.id == ToolLife.tool_id)
+             .outerjoin(User, User.id == ToolLife.user_id)
+             .outerjoin(Shift, Shift.id == User.shift_id)
+             .where(ToolLife.machine_id != None))
     if start_date:
-        query = query.where(ToolConsumption.datetime >= start_date)
+        query = query.where(ToolLife.timestamp >= start_date)
     if end_date:
-        query = query.where(ToolConsumption.datetime <= end_date)
-    tool_consumptions = db.exec(query).all()
+        query = query.where(ToolLife.timestamp <= end_date)
+    for machine_id, weeks_sunday, shift, reports in db.exec(query.group_by(ToolLife.machine_id, week, shift_name)):
+        week_data = match_by_machine[machine_id].setdefault(weeks_sunday, {'tool_consumption': 0})
+        week_data[shift] = reports
 
-    query = (select(ToolLife)
-             .where(ToolLife.machine_id == machine_id))
+    week = reliability_week(ToolConsumption.datetime)
+    query = (select(ToolConsumption.machine_id, week, func.sum(ToolConsumption.quantity))
+             .where(ToolConsumption.machine_id != None))
     if start_date:
-        query = query.where(ToolLife.timestamp >= start_date)
+        query = query.where(ToolConsumption.datetime >= start_date)
     if end_date:
-        query = query.where(ToolLife.timestamp <= end_date)
-    tool_lifes = db.exec(query).all()
-
-    match_by_weeks = {}
-    shifts = set()
-    shifts.add('total_reports')
-    for tool_life in tool_lifes:
-        # week_number = tool_life.timestamp.isocalendar()[1]
-        weeks_sunday = tool_life.timestamp - timedelta(days=tool_life.timestamp.weekday() + 1)
-        weeks_sunday = weeks_sunday.date()
-        if weeks_sunday not in match_by_weeks:
-            match_by_weeks[weeks_sunday] = {
-                'total_reports': 0,
-                'tool_consumption': 0
-            }
-        shift_name = tool_life.user.shift.name if tool_life.user and tool_life.user.shift else 'Unknown Shift'
-        if shift_name not in match_by_weeks[weeks_sunday]:
-            match_by_weeks[weeks_sunday][shift_name] = 0
-            shifts.add(shift_name)
-        match_by_weeks[weeks_sunday][shift_name] += tool_life.tool_count / tool_life.tool.max_uses
-        match_by_weeks[weeks_sunday]['total_reports'] += tool_life.tool_count / tool_life.tool.max_uses
-    
-    for tool_consumption in tool_consumptions:
-        weeks_sunday = tool_consumption.datetime - timedelta(days=tool_consumption.datetime.weekday() + 1)
-        weeks_sunday = weeks_sunday.date()
-        if weeks_sunday not in match_by_weeks:
-            match_by_weeks[weeks_sunday] = {
-                'total_reports': 0,
-                'tool_consumption': 0
-            }
-        match_by_weeks[weeks_sunday]['tool_consumption'] += tool_consumption.quantity   
+        query = query.where(ToolConsumption.datetime <= end_date)
+    for machine_id, weeks_sunday, quantity in db.exec(query.group_by(ToolConsumption.machine_id, week)):
+        week_data = match_by_machine[machine_id].setdefault(weeks_sunday, {'tool_consumption': 0})
+        week_data['tool_consumption'] = quantity
+
+    return match_by_machine
+
+def week_shifts(match_by_weeks: Dict) -> List[str]:
+    return sorted({shift for week_data in match_by_weeks.values() for shift in week_data if shift != 'tool_consumption'})
 
+def machine_reliability(machine: Machine, match_by_weeks: Dict) -> Dict:
+    """Reported tool changes per shift and in total as a percentage of the weekly tool consumption"""
+    shifts = ['total_reports'] + week_shifts(match_by_weeks)
     series_dict = {shift: {
             'type': 'line',
             'smooth': True,
             'name': shift,
             'data': []
         } for shift in shifts}
-    
-    if start_date and machine.name == 'OP45-Broach':
-        pass
 
-    weeks = sorted(list(match_by_weeks.keys()))
+    weeks = sorted(match_by_weeks.keys())
     for week in weeks:
-        week_data = match_by_weeks[week]
+        week_data = dict(match_by_weeks[week])
+        week_data['total_reports'] = sum(week_data.get(shift, 0) for shift in shifts[1:])
         for shift in shifts:
             reports = week_data.get(shift, 0)
             series_dict[shift]['data'].append(int(100 * reports/week_data['tool_consumption'] if week_data['tool_consumption'] != 0 else 0))
 
     series = [data for data in series_dict.values()]
     xAxis= {'type': "category", 'data': [week.isoformat() for week in weeks]}
-    graph = tc.graph_card(machine.name, series, xAxis)
-
-    
-    return graph
-
-
-async def machine_reliability_stacked(db: Session, machine_id: int, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Dict[str, str]]:
-    # Fetch machine reliability data from the database
-    machine = db.get(Machine, machine_id)
-    query = (select(ToolConsumption)
-             .where(ToolConsumption.machine_id == machine_id))
-    if start_date:
-        query = query.where(ToolConsumption.datetime >= start_date)
-    if end_date:
-        query = query.where(ToolConsumption.datetime <= end_date)
-    tool_consumptions = db.exec(query).all()
-
-    query = (select(ToolLife)
-             .where(ToolLife.machine_id == machine_id))
-    if start_date:
-        query = query.where(ToolLife.timestamp >= start_date)
-    if end_date:
-        query = query.where(ToolLife.timestamp <= end_date)
-    tool_lifes = db.exec(query).all()
-
-    match_by_weeks = {}
-    shifts = set()
-    # shifts.add('total_reports')
-    for tool_life in tool_lifes:
-        # week_number = tool_life.timestamp.isocalendar()[1]
-        weeks_sunday = tool_life.timestamp - timedelta(days=tool_life.timestamp.weekday() + 1)
-        weeks_sunday = weeks_sunday.date()
-        if weeks_sunday not in match_by_weeks:
-            match_by_weeks[weeks_sunday] = {
-                # 'total_reports': 0,
-                'tool_consumption': 0
-            }
-        shift_name = tool_life.user.shift.name if tool_life.user and tool_life.user.shift else 'Unknown Shift'
-        if shift_name not in match_by_weeks[weeks_sunday]:
-            match_by_weeks[weeks_sunday][shift_name] = 0
-            shifts.add(shift_name)
-        match_by_weeks[weeks_sunday][shift_name] += tool_life.tool_count / tool_life.tool.max_uses
-        # match_by_weeks[weeks_sunday]['total_reports'] += tool_life.tool_count / tool_life.tool.max_uses
-    
-    for tool_consumption in tool_consumptions:
-        weeks_sunday = tool_consumption.datetime - timedelta(days=tool_consumption.datetime.weekday() + 1)
-        weeks_sunday = weeks_sunday.date()
-        if weeks_sunday not in match_by_weeks:
-            match_by_weeks[weeks_sunday] = {
-                # 'total_reports': 0,
-                'tool_consumption': 0
-            }
-        match_by_weeks[weeks_sunday]['tool_consumption'] += tool_consumption.quantity   
+    return tc.graph_card(machine.name, series, xAxis)
 
+def machine_reliability_stacked(machine: Machine, match_by_weeks: Dict) -> Dict:
+    """Reported tool changes per shift stacked, next to the weekly tool consumption"""
+    shifts = week_shifts(match_by_weeks)
     series_dict = {shift: {
             'type': 'line',
             'stack': 'Total',
@@ -144,17 +95,13 @@ async def machine_reliability_stacked(db: Session, machine_id: int, start_date:
             'name': shift,
             'data': []
         } for shift in shifts}
-    
-    if start_date and machine.name == 'OP45-Broach':
-        pass
 
-    weeks = sorted(list(match_by_weeks.keys()))
+    weeks = sorted(match_by_weeks.keys())
     for week in weeks:
         week_data = match_by_weeks[week]
         for shift in shifts:
-            reports = week_data.get(shift, 0)
-            series_dict[shift]['data'].append(reports)
-        
+            series_dict[shift]['data'].append(week_data.get(shift, 0))
+
         if 'tool_consumption' not in series_dict:
             series_dict['tool_consumption'] = {
                 'type': 'line',
@@ -165,18 +112,16 @@ async def machine_reliability_stacked(db: Session, machine_id: int, start_date:
 
     series = [data for data in series_dict.values()]
     xAxis= {'type': "category", 'data': [week.isoformat() for week in weeks]}
-    graph = tc.graph_card(machine.name, series, xAxis)
-
-    
-    return graph
+    return tc.graph_card(machine.name, series, xAxis)
 
 @router.get("/")
 async def tools(request: Request, 
                 db: Session = Depends(get_session), 
             ):
     # Get initial graphs without date filtering
-    machine_ids = db.exec(select(Machine.id).order_by(Machine.name)).all()
-    graphs = [await machine_reliability(db, id) for id in machine_ids]
+    machines = db.exec(select(Machine).order_by(Machine.name)).all()
+    match_by_machine = load_reliability(db)
+    graphs = [machine_reliability(machine, match_by_machine.get(machine.id, {})) for machine in machines]
     return templates.TemplateResponse(
         "dashboard/log_reliability.html.j2",  # Updated template path
         {
@@ -192,7 +137,8 @@ async def log_reliability(db: Session = Depends(get_session),
             ):
     start_date = datetime.fromisoformat(start_date) if start_date else None
     end_date = datetime.fromisoformat(end_date) if end_date and end_date != 'null' else None
-    machine_ids = db.exec(select(Machine.id).order_by(Machine.name)).all()
-    graphs = [await machine_reliability_stacked(db, id, start_date, end_date) for id in machine_ids]
+    machines = db.exec(select(Machine).order_by(Machine.name)).all()
+    match_by_machine = load_reliability(db, start_date, end_date)
+    graphs = [machine_reliability_stacked(machine, match_by_machine.get(machine.id, {})) for machine in machines]
 
     return graphs
\ No newline at end of file
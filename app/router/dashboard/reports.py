@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Request, Depends, Query
+import asyncio
+from fastapi import APIRouter, Request, Depends
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select, func
-from datetime import datetime, timedelta
+from datetime import timedelta
 from app.database_config import get_session
 from app.templates.jinja_functions import templates
-from app.models import OrderCompletion
-from .tools import get_cpu
+from app.models import DailyFact
+from app.report_cube import refresh_report_cube
+from .tools import compute_cpu
+from .filters import DashboardFilter, get_dated_dashboard_filter
 
 router = APIRouter(
     prefix="/reports",
@@ -24,49 +27,43 @@ async def reports_page(request: Request):
 
 @router.get("/api/data")
 async def reports_data(
-    selected_products: str = Query('[]'),
-    selected_operations: str = Query('[]'),
-    start_date: datetime = Query(...),
-    end_date: datetime = Query(...),
+    dashboard_filter: DashboardFilter = Depends(get_dated_dashboard_filter),
     db: Session = Depends(get_session),
 )-> JSONResponse:
     """
     Retrieve report data: cost per piece, finished counts current and previous windows.
     """
 
+    # Both windows are summed from the daily fact cube, first pick up what was added since its last refresh.
+    # It runs in a thread, waiting for the advisory lock of a concurrent refresh must not block the event loop
+    await asyncio.to_thread(refresh_report_cube)
+
     # Get cost per piece metrics from existing CPU endpoint logic
-    current_cpu_data = await get_cpu(
-        selected_operations=selected_operations,
-        selected_products=selected_products,
-        start_date=start_date,
-        end_date=end_date,
-        db=db,
-    )
+    current_cpu_data = compute_cpu(dashboard_filter, db, from_cube=True)
 
     # Compute previous window
+    start_date, end_date = dashboard_filter.start_date, dashboard_filter.end_date
     duration = end_date - start_date
     prev_end = start_date - timedelta(days=1)
     prev_start = prev_end - duration
 
-    previous_cpu_data = await get_cpu(
-        selected_operations=selected_operations,
-        selected_products=selected_products,
-        start_date=prev_start,
-        end_date=prev_end,
-        db=db,
-    )
+    previous_cpu_data = compute_cpu(
+        dashboard_filter.model_copy(update={'start_date': prev_start, 'end_date': prev_end}), db, from_cube=True)
+
+    # Finished pieces per product in the current window
+    completions = dict(db.exec(
+        select(DailyFact.workpiece_id, func.sum(DailyFact.completions))
+        .where(DailyFact.completions > 0)
+        .where(DailyFact.day >= start_date.date())
+        .where(DailyFact.day <= end_date.date())
+        .group_by(DailyFact.workpiece_id)
+    ).all())
 
     report_rows = []
     for line_name, line_dict in current_cpu_data.items():
         for prod_name, prod_dict in line_dict.get("products", {}).items():
             product_id = prod_dict.get("id")
-            # Compute finished pieces for current and previous windows
-            workpieces_produced = db.exec(
-                select(func.sum(OrderCompletion.quantity))
-                .where(OrderCompletion.workpiece_id == product_id)
-                .where(OrderCompletion.date >= start_date.date())
-                .where(OrderCompletion.date <= end_date.date())
-             ).first() or 0
+            workpieces_produced = completions.get(product_id) or 0
 
             for op_name, op_dict in prod_dict.get("operations", {}).items():
                 current_cpp = op_dict.get("cost_per_piece", 0)
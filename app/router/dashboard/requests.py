@@ -1,15 +1,19 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request, Depends
-from sqlmodel import Session, select
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Request
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime, timedelta
 from typing import List, Callable, Dict
 import asyncio
-from decimal import Decimal
+import time
 from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 import socket
 import json
 
-from app.database_config import engine, get_session
-from app.models import RequestLog, ServiceMetrics, Heartbeat, LogDevice
+from app.database_config import async_engine, pool_status
+from app.models import RequestLog, HeartbeatHourly, HeartbeatDaily, LogDevice, Machine
+from app.monitoring import request_log_writer
+from app.query_stats import count_queries
 
 
 router = APIRouter()
@@ -17,61 +21,64 @@ router = APIRouter()
 # Store active WebSocket connections
 active_connections: List[WebSocket] = []
 
-# Middleware to log requests
-async def log_request(request: Request, call_next: Callable, db: Session):
-    start_time = datetime.now()
-    response = await call_next(request)
-    end_time = datetime.now()
-    
-    # Calculate response time in seconds
-    response_time = Decimal(str((end_time - start_time).total_seconds()))
-    
-    # Create request log
-    log = RequestLog(
-        method=request.method,
-        endpoint=str(request.url.path),
-        status_code=response.status_code,
-        response_time=response_time
-    )
-    db.add(log)
-    
-    # Update metrics
-    metrics = db.exec(select(ServiceMetrics)).first()
-    if not metrics:
-        metrics = ServiceMetrics()
-        db.add(metrics)
-    
-    metrics.total_requests += 1
-    if response.status_code >= 400:
-        metrics.total_errors += 1
-    
-    # Update average response time
-    metrics.avg_response_time = (
-        (metrics.avg_response_time * (metrics.total_requests - 1) + response_time)
-        / metrics.total_requests
-    )
-    metrics.last_updated = datetime.now()
-    
-    db.commit()
-    
-    # Notify WebSocket clients
-    log_data = {
+# Middleware to log requests, the log is only enqueued and written to the database in the background
+async def log_request(request: Request, call_next: Callable):
+    start_time = time.perf_counter()
+    # Statements of the handler, its dependencies and the worker threads it starts
+    with count_queries() as query_stats:
+        response = await call_next(request)
+    response_time = time.perf_counter() - start_time
+    response.headers['Server-Timing'] = query_stats.server_timing(response_time)
+
+    # Key the latency histograms by the route template to keep their number bounded
+    route = request.scope.get('route')
+    route_path = getattr(route, 'path', None) or 'unmatched'
+    if query_stats.over_budget():
+        print(f"Query budget exceeded: {request.method} {route_path} {query_stats.report()}")
+    request_log_writer.log(request.method, str(request.url.path), route_path, response.status_code, response_time,
+                           query_stats)
+    return response
+
+async def notify_request_logs(batch: List[Dict]):
+    """Send a batch of written request logs to the connected WebSocket clients"""
+    if not active_connections:
+        return
+    messages = [{
         "type": "request",
         "data": {
-            "method": log.method,
-            "endpoint": log.endpoint,
-            "status_code": log.status_code,
-            "response_time": float(log.response_time),
-            "timestamp": log.timestamp.isoformat()
+            "method": log["method"],
+            "endpoint": log["endpoint"],
+            "status_code": log["status_code"],
+            "response_time": float(log["response_time"]),
+            "query_count": log["query_count"],
+            "query_time": float(log["query_time"]),
+            "timestamp": log["timestamp"].isoformat()
         }
-    }
-    for connection in active_connections:
+    } for log in batch]
+    for connection in list(active_connections):
         try:
-            await connection.send_json(log_data)
+            for message in messages:
+                await connection.send_json(message)
         except:
             pass  # Ignore failed sends
-    
-    return response
+
+request_log_writer.listeners.append(notify_request_logs)
+
+# How far back the request log sent on connect looks
+RECENT_REQUESTS_WINDOW = timedelta(days=1)
+
+# Seconds between the per route latency percentiles sent over /ws/requests
+LATENCY_SEND_SECONDS = 5
+
+@router.get("/api/requests/latency")
+async def get_request_latency():
+    """Rolling 1m/5m/1h response time percentiles per (method, route template)"""
+    return request_log_writer.latency.summary()
+
+@router.get("/api/requests/pool")
+async def get_pool_status():
+    """Connections of the database pool of this process in use and idle"""
+    return pool_status()
 
 @router.websocket("/ws/requests")
 async def websocket_endpoint(websocket: WebSocket):
@@ -79,54 +86,48 @@ async def websocket_endpoint(websocket: WebSocket):
     active_connections.append(websocket)
     
     try:
-        # Create a new database session for this WebSocket connection
-        db = Session(engine)
+        ticks = 0
         
-        try:
-            while True:
-                # Force a new database query each time
-                db.expire_all()
-                metrics = db.exec(select(ServiceMetrics)).first()
+        while True:
+            # Live metrics come from memory, the ServiceMetrics row is only flushed periodically
+            await websocket.send_json({
+                "type": "metrics",
+                "data": request_log_writer.metrics()
+            })
+            if ticks % LATENCY_SEND_SECONDS == 0:
+                await websocket.send_json({
+                    "type": "latency",
+                    "data": request_log_writer.latency.summary()
+                })
+            ticks += 1
+            
+            # Send recent requests on first connect
+            if not hasattr(websocket, 'initial_data_sent'):
+                # Time bounded, so only the latest partitions are scanned
+                async with AsyncSession(async_engine) as db:
+                    recent_logs = (await db.exec(
+                        select(RequestLog)
+                        .where(RequestLog.timestamp >= datetime.now() - RECENT_REQUESTS_WINDOW)
+                        .order_by(RequestLog.timestamp.desc())
+                        .limit(100)
+                    )).all()
                 
-                if metrics:
-                    # Explicitly load the metrics attributes to ensure fresh data
-                    db.refresh(metrics)
-                    
+                for log in reversed(recent_logs):
                     await websocket.send_json({
-                        "type": "metrics",
+                        "type": "request",
                         "data": {
-                            "uptime": (datetime.now() - metrics.start_time).total_seconds(),
-                            "total_requests": metrics.total_requests,
-                            "total_errors": metrics.total_errors,
-                            "avg_response_time": float(metrics.avg_response_time)
+                            "method": log.method,
+                            "endpoint": log.endpoint,
+                            "status_code": log.status_code,
+                            "response_time": float(log.response_time),
+                            "query_count": log.query_count,
+                            "query_time": float(log.query_time),
+                            "timestamp": log.timestamp.isoformat()
                         }
                     })
-                
-                # Send recent requests on first connect
-                if not hasattr(websocket, 'initial_data_sent'):
-                    recent_logs = db.exec(
-                        select(RequestLog)
-                        .order_by(RequestLog.timestamp.desc())
-                        .limit(100)
-                    ).all()
-                    
-                    for log in reversed(recent_logs):
-                        await websocket.send_json({
-                            "type": "request",
-                            "data": {
-                                "method": log.method,
-                                "endpoint": log.endpoint,
-                                "status_code": log.status_code,
-                                "response_time": float(log.response_time),
-                                "timestamp": log.timestamp.isoformat()
-                            }
-                        })
-                    websocket.initial_data_sent = True
-                
-                await asyncio.sleep(1)
-        
-        finally:
-            db.close()
+                websocket.initial_data_sent = True
+            
+            await asyncio.sleep(1)
     
     except WebSocketDisconnect:
         active_connections.remove(websocket)
@@ -146,10 +147,12 @@ async def requests(request: Request):
 
 
 ### Hardware Stati
-async def get_device_status(db: Session) -> List[Dict]:
+async def get_device_status(db: AsyncSession) -> List[Dict]:
     """Fetches the status of all log devices."""
     now = datetime.now()
-    devices = db.exec(select(LogDevice)).all()
+    devices = (await db.exec(
+        select(LogDevice).options(selectinload(LogDevice.machines).selectinload(Machine.line))
+    )).all()
     device_statuses = []
 
     # Define time horizons
@@ -165,23 +168,32 @@ async def get_device_status(db: Session) -> List[Dict]:
     expected_heartbeats_7d = int(time_horizon_7d.total_seconds() / (heartbeat_frequency * 60))
     expected_heartbeats_30d = int(time_horizon_30d.total_seconds() / (heartbeat_frequency * 60))
 
+    # Heartbeat counts of all devices from the rollup tables, hourly for 24h/7d and daily for 30d
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    hourly_counts = {row.log_device_id: row for row in (await db.exec(
+        select(
+            HeartbeatHourly.log_device_id,
+            func.sum(HeartbeatHourly.count).filter(HeartbeatHourly.hour > hour - time_horizon_24h).label("count_24h"),
+            func.sum(HeartbeatHourly.count).label("count_7d"),
+        )
+        .where(HeartbeatHourly.hour > hour - time_horizon_7d)
+        .group_by(HeartbeatHourly.log_device_id)
+    )).all()}
+    daily_counts = dict((await db.exec(
+        select(HeartbeatDaily.log_device_id, func.sum(HeartbeatDaily.count))
+        .where(HeartbeatDaily.day > hour.replace(hour=0) - time_horizon_30d)
+        .group_by(HeartbeatDaily.log_device_id)
+    )).all())
+
     for device in devices:
         if device.name != 'Server' and not device.machines:
             continue
 
-        # Construct the query to count heartbeats for different time horizons using aggregate filters
-        stmt = select(
-            func.count(Heartbeat.timestamp).filter(Heartbeat.timestamp >= now - time_horizon_24h).label("count_24h"),
-            func.count(Heartbeat.timestamp).filter(Heartbeat.timestamp >= now - time_horizon_7d).label("count_7d"),
-            func.count(Heartbeat.timestamp).filter(Heartbeat.timestamp >= now - time_horizon_30d).label("count_30d"),
-        ).where(Heartbeat.log_device_id == device.id)
-
-        result = db.exec(stmt).first()
-
-        # Extract heartbeat counts from the result
-        heartbeats_24h = result.count_24h if result else 0
-        heartbeats_7d = result.count_7d if result else 0
-        heartbeats_30d = result.count_30d if result else 0
+        # Extract heartbeat counts from the rollups
+        result = hourly_counts.get(device.id)
+        heartbeats_24h = (result.count_24h or 0) if result else 0
+        heartbeats_7d = (result.count_7d or 0) if result else 0
+        heartbeats_30d = daily_counts.get(device.id) or 0
 
         # Calculate device health
         is_healthy = device.last_seen and (now - device.last_seen) <= timedelta(minutes=5) if device.last_seen else False
@@ -240,27 +252,29 @@ def get_ip_address():
         return "Unable to get IP address"
 
 
-async def send_heartbeat_data(websocket: WebSocket, db: Session):
+async def send_heartbeat_data(websocket: WebSocket):
     """Sends device status data to the WebSocket client."""
-    device_statuses = await get_device_status(db)
+    # A fresh session per send, so last_seen isn't served from the identity map of an earlier one
+    async with AsyncSession(async_engine) as db:
+        device_statuses = await get_device_status(db)
     await websocket.send_text(json.dumps(device_statuses))
 
 
-async def periodic_data_sender(websocket: WebSocket, db: Session):
+async def periodic_data_sender(websocket: WebSocket):
     """Periodically sends heartbeat data to the WebSocket client."""
     while True:
         try:
-            await send_heartbeat_data(websocket, db)
+            await send_heartbeat_data(websocket)
             await asyncio.sleep(30)  # Send data every 30 seconds
         except Exception as e:
             print(f"Error in periodic_data_sender: {e}")
             break
 
 @router.websocket("/ws/heartbeat")
-async def websocket_heartbeat(websocket: WebSocket, db: Session = Depends(get_session)):
+async def websocket_heartbeat(websocket: WebSocket):
     """WebSocket endpoint for streaming heartbeat data."""
     await websocket.accept()
-    data_sender_task = asyncio.create_task(periodic_data_sender(websocket, db))
+    data_sender_task = asyncio.create_task(periodic_data_sender(websocket))
     try:
         while True:
             await websocket.receive_text()  # Keep the connection alive
@@ -1,16 +1,22 @@
 from fastapi import APIRouter, WebSocket, Request, Depends, HTTPException
+from pydantic import ValidationError
 import asyncio
+import copy
 import json
 from statistics import median
 from collections import defaultdict
 from app.templates.jinja_functions import templates
 from datetime import datetime
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
+from sqlalchemy.orm import selectinload
 import locale
 from app.database_config import get_session, engine
-from app.models import Tool, ToolLife, Recipe, Machine, ToolPosition, ToolConsumption, Line
+from app.models import Tool, ToolLife, Machine, ToolPosition, ToolConsumption, Line
 from typing import Dict, List, Optional
-from .utils import get_condensed_data
+from app.broadcast import broadcast
+from .utils import get_condensed_data, window_start
+from .cache import SharedResultCache
+from .filters import DashboardFilter, get_dashboard_filter
 from . import tool_lifes_cards as tc
 
 
@@ -19,6 +25,18 @@ router = APIRouter()
 # Global variables to store the latest filter settings
 websocket_filters = {}
 
+# Snapshots older than this are recomputed, which picks up changes made outside log_tool_life (e.g. engineer edits)
+TOOL_LIFE_REFRESH_SECONDS = 300
+
+# Results shared by all websockets, invalidated whenever a new tool life is logged
+tool_life_cache = SharedResultCache(ttl=TOOL_LIFE_REFRESH_SECONDS)
+
+# Broadcast channel log_tool_life publishes new records on
+TOOL_LIFE_CHANNEL = "tool_life"
+
+# Points per series before it gets condensed into day/week/month averages
+MAX_SERIES_POINTS = 100
+
 def define_machine_colors(machines):
     machine_colors = {}
     lines = {}
@@ -36,58 +54,86 @@ def define_machine_colors(machines):
 
     return machine_colors
 
-async def get_tool_life_graphs(db: Session, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
-                          selected_operations: Optional[list] = None, selected_products: Optional[list] = None) -> List[Dict]:
-    # Get all active tools
-    statement = select(Tool).where(Tool.active == True)
-    tools = db.exec(statement).all()
-    
-    graphs = []
-    
-    # Fetch ToolLife records for each tool and find the latest timestamp
-    tool_life_data = []
-    for tool in tools:
-        statement = select(ToolLife).where(ToolLife.tool_id == tool.id)
-        if start_date:
-            statement = statement.where(ToolLife.timestamp >= start_date)
-        if end_date:
-            statement = statement.where(ToolLife.timestamp <= end_date)
-        if selected_operations:
-            statement = statement.where(ToolLife.machine_id.in_(selected_operations))
-        if selected_products:
-            statement = (
-                statement
-                .join(Recipe, ToolLife.recipe_id == Recipe.id)
-                .where(Recipe.workpiece_id.in_(selected_products))
-            )
-        
-        tool_lifes = db.exec(statement).all()
-        if tool_lifes:
-            latest_timestamp = max(tool_life.timestamp for tool_life in tool_lifes)
-            tool_life_data.append((tool, latest_timestamp))
-    
-    # Sort tools by the latest ToolLife timestamp (newest first)
-    tool_life_data.sort(key=lambda x: x[1], reverse=True)
-    
-    # Create graph dictionaries in the sorted order
-    for tool, _ in tool_life_data:
-        graphs.append({
-            "id": f"tool_{tool.id}",
-            "type": "line",
-            "title": f"{tool.name} (#{tool.number})",
-            "width": 6,
-            "height": 2
-        })
-
-    return graphs
+def filter_tool_life_statement(statement, dashboard_filter: DashboardFilter, db: Session):
+    """Apply the dashboard date/operation/product filter to a statement selecting from ToolLife"""
+    for predicate in dashboard_filter.tool_life_predicates(db):
+        statement = statement.where(predicate)
+    return statement
+
+def query_tool_life_buckets(db: Session, dashboard_filter: DashboardFilter = DashboardFilter()) -> Dict:
+    """
+    Fetch the whole filtered tool life set in a single query and bucket it by tool, line/machine and channel.
+
+    The latest timestamp per tool is computed with a window function in the same query, so the result
+    feeds both the graph list (ordered newest first) and the chart series.
+
+    Returns:
+        Dict: {tool_id: {'name', 'number', 'latest_timestamp', 'machines': {"<line>_<machine>": {"Channel <n>": [points]}}}},
+              ordered by the latest tool life timestamp, newest first.
+    """
+    latest_timestamp = func.max(ToolLife.timestamp).over(partition_by=ToolLife.tool_id).label("latest_timestamp")
+    statement = (
+        select(ToolLife.tool_id, Tool.name, Tool.number, Line.name, Machine.name,
+               ToolLife.machine_channel, ToolLife.timestamp, ToolLife.reached_life, latest_timestamp)
+        .join(Tool, Tool.id == ToolLife.tool_id)
+        .join(Machine, Machine.id == ToolLife.machine_id)
+        .join(Line, Line.id == Machine.line_id)
+        .where(Tool.active == True)
+    )
+    statement = filter_tool_life_statement(statement, dashboard_filter, db)
+    statement = statement.order_by(latest_timestamp.desc(), ToolLife.tool_id, ToolLife.timestamp.asc())
+
+    buckets = {}
+    for tool_id, tool_name, tool_number, line_name, machine_name, channel, timestamp, reached_life, latest in db.exec(statement):
+        tool = buckets.get(tool_id)
+        if tool is None:
+            tool = buckets[tool_id] = {
+                'name': tool_name,
+                'number': tool_number,
+                'latest_timestamp': latest,
+                'machines': {}
+            }
+        channels = tool['machines'].setdefault(f"{line_name}_{machine_name}", {})
+        channels.setdefault(f"Channel {channel}", []).append({'timestamp': timestamp, 'reached_life': reached_life})
+
+    return buckets
+
+def build_tool_life_graphs(buckets: Dict) -> List[Dict]:
+    """Create the graph dictionaries in the order of the bucketed tool life set"""
+    return [{
+        "id": f"tool_{tool_id}",
+        "type": "line",
+        "title": f"{tool['name']} (#{tool['number']})",
+        "width": 6,
+        "height": 2
+    } for tool_id, tool in buckets.items()]
+
+def series_tail(points: List[Dict], window: Optional[str]) -> Dict:
+    """
+    Describe the last point of a series so later tool lifes can be merged into it.
+
+    For raw series the new point is simply appended, counting the points so the series is condensed once it
+    grows past MAX_SERIES_POINTS. For condensed series it is averaged into the last window bucket, which needs
+    the bucket start, record count and value sum of that bucket.
+    """
+    if window is None:
+        return {'window': None, 'count': len(points)}
+    bucket = window_start(points[-1]['timestamp'], window)
+    bucket_values = [point['reached_life'] for point in points if window_start(point['timestamp'], window) == bucket]
+    return {
+        'window': window,
+        'bucket': bucket.isoformat(),
+        'count': len(bucket_values),
+        'sum': sum(bucket_values),
+    }
 
-async def get_tool_life_data(db: Session, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
-                          selected_operations: Optional[list] = None, selected_products: Optional[list] = None) -> Dict:
-    # Get active tools with life records
-    statement = select(Tool).where(Tool.active == True)
-    tools = db.exec(statement).all()
+def build_tool_life_data(db: Session, buckets: Dict, tails: Optional[Dict] = None) -> Dict:
+    """
+    Create the chart options for every tool in the bucketed tool life set.
 
-    machines = db.exec(select(Machine).where(Machine.active == True)).all()
+    If a tails dict is given it is filled with {graph_id: {series_id: series_tail}} for incremental updates.
+    """
+    machines = db.exec(select(Machine).where(Machine.active == True).options(selectinload(Machine.line))).all()
     machines.sort(key=lambda x: x.name)
     machine_colors = define_machine_colors(machines)
     machine_map = {f"{machine.line.name}_{machine.name}": machine for machine in machines}
@@ -95,81 +141,90 @@ async def get_tool_life_data(db: Session, start_date: Optional[datetime] = None,
     lines = db.exec(select(Line)).all()
     line_patterns = {line.id: pattern for line, pattern in zip(lines, ['rect', 'circle', 'triangle', 'diamond', 'pin', 'arrow', 'roundRect'])}
 
-
     data = {}
-    for tool in tools:
-        # Build query with date filters
-        statement = select(ToolLife).where(ToolLife.tool_id == tool.id)
-        
-        if start_date:
-            statement = statement.where(ToolLife.timestamp >= start_date)
-        if end_date:
-            statement = statement.where(ToolLife.timestamp <= end_date)
-
-        if selected_operations:
-            statement = statement.where(ToolLife.machine_id.in_(selected_operations))
-        if selected_products:
-            statement = (
-                statement
-                .join(Recipe, ToolLife.recipe_id == Recipe.id)
-                .where(Recipe.workpiece_id.in_(selected_products))
-            )
-            
-        statement = statement.order_by(ToolLife.timestamp.asc())
-        records = list(db.exec(statement))
-        
-        # Only include tools that have records
-        if records:
-            ordered_records = {}
-            # sort by machine
-            for r in records:
-                key = f"{r.machine.line.name}_{r.machine.name}"
-                if key not in ordered_records:
-                    ordered_records[key] = {}
-                if f"Channel {r.machine_channel}" not in ordered_records[key]:
-                    ordered_records[key][f"Channel {r.machine_channel}"] = []
-                ordered_records[key][f"Channel {r.machine_channel}"].append(r)
-
-            series = []
-            decal_symbols = set()
-
-            for machine_key in ordered_records:
-                machine_name = machine_key
-                machine_obj = machine_map.get(machine_name)
-                for channel in ordered_records[machine_key]:
-                    condensed_data, _ = get_condensed_data([{'timestamp': tool_life.timestamp, 'reached_life': tool_life.reached_life} 
-                                                         for tool_life in ordered_records[machine_key][channel]])
-                    decal_symbols.add(line_patterns.get(machine_obj.line_id, 'rect') if machine_obj else 'rect')
-                    series.append({
-                        "type": "line",
-                        "data": condensed_data,
-                        "lineStyle": { "color": machine_colors[machine_key][0] },
-                        "areaStyle": { 
-                            "color": machine_colors[machine_key][1],
-                        },
-                    })
-
-            data[f"tool_{tool.id}"] = {
-                "tooltip": { "trigger": "axis" },
-                "xAxis": {"type": "time"},
-                "yAxis": { "type": "value" },
-                "series": series,
-                "aria": {
-                    "enabled": True,
-                    "decal": {
-                        "show": True,
-                        "decals": {
-                            "symbol": list(decal_symbols),
-                            "dashArrayX": 20,
-                            "dashArrayY": 20,
-                            "color": "rgba(0, 0, 0, 0.4)",
-                        }
+    for tool_id, tool in buckets.items():
+        series = []
+        decal_symbols = set()
+
+        for machine_key, channels in tool['machines'].items():
+            machine_obj = machine_map.get(machine_key)
+            for channel, points in channels.items():
+                condensed_data, window = get_condensed_data(points, MAX_SERIES_POINTS)
+                decal_symbols.add(line_patterns.get(machine_obj.line_id, 'rect') if machine_obj else 'rect')
+                series_id = f"{machine_key}|{channel}"
+                if tails is not None:
+                    tails.setdefault(f"tool_{tool_id}", {})[series_id] = series_tail(
+                        points, window if len(points) > MAX_SERIES_POINTS else None)
+                series.append({
+                    "id": series_id,
+                    "type": "line",
+                    "data": condensed_data,
+                    "lineStyle": { "color": machine_colors[machine_key][0] },
+                    "areaStyle": { 
+                        "color": machine_colors[machine_key][1],
+                    },
+                })
+
+        data[f"tool_{tool_id}"] = {
+            "tooltip": { "trigger": "axis" },
+            "xAxis": {"type": "time"},
+            "yAxis": { "type": "value" },
+            "series": series,
+            "aria": {
+                "enabled": True,
+                "decal": {
+                    "show": True,
+                    "decals": {
+                        "symbol": list(decal_symbols),
+                        "dashArrayX": 20,
+                        "dashArrayY": 20,
+                        "color": "rgba(0, 0, 0, 0.4)",
                     }
                 }
             }
-    
+        }
+
     return data
 
+async def get_tool_life_graphs(db: Session, dashboard_filter: DashboardFilter = DashboardFilter()) -> List[Dict]:
+    # Active tools with life records, sorted by their latest ToolLife timestamp (newest first)
+    latest_timestamp = func.max(ToolLife.timestamp).label("latest_timestamp")
+    statement = (
+        select(Tool.id, Tool.name, Tool.number, latest_timestamp)
+        .select_from(ToolLife)
+        .join(Tool, Tool.id == ToolLife.tool_id)
+        .where(Tool.active == True)
+    )
+    statement = filter_tool_life_statement(statement, dashboard_filter, db)
+    statement = statement.group_by(Tool.id, Tool.name, Tool.number).order_by(latest_timestamp.desc())
+
+    return build_tool_life_graphs({
+        tool_id: {'name': name, 'number': number, 'latest_timestamp': latest}
+        for tool_id, name, number, latest in db.exec(statement)
+    })
+
+async def get_tool_life_data(db: Session, dashboard_filter: DashboardFilter = DashboardFilter()) -> Dict:
+    buckets = query_tool_life_buckets(db, dashboard_filter)
+    return build_tool_life_data(db, buckets)
+
+def build_tool_life_snapshot(dashboard_filter: DashboardFilter) -> tuple:
+    """Serialized snapshot and series tails for a dashboard filter, blocking"""
+    tails = {}
+    with Session(engine) as db:
+        # Get filtered graphs and data from a single pass over the tool life set
+        buckets = query_tool_life_buckets(db, dashboard_filter)
+        response = {
+            "op": "snapshot",
+            "graphs": build_tool_life_graphs(buckets),
+            "data": build_tool_life_data(db, buckets, tails)
+        }
+    return json.dumps(response), tails
+
+async def compute_tool_life_dashboard(dashboard_filter: DashboardFilter) -> tuple:
+    """Compute the serialized snapshot and the series tails for a dashboard filter"""
+    # Queries and condensation run in a worker thread, the event loop keeps serving kiosks and websockets
+    return await asyncio.to_thread(build_tool_life_snapshot, dashboard_filter)
+
 async def send_tool_data(websocket: WebSocket, ws_id: int):
     global websocket_filters
     
@@ -177,10 +232,7 @@ async def send_tool_data(websocket: WebSocket, ws_id: int):
     if ws_id not in websocket_filters:
         return
     
-    latest_start_date = websocket_filters[ws_id].get("latest_start_date")
-    latest_end_date = websocket_filters[ws_id].get("latest_end_date")
-    selected_operations = websocket_filters[ws_id].get("selected_operations")
-    selected_products = websocket_filters[ws_id].get("selected_products")
+    dashboard_filter = websocket_filters[ws_id].get("filter")
     last_filter_update = websocket_filters[ws_id].get("last_filter_update")
 
     await asyncio.sleep(1)  # Wait for any additional filters to be sent
@@ -190,18 +242,21 @@ async def send_tool_data(websocket: WebSocket, ws_id: int):
         return
     # Filters have not been updated, proceed with sending data
 
+    # Tool lifes logged from here on may be missing from the snapshot, send_tool_life_update flags them
+    websocket_filters[ws_id]['missed'] = False
+
     try:
-        with Session(engine) as db:
-            # Get filtered graphs and data
-            graphs = await get_tool_life_graphs(db, latest_start_date, latest_end_date, selected_operations, selected_products)
-            data = await get_tool_life_data(db, latest_start_date, latest_end_date, selected_operations, selected_products)
-
-            # Send both graphs and data
-            response = {
-                "graphs": graphs,
-                "data": data
-            }
-            await websocket.send_text(json.dumps(response))
+        # Clients with identical filters share one computation per refresh
+        response, tails = await tool_life_cache.get(dashboard_filter, lambda: compute_tool_life_dashboard(dashboard_filter))
+        if ws_id not in websocket_filters or last_filter_update != websocket_filters[ws_id].get("last_filter_update"):
+            return
+        await websocket.send_text(response)
+        if websocket_filters[ws_id]['missed']:
+            # Tool lifes arrived while computing, the cache was invalidated for them so the next snapshot has them
+            asyncio.create_task(send_tool_data(websocket, ws_id))
+            return
+        # Each client merges the following tool lifes into its own copy of the series tails
+        websocket_filters[ws_id]['tails'] = copy.deepcopy(tails)
 
     except RuntimeError as e:
         if "close message has been sent" in str(e):
@@ -210,24 +265,62 @@ async def send_tool_data(websocket: WebSocket, ws_id: int):
     except Exception as e:
         print(f"Error in send_tool_data for WebSocket {ws_id}: {e}")
 
-async def periodic_data_sender(websocket: WebSocket, ws_id: int):
-    """Send data periodically every X seconds"""
-    while True:
-        try:
-            # Check if websocket still exists
-            if ws_id not in websocket_filters:
-                break
-                
-            await asyncio.sleep(30)  # Wait 30 seconds between updates
-            
-            # Check again before sending
-            if ws_id in websocket_filters:
-                await send_tool_data(websocket, ws_id)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print(f"Error in periodic_data_sender for WebSocket {ws_id}: {e}")
-            break
+async def send_tool_life_update(websocket: WebSocket, ws_id: int, record: Dict):
+    """Send a single new tool life as a delta, or a full snapshot if its graph/series isn't shown yet"""
+    filters = websocket_filters.get(ws_id)
+    if filters is None or not filters['filter'].matches_tool_life(record):
+        return
+    if filters.get('tails') is None:
+        # A snapshot is being computed and may have been queried before this record, send another one after it
+        filters['missed'] = True
+        return
+
+    graph_id = f"tool_{record['tool_id']}"
+    series_id = f"{record['line']}_{record['machine']}|Channel {record['machine_channel']}"
+    tail = filters['tails'].get(graph_id, {}).get(series_id)
+    if tail is None:
+        # New graph or series, the client needs the full picture. Deltas are paused until it is sent,
+        # the snapshot is computed after this record was committed and already contains them.
+        filters['tails'] = None
+        asyncio.create_task(send_tool_data(websocket, ws_id))
+        return
+
+    timestamp = datetime.fromisoformat(record['timestamp'])
+    if tail['window'] is None:
+        tail['count'] += 1
+        if tail['count'] > MAX_SERIES_POINTS:
+            # The series has to be condensed from now on, which needs the full picture again
+            filters['tails'] = None
+            asyncio.create_task(send_tool_data(websocket, ws_id))
+            return
+        point = [timestamp.isoformat(), record['reached_life']]
+    else:
+        bucket = window_start(timestamp, tail['window']).isoformat()
+        if bucket != tail['bucket']:
+            tail.update({'bucket': bucket, 'count': 0, 'sum': 0})
+        tail['count'] += 1
+        tail['sum'] += record['reached_life']
+        point = [bucket, tail['sum'] / tail['count']]
+
+    await websocket.send_text(json.dumps({
+        "op": "upsert",
+        "graph_id": graph_id,
+        "series_id": series_id,
+        "point": point
+    }))
+
+async def tool_life_update_sender(websocket: WebSocket, ws_id: int):
+    """Forward tool lifes published by log_tool_life to the websocket as delta messages"""
+    try:
+        async with broadcast.subscribe(TOOL_LIFE_CHANNEL) as subscriber:
+            async for event in subscriber:
+                if ws_id not in websocket_filters:
+                    break
+                await send_tool_life_update(websocket, ws_id, json.loads(event.message))
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        print(f"Error in tool_life_update_sender for WebSocket {ws_id}: {e}")
 
 @router.get("/toolLifes")
 async def tools(request: Request, db: Session = Depends(get_session)):
@@ -241,13 +334,15 @@ async def tools(request: Request, db: Session = Depends(get_session)):
         }
     )
 
+@router.get("/api/toolLifes/cache")
+async def get_tool_life_cache_stats():
+    """Hit/miss counters of the shared tool life websocket cache"""
+    return tool_life_cache.stats()
+
 @router.get("/api/toolLifes/{tool_id}/details")
 async def get_tool_details(
     tool_id: int,
-    start_date: Optional[datetime],
-    end_date: str = None, 
-    selected_operations: str = '',
-    selected_products: str = '',
+    dashboard_filter: DashboardFilter = Depends(get_dashboard_filter),
     db: Session = Depends(get_session)
 ):
     """Get detailed information about a specific tool"""
@@ -256,30 +351,15 @@ async def get_tool_details(
     if not tool:
         raise HTTPException(status_code=404, detail="Tool not found")
     
-    # Convert date strings to datetime objects and make them timezone-naive
-    end_date = datetime.fromisoformat(end_date).replace(tzinfo=None) if end_date and end_date != 'null' else datetime.now().replace(tzinfo=None)
-
-    selected_operations = json.loads(selected_operations) if selected_operations else []
-    selected_products = json.loads(selected_products) if selected_products else []
-    # Convert selected operations and products to lists of integers
-    selected_operations = [int(op) for op in selected_operations]
-    selected_products = [int(product) for product in selected_products]
-    
+    # An open end date runs up to now
+    if not dashboard_filter.end_date:
+        dashboard_filter = dashboard_filter.model_copy(update={'end_date': datetime.now()})
+    start_date, end_date = dashboard_filter.start_date, dashboard_filter.end_date
+    selected_products = dashboard_filter.products
+
     # Get tool life records with date filtering
     statement = select(ToolLife).where(ToolLife.tool_id == tool_id)
-    if start_date:
-        start_date = start_date.replace(tzinfo=None)
-        statement = statement.where(ToolLife.timestamp >= start_date)
-    if end_date:
-        statement = statement.where(ToolLife.timestamp <= end_date)
-    if selected_operations:
-        statement = statement.where(ToolLife.machine_id.in_(selected_operations))
-    if selected_products:
-        statement = (
-            statement
-            .join(Recipe, ToolLife.recipe_id == Recipe.id)
-            .where(Recipe.workpiece_id.in_(selected_products))
-        )
+    statement = filter_tool_life_statement(statement, dashboard_filter, db)
     statement = statement.order_by(ToolLife.timestamp.asc())
     tool_life_records = db.exec(statement).all()
 
@@ -570,15 +650,14 @@ async def websocket_endpoint(websocket: WebSocket):
     ws_id = id(websocket)
     
     websocket_filters[ws_id] = {
-        'latest_start_date': datetime.strptime("2020-01-01", "%Y-%m-%d"),
-        'latest_end_date': datetime.today(),
-        'selected_operations': [],
-        'selected_products': [],
+        # open ended, so all clients on the default filter share one cache entry
+        'filter': DashboardFilter(start_date=datetime(2020, 1, 1)),
         'last_filter_update': datetime.fromisoformat("2020-01-01")
     }
 
-    # Start the periodic data sending task
-    data_sender_task = asyncio.create_task(periodic_data_sender(websocket, ws_id))
+    # Send the initial snapshot, then only deltas until the filters change
+    asyncio.create_task(send_tool_data(websocket, ws_id))
+    data_sender_task = asyncio.create_task(tool_life_update_sender(websocket, ws_id))
 
     try:
         while True:
@@ -587,11 +666,19 @@ async def websocket_endpoint(websocket: WebSocket):
                 message = await websocket.receive_text()
                 filters = json.loads(message)
 
-                websocket_filters[ws_id]['latest_start_date'] = datetime.fromisoformat(filters['startDate']) if filters.get('startDate') and filters['startDate'] != 'null' else None
-                websocket_filters[ws_id]['latest_end_date'] = datetime.fromisoformat(filters['endDate']) if filters.get('endDate') and filters['endDate'] != 'null' else None
-                websocket_filters[ws_id]['selected_operations'] = [int(op) for op in filters.get('selectedOperations', [])]
-                websocket_filters[ws_id]['selected_products'] = [int(product) for product in filters.get('selectedProducts', [])]
+                try:
+                    dashboard_filter = DashboardFilter(
+                        start_date=filters.get('startDate'),
+                        end_date=filters.get('endDate'),
+                        operations=filters.get('selectedOperations', []),
+                        products=filters.get('selectedProducts', []),
+                    )
+                except ValidationError as e:
+                    print(f"Invalid filters from WebSocket {ws_id}: {e}")
+                    continue
+                websocket_filters[ws_id]['filter'] = dashboard_filter
                 websocket_filters[ws_id]['last_filter_update'] = datetime.now()
+                websocket_filters[ws_id]['tails'] = None  # no deltas until the snapshot for the new filters is sent
 
                 asyncio.create_task(send_tool_data(websocket, ws_id))
 
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, Request, Query
-from sqlmodel import Session, select, and_, exists, desc, asc, func
-from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select, exists, desc, asc, func, or_
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
 from typing import Dict
-from datetime import datetime
+from datetime import datetime, timedelta
+from collections import defaultdict
 from math import ceil
 import dotsi
 
@@ -10,10 +11,11 @@ from app.templates.jinja_functions import templates
 from app.database_config import get_session
 from app.models import (Tool, RecipeTool, Recipe, ToolType, 
                         ToolConsumption, Workpiece, Machine, ChangeOver,
-                        ToolPosition, Line, OrderDelivery, ToolLife,
-                        OrderCompletion)
+                        ToolPosition, Line, OrderDelivery, ToolOrder, ToolLife,
+                        OrderCompletion, DailyFact)
 from . import tool_lifes_cards as tc
-from .utils import get_condensed_data
+from .utils import query_condensed_data
+from .filters import DashboardFilter, get_dated_dashboard_filter
 
 
 router = APIRouter(
@@ -21,9 +23,101 @@ router = APIRouter(
     tags=["Tools"],
 )
 
+def load_cpu_facts(db: Session, position_ids: list, tool_ids: list, start_date, end_date, from_cube: bool = False) -> dict:
+    """
+    Load what the cost per piece is computed from for the given tool positions and tools in three set-based queries.
+
+    With from_cube the consumption and tool life totals are summed from the daily fact cube instead of the fact tables.
+
+    Returns:
+        dict: {'consumption': {tool_id: (records, quantity, first date, last date)},
+               'lead_times': {tool_id: (weeks, order size)} of the longest of the latest 10 deliveries,
+               'position_lifes': {position_id: (count, sum)}, 'tool_lifes': {tool_id: (count, sum)}}
+    """
+    if from_cube:
+        consumption_statement = (
+            select(DailyFact.tool_id,
+                   func.sum(DailyFact.consumption_records),
+                   func.sum(DailyFact.consumption_quantity),
+                   func.min(DailyFact.day),
+                   func.max(DailyFact.day))
+            .where(DailyFact.tool_id.in_(tool_ids))
+            .where(DailyFact.consumption_records > 0)
+            .where(DailyFact.day >= start_date)
+            .where(DailyFact.day <= end_date)
+            .group_by(DailyFact.tool_id)
+        )
+        life_statement = (
+            select(DailyFact.tool_id, DailyFact.tool_position_id, func.sum(DailyFact.life_count), func.sum(DailyFact.life_sum))
+            .where(or_(DailyFact.tool_position_id.in_(position_ids), DailyFact.tool_id.in_(tool_ids)))
+            .where(DailyFact.life_count > 0)
+            .where(DailyFact.day >= start_date)
+            .where(DailyFact.day <= end_date)
+            .group_by(DailyFact.tool_id, DailyFact.tool_position_id)
+        )
+    else:
+        # The whole end date included, like the days of the cube
+        consumption_statement = (
+            select(ToolConsumption.tool_id,
+                   func.count(),
+                   func.sum(ToolConsumption.quantity),
+                   func.min(func.date(ToolConsumption.datetime)),
+                   func.max(func.date(ToolConsumption.datetime)))
+            .where(ToolConsumption.tool_id.in_(tool_ids))
+            .where(ToolConsumption.datetime >= start_date)
+            .where(ToolConsumption.datetime < end_date + timedelta(days=1))
+            .group_by(ToolConsumption.tool_id)
+        )
+        life_statement = (
+            select(ToolLife.tool_id, ToolLife.tool_position_id, func.count(), func.sum(ToolLife.reached_life))
+            .where(or_(ToolLife.tool_position_id.in_(position_ids), ToolLife.tool_id.in_(tool_ids)))
+            .where(ToolLife.timestamp >= start_date)
+            .where(ToolLife.timestamp < end_date + timedelta(days=1))
+            .group_by(ToolLife.tool_id, ToolLife.tool_position_id)
+        )
+
+    consumption = {
+        tool_id: (records, quantity, first, last)
+        for tool_id, records, quantity, first, last in db.exec(consumption_statement)
+    }
+
+    # Latest 10 deliveries per tool, only tools with more than 5 get a measured lead time
+    recency = func.row_number().over(partition_by=ToolOrder.tool_id, order_by=desc(OrderDelivery.delivery_date))
+    latest = (
+        select(ToolOrder.tool_id, OrderDelivery.delivery_date, ToolOrder.order_date, OrderDelivery.quantity,
+               recency.label('recency'))
+        .join(ToolOrder, ToolOrder.id == OrderDelivery.order_id)
+        .where(ToolOrder.tool_id.in_(tool_ids))
+        .subquery()
+    )
+    deliveries = defaultdict(list)
+    for tool_id, delivery_date, order_date, quantity in db.exec(
+        select(latest.c.tool_id, latest.c.delivery_date, latest.c.order_date, latest.c.quantity)
+        .where(latest.c.recency <= 10)
+        .order_by(latest.c.tool_id, latest.c.recency)
+    ):
+        deliveries[tool_id].append((ceil((delivery_date - order_date).days / 7), quantity))
+    lead_times = {tool_id: max(durations, key=lambda x: x[0])
+                  for tool_id, durations in deliveries.items() if len(durations) > 5}
+
+    # Tool life count and sum per position and tool
+    position_lifes, tool_lifes = defaultdict(lambda: (0, 0)), defaultdict(lambda: (0, 0))
+    for tool_id, position_id, count, total in db.exec(life_statement):
+        if position_id is not None:
+            position_count, position_total = position_lifes[position_id]
+            position_lifes[position_id] = (position_count + count, position_total + total)
+        tool_count, tool_total = tool_lifes[tool_id]
+        tool_lifes[tool_id] = (tool_count + count, tool_total + total)
+
+    return {
+        'consumption': consumption,
+        'lead_times': lead_times,
+        'position_lifes': position_lifes,
+        'tool_lifes': tool_lifes,
+    }
+
 def aggregate_tool_metrics(aggregated: dict, line: Line, product: Workpiece, machine: Machine, 
-                           tool_position: ToolPosition, tool: Tool, start_date: datetime, 
-                           end_date: datetime, db: Session) -> dict:
+                           tool_position: ToolPosition, tool: Tool, facts: dict) -> dict:
     """
     Helper function to compute and aggregate tool metrics.
     
@@ -34,55 +128,30 @@ def aggregate_tool_metrics(aggregated: dict, line: Line, product: Workpiece, mac
         machine: Machine instance (or None for standalone tools).
         tool_position: ToolPosition instance if available; if None, aggregation falls back to tool-level lifespans.
         tool: The Tool instance.
-        start_date (datetime): Start date for filtering.
-        end_date (datetime): End date for filtering.
-        db (Session): The database session.
+        facts (dict): Consumption, lead time and tool life statistics from load_cpu_facts.
     
     Returns:
         dict: Updated aggregated dictionary.
     """
-    # Fetch consumption records for the tool in the given date range.
-    consumptions = db.exec(
-        select(ToolConsumption)
-        .where(ToolConsumption.tool_id == tool.id)
-        .where(ToolConsumption.datetime >= start_date)
-        .where(ToolConsumption.datetime <= end_date)
-    ).all()
-    
-    if consumptions:
-        first_date = min(c.datetime.date() for c in consumptions)
-        last_date = max(c.datetime.date() for c in consumptions)
-        total_consumed_quantity = sum(c.quantity for c in consumptions)
+    _, total_consumed_quantity, first_date, last_date = facts['consumption'].get(tool.id, (0, 0, None, None))
+    if total_consumed_quantity:
         weeks = ((last_date - first_date).days // 7) + 1
         weekly = total_consumed_quantity / weeks if weeks > 0 else total_consumed_quantity
     else:
-        total_consumed_quantity = 0
         weekly = 0
 
-    # Calculate order delivery metrics.
-    tool_orders = tool.tool_orders
-    order_deliveries = db.exec(
-        select(OrderDelivery)
-        .where(OrderDelivery.order_id.in_([o.id for o in tool_orders]))
-        .order_by(desc(OrderDelivery.delivery_date))
-        .limit(10)
-    ).all()
-    if order_deliveries and len(order_deliveries) > 5:
-        delivery_durations = [(ceil((od.delivery_date - od.order.order_date).days / 7), od.quantity) for od in order_deliveries]
-        longest_delivery_duration = max(delivery_durations, key=lambda x: x[0])
-    else:
-        longest_delivery_duration = (14, 0)
+    longest_delivery_duration = facts['lead_times'].get(tool.id, (14, 0))
     
     # Determine the applicable tool lifes.
     if tool_position is not None:
-        lifes = [tl for tl in tool_position.tool_lifes if tl.timestamp.date() >= start_date and tl.timestamp.date() <= end_date]
+        life_count, life_total = facts['position_lifes'][tool_position.id]
     else:
-        lifes = [tl for tl in tool.tool_lifes if tl.timestamp.date() >= start_date and tl.timestamp.date() <= end_date]
+        life_count, life_total = facts['tool_lifes'][tool.id]
     
-    percent_consumptions_recorded = round(100 * (len(lifes) / tool.max_uses) / total_consumed_quantity) if total_consumed_quantity else 100
+    percent_consumptions_recorded = round(100 * (life_count / tool.max_uses) / total_consumed_quantity) if total_consumed_quantity else 100
     
-    if lifes:
-        reported_avg_tool_life = sum(t.reached_life for t in lifes) / len(lifes) if len(lifes) > 0 else 0
+    if life_count:
+        reported_avg_tool_life = life_total / life_count
         if tool_position is not None and hasattr(tool_position, 'tool_count'):
             cost_per_piece = (tool_position.tool_count * float(tool.price) / tool.max_uses) / reported_avg_tool_life if reported_avg_tool_life > 0 else 0
         else:
@@ -108,7 +177,7 @@ def aggregate_tool_metrics(aggregated: dict, line: Line, product: Workpiece, mac
         'cost_per_piece': round(cost_per_piece, 2),
         'average_life': round(reported_avg_tool_life),
         'percent_consumptions_recorded': percent_consumptions_recorded,
-        'total_records': len(lifes),
+        'total_records': life_count,
     }
     
     if line is not None and product is not None and machine is not None:
@@ -164,10 +233,7 @@ async def get_tool_template(request: Request):
 # Endpoint: Retrieve unique tool data and consumption metrics
 @router.get("/api/unique_tools")
 async def get_unique_tool_data(
-    selected_operations: str = Query(''),
-    selected_products: str = Query(''),
-    start_date: datetime = Query(''),
-    end_date: datetime = Query(''),
+    dashboard_filter: DashboardFilter = Depends(get_dated_dashboard_filter),
     db: Session = Depends(get_session),
 ) -> Dict:
     """
@@ -177,10 +243,7 @@ async def get_unique_tool_data(
     data for tools filtered by selected operations, products, and a date range.
 
     Parameters:
-        selected_operations (str): A string representing a list of operation IDs.
-        selected_products (str): A string representing a list of product IDs.
-        start_date (datetime): Start date for filtering consumption data.
-        end_date (datetime): End date for filtering consumption data.
+        dashboard_filter (DashboardFilter): Selected operations, products and the date range for filtering consumption data.
         db (Session): Database session dependency.
 
     Returns:
@@ -188,75 +251,61 @@ async def get_unique_tool_data(
               manufacturer, line, weekly consumption, inventory status, order lead time, stop order status,
               and price.
     """
-    # Convert query string lists to Python objects
-    selected_operations = eval(selected_operations)
-    selected_products = eval(selected_products)
-
-    start_date = start_date.date()
-    end_date = end_date.date()
-
-    # Base statement to select active tools
-    statement = select(Tool).where(Tool.active == True)
-
-    # Convert product and operation IDs to integers and filter tools based on related recipes
-    selected_products = [int(x) for x in selected_products]
-    selected_operations = [int(x) for x in selected_operations]
-    statement = statement.where(
-        Tool.id.in_(
-            select(RecipeTool.tool_id).where(
-                RecipeTool.recipe_id.in_(
-                    select(Recipe.id).where(and_(
-                        Recipe.workpiece_id.in_(selected_products),
-                        Recipe.machine_id.in_(selected_operations)
-                    ))
-                )
-            )
+    # Tools are only listed for a selection of both operations and products
+    if not (dashboard_filter.operations and dashboard_filter.products):
+        return {}
+
+    start_date = dashboard_filter.start_date.date()
+    end_date = dashboard_filter.end_date.date()
+
+    # Active tools used by the recipes of the selection, with the dimension rows they are shown with
+    tool_ids = dashboard_filter.tool_ids(db)
+    statement = (
+        select(Tool)
+        .where(Tool.active == True)
+        .where(Tool.id.in_(tool_ids))
+        .join(ToolType, ToolType.id == Tool.tool_type_id)
+        .options(
+            contains_eager(Tool.tool_type),
+            joinedload(Tool.manufacturer),
+            selectinload(Tool.recipes).selectinload(Recipe.workpiece).selectinload(Workpiece.lines),
         )
+        .order_by(ToolType.name, Tool.name)
     )
-    # Join with ToolType and order the result for clarity
-    statement = statement.join(ToolType, ToolType.id == Tool.tool_type_id).order_by(ToolType.name, Tool.name)
-
-    db_tools = db.exec(statement).all()
+    db_tools = db.exec(statement).unique().all()
+
+    # Consumption per tool in the date range: total quantity and first/last consumption
+    consumptions = {
+        tool_id: (total, first.date(), last.date())
+        for tool_id, total, first, last in db.exec(
+            select(ToolConsumption.tool_id,
+                   func.sum(ToolConsumption.quantity),
+                   func.min(ToolConsumption.datetime),
+                   func.max(ToolConsumption.datetime))
+            .where(ToolConsumption.tool_id.in_(tool_ids))
+            .where(ToolConsumption.datetime >= start_date)
+            .where(ToolConsumption.datetime <= end_date)
+            .group_by(ToolConsumption.tool_id)
+        )
+    }
 
-    # # Retrieve tool consumption records within the date range for selected tools
-    # statement = select(ToolConsumption).where(ToolConsumption.tool_id.in_([tool.id for tool in db_tools]))
-    # statement = statement.where(ToolConsumption.datetime >= start_date)
-    # statement = statement.where(ToolConsumption.datetime <= end_date)
+    # Average reached life per tool in the date range
+    average_lifes = dict(db.exec(
+        select(ToolLife.tool_id, func.avg(ToolLife.reached_life))
+        .where(ToolLife.tool_id.in_(tool_ids))
+        .where(ToolLife.timestamp >= start_date)
+        .where(ToolLife.timestamp <= end_date)
+        .group_by(ToolLife.tool_id)
+    ).all())
 
     tools = {}
     # For unique tools endpoint, we simply build a dictionary keyed by tool.id
     for tool in db_tools:
-        # Calculate consumption metrics similar to unique_tools endpoint logic
-        first_consumption_date = end_date
-        last_consumption_date = start_date
-        total_consumption = 0
-        tool_consumptions = db.exec(
-            select(ToolConsumption)
-            .where(ToolConsumption.tool_id == tool.id)
-            .where(ToolConsumption.datetime >= start_date)
-            .where(ToolConsumption.datetime <= end_date)
-        ).all()
-        for consumption in tool_consumptions:
-            if consumption.datetime.date() <= first_consumption_date:
-                first_consumption_date = consumption.datetime.date()
-            if consumption.datetime.date() >= last_consumption_date:
-                last_consumption_date = consumption.datetime.date()
-            total_consumption += consumption.quantity
-        weeks = (last_consumption_date - first_consumption_date).days // 7 + 1 if first_consumption_date != end_date else 1
+        total_consumption, first_consumption_date, last_consumption_date = consumptions.get(tool.id, (0, end_date, end_date))
+        weeks = (last_consumption_date - first_consumption_date).days // 7 + 1
         weekly_consumption = total_consumption / weeks if weeks > 0 else total_consumption
 
-        # Calculate average life
-        tool_lifes = db.exec(
-            select(ToolLife)
-            .where(ToolLife.tool_id == tool.id)
-            .where(ToolLife.timestamp >= start_date)
-            .where(ToolLife.timestamp <= end_date)
-        ).all()
-
-        if tool_lifes:
-            avg_life = round(sum(t.reached_life for t in tool_lifes) / len(tool_lifes) if len(tool_lifes) > 0 else 0)
-        else:
-            avg_life = 0
+        avg_life = round(float(average_lifes.get(tool.id) or 0))
 
         tool_dict = {
             'id': tool.id,
@@ -276,58 +325,27 @@ async def get_unique_tool_data(
     
     return tools
 
-# Endpoint: Get CPU and tool cost metrics for recipes and standalone tools
-@router.get("/api/cpu")
-async def get_cpu(
-    selected_operations: str = Query(''),
-    selected_products: str = Query(''),
-    start_date: datetime = Query(''),
-    end_date: datetime = Query(''),
-    db: Session = Depends(get_session),
-) -> Dict:
-    """
-    Retrieve CPU related data for recipes and standalone tools, including tool positions and cost metrics.
-
-    This endpoint collects recipe data for active recipes that experienced a changeover within
-    the specified date range and calculates consumption and cost metrics for tools. It also includes
-    tools that are not part of any recipe but have consumption records in the given time frame.
-
-    Parameters:
-        selected_operations (str): A string representing a list of operation IDs.
-        selected_products (str): A string representing a list of product IDs.
-        start_date (datetime): Start date for filtering recipes and consumptions.
-        end_date (datetime): End date for filtering recipes and consumptions.
-        db (Session): Database session dependency.
-
-    Returns:
-        Dict: A nested dictionary structure organizing tool data and cost metrics by production line,
-              product, and operation for recipe-based tools, and a separate section for standalone tools.
-    """
-    # Convert query parameters.
-    selected_operations = eval(selected_operations)
-    selected_products = eval(selected_products)
-    selected_products = [int(x) for x in selected_products]
-    selected_operations = [int(x) for x in selected_operations]
-
-    start_date = start_date.date()
-    end_date = end_date.date()
+def compute_cpu(dashboard_filter: DashboardFilter, db: Session, from_cube: bool = False) -> Dict:
+    """Cost per piece rollup of get_cpu, with from_cube the totals are summed from the daily fact cube"""
+    start_date = dashboard_filter.start_date.date()
+    end_date = dashboard_filter.end_date.date()
 
     aggregated = {}
 
     # Process recipe-based tools.
     statement = select(Recipe).where(Recipe.active == True)
-    if selected_operations:
-        statement = statement.where(Recipe.machine_id.in_(selected_operations))
-    if selected_products:
-        statement = statement.where(Recipe.workpiece_id.in_(selected_products))
+    statement = statement.where(dashboard_filter.recipe_predicate(Recipe.id, db))
     statement = statement.where(exists()
                                 .where(Recipe.id == ChangeOver.recipe_id)
                                 .where(ChangeOver.timestamps >= start_date)
                                 .where(ChangeOver.timestamps <= end_date))
     statement = statement.options(
-                    selectinload(Recipe.machine),
+                    selectinload(Recipe.machine).selectinload(Machine.line),
+                    selectinload(Recipe.workpiece),
                     selectinload(Recipe.tool_positions).options(
-                        selectinload(ToolPosition.tool)))
+                        selectinload(ToolPosition.tool).options(
+                            selectinload(Tool.tool_type),
+                            selectinload(Tool.manufacturer))))
     statement = (statement
                  .join(Machine, Machine.id == Recipe.machine_id)
                  .join(Line, Line.id == Machine.line_id)
@@ -336,34 +354,34 @@ async def get_cpu(
 
     db_recipes = db.exec(statement).all()
 
-    for recipe in db_recipes:
-        # For each recipe, process each tool_position.
-        for tool_position in recipe.tool_positions:
-            # Call the helper to update the aggregated dictionary.
-            aggregated = aggregate_tool_metrics(aggregated, recipe.machine.line, recipe.workpiece, recipe.machine, tool_position, tool_position.tool, start_date, end_date, db)
-
-    # Process standalone tools (tools without any associated recipes).
-    standalone_statement = select(Tool).where(Tool.active == True)
-    # Exclude tools that are already processed through recipes.
-    standalone_tools = []
-    all_recipe_tool_ids = {tool_id for tool_id in db.exec(
-        select(RecipeTool.tool_id)
-    ).all()}
-    for tool in db.exec(standalone_statement).all():
-        if tool.id not in all_recipe_tool_ids:
-            # Check if the tool has consumption records in the given time frame.
-            tool_consumptions = db.exec(
-                select(ToolConsumption)
-                .where(ToolConsumption.tool_id == tool.id)
-                .where(ToolConsumption.datetime >= start_date)
-                .where(ToolConsumption.datetime <= end_date)
-            ).all()
-            if tool_consumptions:
-                standalone_tools.append(tool)
-    
-    # For standalone tools, add them under the "Standalone Tools" key in aggregated.
-    for tool in standalone_tools:
-        aggregated = aggregate_tool_metrics(aggregated, None, None, None, None, tool, start_date, end_date, db)
+    # Standalone tool candidates: active tools without any associated recipes.
+    all_recipe_tool_ids = DashboardFilter().tool_ids(db)
+    candidates = db.exec(
+        select(Tool)
+        .where(Tool.active == True)
+        .where(Tool.id.not_in(all_recipe_tool_ids))
+        .options(selectinload(Tool.tool_type), selectinload(Tool.manufacturer))
+    ).all()
+
+    # Consumption, lead times and lifes of all positions and tools at once
+    positions = [(recipe, tool_position) for recipe in db_recipes for tool_position in recipe.tool_positions]
+    facts = load_cpu_facts(
+        db,
+        [tool_position.id for _, tool_position in positions],
+        list({tool_position.tool_id for _, tool_position in positions} | {tool.id for tool in candidates}),
+        start_date,
+        end_date,
+        from_cube,
+    )
+
+    for recipe, tool_position in positions:
+        # Call the helper to update the aggregated dictionary.
+        aggregated = aggregate_tool_metrics(aggregated, recipe.machine.line, recipe.workpiece, recipe.machine, tool_position, tool_position.tool, facts)
+
+    # For standalone tools with consumption records in the given time frame, add them under the "Unassigned" key in aggregated.
+    for tool in candidates:
+        if tool.id in facts['consumption']:
+            aggregated = aggregate_tool_metrics(aggregated, None, None, None, None, tool, facts)
     
     # Additional aggregation steps for overall cost per piece.
     for line in aggregated.values():
@@ -391,6 +409,29 @@ async def get_cpu(
 
     return aggregated
 
+# Endpoint: Get CPU and tool cost metrics for recipes and standalone tools
+@router.get("/api/cpu")
+async def get_cpu(
+    dashboard_filter: DashboardFilter = Depends(get_dated_dashboard_filter),
+    db: Session = Depends(get_session),
+) -> Dict:
+    """
+    Retrieve CPU related data for recipes and standalone tools, including tool positions and cost metrics.
+
+    This endpoint collects recipe data for active recipes that experienced a changeover within
+    the specified date range and calculates consumption and cost metrics for tools. It also includes
+    tools that are not part of any recipe but have consumption records in the given time frame.
+
+    Parameters:
+        dashboard_filter (DashboardFilter): Selected operations, products and the date range for filtering recipes and consumptions.
+        db (Session): Database session dependency.
+
+    Returns:
+        Dict: A nested dictionary structure organizing tool data and cost metrics by production line,
+              product, and operation for recipe-based tools, and a separate section for standalone tools.
+    """
+    return compute_cpu(dashboard_filter, db)
+
 
 async def tool_info(tool_id:int, start_date:datetime, end_date:datetime, db, condense:bool=True, max_points:int=50) -> dict:
     """
@@ -411,24 +452,6 @@ async def tool_info(tool_id:int, start_date:datetime, end_date:datetime, db, con
     if not tool:
         return {"error": "Tool not found."}
 
-    # Fetch consumption records for the specified date range
-    consumptions_db = db.exec(
-        select(ToolConsumption)
-        .where(ToolConsumption.tool_id == tool.id)
-        .where(ToolConsumption.datetime >= start_date)
-        .where(ToolConsumption.datetime <= end_date)
-        .order_by(asc(ToolConsumption.datetime))
-    ).all()
-
-    # Fetch tool life records
-    lifes = db.exec(
-        select(ToolLife)
-        .where(ToolLife.tool_id == tool.id)
-        .where(ToolLife.timestamp >= start_date)
-        .where(ToolLife.timestamp <= end_date)
-        .order_by(asc(ToolLife.timestamp))
-    ).all()
-
     # Fetch related recipes
     recipes = db.exec(
         select(Recipe)
@@ -437,15 +460,44 @@ async def tool_info(tool_id:int, start_date:datetime, end_date:datetime, db, con
         .where(RecipeTool.tool_id == tool.id)
     ).all()
 
-    consumptions = [{"datetime": c.datetime, "quantity": c.quantity} for c in consumptions_db]
-    prices = [{"datetime": c.datetime, "price": c.price} for c in consumptions_db]
-    lifes = [{"timestamp": life.timestamp, "reached_life": life.reached_life} for life in lifes]
+    consumption_criteria = (
+        ToolConsumption.tool_id == tool.id,
+        ToolConsumption.datetime >= start_date,
+        ToolConsumption.datetime <= end_date,
+    )
+    life_criteria = (
+        ToolLife.tool_id == tool.id,
+        ToolLife.timestamp >= start_date,
+        ToolLife.timestamp <= end_date,
+    )
     window = 'daily'
 
     if condense:
-        consumptions, window = get_condensed_data(consumptions, max_points, 'datetime', 'quantity', average=False)
-        prices, window = get_condensed_data(prices, max_points, 'datetime', 'price')
-        lifes, _ = get_condensed_data(lifes, max_points, 'timestamp', 'reached_life')      
+        # The database condenses the series, only the points are transferred
+        consumptions, window = query_condensed_data(db, ToolConsumption.datetime, ToolConsumption.quantity,
+                                                    *consumption_criteria, max_points=max_points, average=False)
+        prices, window = query_condensed_data(db, ToolConsumption.datetime, ToolConsumption.price,
+                                              *consumption_criteria, max_points=max_points)
+        lifes, _ = query_condensed_data(db, ToolLife.timestamp, ToolLife.reached_life,
+                                        *life_criteria, max_points=max_points)
+    else:
+        # Fetch consumption records for the specified date range
+        consumptions_db = db.exec(
+            select(ToolConsumption.datetime, ToolConsumption.quantity, ToolConsumption.price)
+            .where(*consumption_criteria)
+            .order_by(asc(ToolConsumption.datetime))
+        ).all()
+
+        # Fetch tool life records
+        lifes = db.exec(
+            select(ToolLife.timestamp, ToolLife.reached_life)
+            .where(*life_criteria)
+            .order_by(asc(ToolLife.timestamp))
+        ).all()
+
+        consumptions = [{"datetime": timestamp, "quantity": quantity} for timestamp, quantity, _ in consumptions_db]
+        prices = [{"datetime": timestamp, "price": price} for timestamp, _, price in consumptions_db]
+        lifes = [{"timestamp": timestamp, "reached_life": reached_life} for timestamp, reached_life in lifes]
 
     return_data = dotsi.Dict(
         {
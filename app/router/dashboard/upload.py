@@ -1,18 +1,28 @@
 from fastapi import APIRouter, Request, File, UploadFile, Form
 from fastapi.responses import HTMLResponse, JSONResponse
 
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
+from sqlalchemy import update, values, column, Integer, Numeric
 from sqlalchemy.dialects.postgresql import insert
+import asyncio
 import io
+import re
+from itertools import islice
 import openpyxl
 import pandas as pd
-from datetime import datetime as dt
+from datetime import datetime as dt, date, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from types import UnionType
+from typing import Union, get_args, get_origin
 
 from app.models import (OrderCompletion, OrderCompletionCreate, User, Workpiece, 
                         ToolConsumption, ToolConsumptionCreate, Tool, Machine, Manufacturer, 
-                        ToolType, ToolOrder, ToolOrderCreate, OrderDelivery, OrderDeliveryCreate)
+                        ToolType, ToolOrder, ToolOrderCreate, OrderDelivery, OrderDeliveryCreate,
+                        Recipe, ToolPosition, UploadJob, Production, Line, WorkpieceLine)
 from app.database_config import engine
 from app.templates.jinja_functions import templates
+from app.upload_jobs import upload_jobs
 
 router = APIRouter(
     prefix="/upload",
@@ -20,78 +30,103 @@ router = APIRouter(
 )
 
 
-async def get_excel_sheets(file: UploadFile):
-    """Get list of sheets in Excel file"""
+# Rows per chunk handed from the Excel reader to write_to_db
+EXCEL_CHUNK_SIZE = 1000
+
+async def open_workbook(file: UploadFile):
+    """Parse the Excel file once in read-only mode, rows are streamed from it instead of loaded up front"""
     if not file.filename.lower().endswith('.xlsx'):
         return None
     
     content = await file.read()
     await file.seek(0)  # Reset file pointer for future reads
-    xlsx = io.BytesIO(content)
-    wb = openpyxl.load_workbook(xlsx, data_only=True)
+    return openpyxl.load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+
+def load_workbook(path: str):
+    """Open a stored upload in read-only mode, used by the upload jobs"""
+    return openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+async def get_excel_sheets(file: UploadFile):
+    """Get list of sheets in Excel file"""
+    wb = await open_workbook(file)
+    if wb is None:
+        return None
     sheets = wb.sheetnames
+    wb.close()
     return sheets
 
 async def preview_excel_sheet(file: UploadFile, sheet_name: str = None):
     """Preview first 10 rows of specified sheet without header detection"""
-    if not file.filename.lower().endswith('.xlsx'):
+    wb = await open_workbook(file)
+    if wb is None:
         return None
-    
-    content = await file.read()
-    await file.seek(0)  # Reset file pointer for future reads
-    xlsx = io.BytesIO(content)
-    wb = openpyxl.load_workbook(xlsx, data_only=True)
-    ws = wb[sheet_name]
-
-    df = pd.DataFrame(ws.values)
-    preview_rows = min(10, len(df))  # Show up to 10 rows for better header selection
-
-    return {
-        'rows': df.head(preview_rows).values.tolist(),
-        'total_rows': len(df)
-    }
 
-async def read_excel(file: UploadFile, sheet_names: str = None, header_row: int = None):
-    """Read specified sheets from Excel file and return combined DataFrame"""
-    if not file.filename.lower().endswith('.xlsx'):
-        return None
-    
-    content = await file.read()
-    await file.seek(0)  # Reset file pointer for future reads
-    xlsx = io.BytesIO(content)
-    wb = openpyxl.load_workbook(xlsx, data_only=True)
-    
-    # Convert comma-separated string to list, or use all sheets
-    sheet_list = sheet_names.split(',') if sheet_names else wb.sheetnames
+    try:
+        ws = wb[sheet_name]
+        # Only the first rows are read, the total comes from the sheet dimensions
+        rows = [list(row) for row in islice(ws.iter_rows(values_only=True), 10)]
+        return {
+            'rows': rows,
+            'total_rows': ws.max_row if ws.max_row is not None else len(rows)
+        }
+    finally:
+        wb.close()
+
+def get_sheet_list(wb, sheet_names: str = None) -> list:
+    """Convert comma-separated string to list, or use all sheets"""
+    return sheet_names.split(',') if sheet_names else wb.sheetnames
+
+def read_excel_header(wb, sheet_names: str = None, header_row: int = None) -> list:
+    """Column names of all selected sheets, read from the header row only"""
+    columns = []
+    for sheet_name in get_sheet_list(wb, sheet_names):
+        if header_row is None:
+            continue
+        header = next(islice(wb[sheet_name].iter_rows(values_only=True), header_row, None), None)
+        columns.extend(column for column in header or [] if column not in columns)
+    return columns
+
+def count_excel_rows(wb, sheet_names: str = None, header_row: int = None) -> int:
+    """Estimated number of rows below the header row, from the sheet dimensions"""
+    return sum(max((wb[sheet_name].max_row or 0) - (header_row or 0) - 1, 0)
+               for sheet_name in get_sheet_list(wb, sheet_names))
+
+def iter_excel_rows(wb, sheet_names: str = None, header_row: int = None, chunk_size: int = EXCEL_CHUNK_SIZE):
+    """Stream the rows below the header row of the specified sheets as chunks of {column: value} dicts"""
+    sheet_list = get_sheet_list(wb, sheet_names)
     print(f"Processing sheets: {sheet_list}")
-    
-    dfs = []
+
+    chunk = []
+    total_rows = 0
     for sheet_name in sheet_list:
         print(f"Processing sheet: {sheet_name}")
-        ws = wb[sheet_name]
-        df = pd.DataFrame(ws.values)
-        
-        if header_row is not None and header_row < len(df):
-            # Use the specified row as header
-            df.columns = df.iloc[header_row]
-            df = df[header_row + 1:]
-            print(f"Using row {header_row} as header")
-            print(f"Columns: {df.columns.tolist()}")
-        else:
+        rows = wb[sheet_name].iter_rows(values_only=True)
+
+        header = next(islice(rows, header_row, None), None) if header_row is not None else None
+        if header is None:
             print("Warning: Invalid header row specified")
             continue
+        print(f"Using row {header_row} as header")
+        print(f"Columns: {list(header)}")
 
-        # df.dropna(axis=1, thresh=3, inplace=True)
-        dfs.append(df)
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            chunk.append(dict(zip(header, values)))
+            if len(chunk) >= chunk_size:
+                total_rows += len(chunk)
+                yield chunk
+                chunk = []
 
-    final_df = pd.concat(dfs) if dfs else None
-    if final_df is not None:
-        print(f"Successfully combined {len(dfs)} sheets, total rows: {len(final_df)}")
-    else:
-        print("Warning: No data frames to combine")
-    return final_df
+    if chunk:
+        total_rows += len(chunk)
+        yield chunk
+    print(f"Read {total_rows} rows from {len(sheet_list)} sheets")
+
+def write_to_db(records: list, model, create_model, session: Session, result: dict, load_mode: str = 'insert'):
+    if load_mode == 'copy':
+        return copy_to_db(records, model, create_model, session, result)
 
-async def write_to_db(records: list, model, create_model, session: Session, result: dict):
     valid_records = []
     for record in records:
         try:
@@ -120,6 +155,122 @@ async def write_to_db(records: list, model, create_model, session: Session, resu
 
     return result
 
+def to_int(value) -> int:
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{value} is not an integer")
+    return int(value)
+
+def to_datetime(value) -> dt:
+    if isinstance(value, dt):
+        return value
+    if isinstance(value, date):
+        return dt.combine(value, time())
+    return dt.fromisoformat(str(value))
+
+def to_date(value) -> date:
+    if isinstance(value, dt):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+def to_time(value) -> time:
+    if isinstance(value, dt):
+        return value.time()
+    if isinstance(value, time):
+        return value
+    return time.fromisoformat(str(value))
+
+# Converters of the compiled column schemas, by field type
+COLUMN_CONVERTERS = {
+    int: to_int,
+    float: float,
+    Decimal: lambda value: Decimal(str(value)),
+    str: str,
+    bool: bool,
+    dt: to_datetime,
+    date: to_date,
+    time: to_time,
+}
+
+@lru_cache
+def compile_column_schema(create_model, columns: tuple) -> list:
+    """
+    Compile the fields of a create model into (column, converter, nullable) tuples.
+
+    Converting a row with the compiled schema is much cheaper than constructing the pydantic model,
+    which is what makes the copy load mode worth it for large backfills.
+    """
+    schema = []
+    for name in columns:
+        annotation = create_model.model_fields[name].annotation
+        arguments = get_args(annotation)
+        nullable = get_origin(annotation) in (Union, UnionType) and type(None) in arguments
+        if nullable:
+            annotation = next(argument for argument in arguments if argument is not type(None))
+        schema.append((name, COLUMN_CONVERTERS.get(annotation, lambda value: value), nullable))
+    return schema
+
+def validate_row(record: dict, schema: list) -> tuple:
+    row = []
+    for name, converter, nullable in schema:
+        value = record.get(name)
+        if value is None or value != value:  # None or NaN
+            if not nullable:
+                raise ValueError(f"{name} is required")
+            row.append(None)
+        else:
+            row.append(converter(value))
+    return tuple(row)
+
+def copy_to_db(records: list, model, create_model, session: Session, result: dict):
+    """
+    Load records through a temporary staging table filled with COPY.
+
+    The rows are validated with the compiled column schema, streamed into the staging table and merged
+    into the model's table with one INSERT ... SELECT ... ON CONFLICT DO NOTHING.
+    """
+    if not records:
+        return result
+    columns = tuple(name for name in records[0] if name in create_model.model_fields)
+    schema = compile_column_schema(create_model, columns)
+
+    rows = []
+    for record in records:
+        try:
+            rows.append(validate_row(record, schema))
+        except Exception as e:
+            result['bad_data'] += 1
+            result['total_records'] += 1
+            result['errors'].append(str(e))
+
+    if rows:
+        table = model.__tablename__
+        column_list = ', '.join(f'"{name}"' for name in columns)
+        # The raw psycopg connection of the session, so the merge runs in the session's transaction
+        connection = session.connection().connection.driver_connection
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE TEMP TABLE upload_staging AS SELECT {column_list} FROM "{table}" WITH NO DATA')
+            with cursor.copy(f'COPY upload_staging ({column_list}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cursor.execute(f'INSERT INTO "{table}" ({column_list}) SELECT {column_list} FROM upload_staging ON CONFLICT DO NOTHING')
+            inserted = cursor.rowcount
+            cursor.execute('DROP TABLE upload_staging')
+        session.commit()
+
+        result['total_records'] += len(rows)
+        result['inserted'] += inserted
+        result['skipped'] += len(rows) - inserted
+
+    return result
+
+# Rows per chunk in the copy load mode, COPY is cheap per row so larger batches pay off
+COPY_CHUNK_SIZE = 50000
+
+def chunk_size_for(load_mode: str) -> int:
+    return COPY_CHUNK_SIZE if load_mode == 'copy' else EXCEL_CHUNK_SIZE
+
 @router.get("/", response_class=HTMLResponse)
 async def upload_page(request: Request):
     """Render the file upload page"""
@@ -158,9 +309,16 @@ async def upload_page(request: Request):
         ).first()
         update_dates['order_deliveries'] = last_order_delivery.delivery_date if last_order_delivery else None
 
+        # Most recent hourly production upload
+        last_production = session.exec(
+            select(Production).order_by(Production.date.desc(), Production.end_time.desc())
+        ).first()
+        update_dates['hourly_production'] = dt.combine(
+            last_production.date, last_production.end_time
+        ) if last_production else None
+
         # Placeholder for uploads without timestamps
         update_dates['tool_inventory'] = None
-        update_dates['hourly_production'] = None
 
     return templates.TemplateResponse(
         "dashboard/upload.html.j2",
@@ -196,459 +354,882 @@ async def preview_sheet(
     except Exception as e:
         return {"error": str(e)}
 
-@router.post("/tool-consumption")
-async def upload_tool_consumption(
-    file: UploadFile = File(...),
-    sheet_names: str = Form(None),
-    header_row: int = Form(None)
-)-> JSONResponse:
-    """Handle tool consumption file upload
+# Columns of the resolved tool consumption frame that are written to the database
+CONSUMPTION_COLUMNS = ['datetime', 'number', 'consumption_type', 'quantity', 'value', 'price', 'user_id',
+                       'machine_id', 'tool_id', 'recipe_id', 'tool_position_id', 'workpiece_id']
 
-    Returns:
-        dict: A dictionary containing the following keys:
-            - filename (str): The name of the uploaded file.
-            - type (str): The type of the upload, e.g., "tool_consumption".
-            - result (dict): A dictionary with the following keys:
-                - total_records (int): Total number of records processed.
-                - inserted (int): Number of records successfully inserted.
-                - bad_data (int): Number of records with validation errors.
-                - skipped (int): Number of records skipped due to conflicts or other issues.
+def load_consumption_lookups(session: Session) -> dict:
+    """Load the lookup frames used to resolve the ids of tool consumption rows"""
+    return {
+        'users': pd.DataFrame(session.exec(select(User.number, User.id)).all(), columns=['user_number', 'user_id'])
+                   .dropna(subset=['user_number']).astype({'user_number': str}).drop_duplicates('user_number'),
+        'machines': pd.DataFrame(session.exec(select(Machine.cost_center, Machine.id)).all(), columns=['cost_center', 'machine_id'])
+                      .astype({'cost_center': str}),
+        'workpieces': pd.DataFrame(session.exec(select(Workpiece.description, Workpiece.id)).all(), columns=['Product', 'workpiece_id'])
+                        .dropna(subset=['Product']).drop_duplicates('Product'),
+        'recipes': pd.DataFrame(session.exec(select(Recipe.machine_id, Recipe.workpiece_id, Recipe.id)
+                                             .where(Recipe.workpiece_id.is_not(None))).all(),
+                                columns=['machine_id', 'workpiece_id', 'recipe_id']),
+        'tool_positions': pd.DataFrame(session.exec(select(ToolPosition.recipe_id, ToolPosition.tool_id, ToolPosition.id)
+                                                    .order_by(ToolPosition.id)).all(),
+                                       columns=['recipe_id', 'tool_id', 'tool_position_id'])
+                            .drop_duplicates(['recipe_id', 'tool_id']),
+    }
+
+def resolve_tool_consumption(df: pd.DataFrame, lookups: dict) -> tuple:
+    """
+    Resolve the ids and prices of a chunk of tool consumption rows with merges against the lookup frames.
+
+    Returns the resolved consumption frame with the CONSUMPTION_COLUMNS and a frame of the invalid rows
+    with an 'error' column.
     """
-    print(f'Processing tool consumption file: {file.filename}')
+    df = df.reset_index(drop=True)
+    for column in ['Employee', 'CostCenter', 'Product', 'TransactionId']:
+        if column not in df.columns:
+            df[column] = None
+    if 'tool_number' not in df.columns:
+        df['tool_number'] = tool_numbers(df['CPN'])
+
+    df['user_number'] = df['Employee'].map(
+        lambda value: value.split('-')[1] if isinstance(value, str) and '-' in value else None)
+    df['cost_center'] = df['CostCenter'].map(lambda value: str(value) if pd.notna(value) and value != '' else None)
+
+    df = (df
+          .merge(lookups['users'], on='user_number', how='left')
+          .merge(lookups['machines'], on='cost_center', how='left')
+          .merge(lookups['tools'], on='tool_number', how='left')
+          .merge(lookups['workpieces'], on='Product', how='left'))
+    # Ids with missing values are float columns, use float keys on both sides of the merges
+    df = df.astype({'machine_id': 'float64', 'workpiece_id': 'float64', 'tool_id': 'float64'})
+    df = df.merge(lookups['recipes'].astype('float64'), on=['machine_id', 'workpiece_id'], how='left')
+    df = df.merge(lookups['tool_positions'].astype('float64'), on=['recipe_id', 'tool_id'], how='left')
+
+    df['quantity'] = pd.to_numeric(df['Qty'], errors='coerce')
+    df['datetime'] = pd.to_datetime(df['TransDate'], errors='coerce')
+
+    # Route the rows that can't be resolved to the error frame
+    df['error'] = None
+    df.loc[df['datetime'].isna(), 'error'] = 'Invalid TransDate: ' + df['TransDate'].astype(str)
+    # Quantities are whole pieces, fractional ones would fail the integer cast below
+    df.loc[df['quantity'].isna() | (df['quantity'] == 0) | (df['quantity'] % 1 != 0), 'error'] = 'Invalid Qty: ' + df['Qty'].astype(str)
+    df.loc[df['cost_center'].notna() & df['machine_id'].isna(), 'error'] = 'Unknown CostCenter: ' + df['cost_center'].astype(str)
+    df.loc[df['tool_id'].isna(), 'error'] = 'Unknown tool: ' + df['tool_number'].astype(str)
+    errors = df.loc[df['error'].notna(), ['tool_number', 'error']]
+    df = df[df['error'].isna()].copy()
+
+    # The price of a row is its value per piece, rows without a value use the latest price of the tool before them
+    ext_value = pd.to_numeric(df['ExtValue'], errors='coerce')
+    has_value = ext_value > 0
+    df['price'] = (ext_value / df['quantity']).where(has_value)
+    df['price'] = df.groupby('tool_id')['price'].ffill().fillna(df['tool_price'])
+    df['value'] = ext_value.where(has_value, df['price'] * df['quantity'])
+
+    df['number'] = df['TransactionId'].where(df['TransactionId'].notna() & (df['TransactionId'] != ''))
+    df['consumption_type'] = "ISSUE" # row['Transaction Type'], # hardcoded for now untill data contains transaction type
+    for column in ['user_id', 'machine_id', 'tool_id', 'recipe_id', 'tool_position_id', 'workpiece_id']:
+        df[column] = df[column].astype('Int64')
+    df['quantity'] = df['quantity'].astype('Int64')
+
+    return df, errors
+
+def create_missing_tools(session: Session, new_tools: pd.DataFrame, manufacturer_id: int, tool_type_id: int) -> dict:
+    """
+    Bulk insert tools for unknown CPNs, returns {number: (id, price)} of the new tools.
+
+    Conflicting rows (e.g. a tool with the same name) are skipped by the database, tools that exist with
+    the same number under a different case are looked up instead.
+    """
+    inserted = session.exec(
+        insert(Tool)
+        .values([{
+            'number': number,
+            # 'manufacturer_name': row['Description'], # not in the data yet
+            'name': name,
+            'manufacturer_id': manufacturer_id,
+            'tool_type_id': tool_type_id,
+        } for number, name in new_tools[['tool_number', 'Desc1']].itertuples(index=False)])
+        .on_conflict_do_nothing()
+        .returning(Tool.id, Tool.number, Tool.price)
+    ).all()
+    created = {number.upper(): (tool_id, float(price or 0)) for tool_id, number, price in inserted}
+
+    missing = [number for number in new_tools['tool_number'] if number not in created]
+    if missing:
+        created.update({number.upper(): (tool_id, float(price or 0)) for tool_id, number, price in session.exec(
+            select(Tool.id, Tool.number, Tool.price).where(func.upper(Tool.number).in_(missing))
+        ).all()})
+    session.commit()
+    return created
+
+def update_tool_stock(session: Session, per_tool: pd.DataFrame):
+    """Set the latest price and subtract the consumed quantity of each tool in one UPDATE ... FROM VALUES"""
+    if per_tool.empty:
+        return
+    consumed = values(
+        column('id', Integer), column('price', Numeric), column('quantity', Integer),
+        name='consumed'
+    ).data([(int(tool_id), float(price), int(quantity)) for tool_id, price, quantity in per_tool.itertuples()])
+    session.exec(
+        update(Tool)
+        .where(Tool.id == consumed.c.id)
+        .values(price=consumed.c.price, inventory=func.coalesce(Tool.inventory, 0) - consumed.c.quantity)
+    )
 
-    # Validate sheet names
-    valid_sheets = await get_excel_sheets(file)
+def tool_numbers(cpn: pd.Series) -> pd.Series:
+    """Normalized tool numbers of a CPN column, missing CPNs become None"""
+    return cpn.map(lambda value: str(value).strip("\n").upper() if pd.notna(value) and value != '' else None)
+
+def frame_to_records(df: pd.DataFrame) -> list:
+    """Convert a frame to a list of dicts with plain Python values, NaN/NA become None"""
+    return [
+        {key: None if pd.isna(value) else value for key, value in record.items()}
+        for record in df.to_dict('records')
+    ]
+
+def validate_sheet_names(wb, sheet_names: str = None):
     if sheet_names:
-        invalid_sheets = [sheet for sheet in sheet_names.split(',') if sheet not in valid_sheets]
+        invalid_sheets = [sheet for sheet in sheet_names.split(',') if sheet not in wb.sheetnames]
         if invalid_sheets:
-            return JSONResponse(
-                status_code=400,
-                content={"error": f"Invalid sheet names: {', '.join(invalid_sheets)}"}
-            )
-    
-    df = await read_excel(file, sheet_names, header_row)
+            raise ValueError(f"Invalid sheet names: {', '.join(invalid_sheets)}")
 
-    if df is None:
-        return JSONResponse(
-            status_code=400,
-            content={"error": "Unsupported file type or failed to read file"}
-        )
-        # return {"filename": file.filename, "type": "tool_consumption", "error": "Failed to read file"}
-    
-    necessary_columns = ['TransDate', 'Qty', 'ExtValue', 'CPN', 'Desc1', 'Employee', 'CostCenter'] # , 'Transaction Type', 'Product'
-    missing_columns = [col for col in necessary_columns if col not in df.columns]
+def validate_columns(wb, sheet_names: str, header_row: int, necessary_columns: list):
+    columns = read_excel_header(wb, sheet_names, header_row)
+    missing_columns = [col for col in necessary_columns if col not in columns]
     if missing_columns:
-        return JSONResponse(
-            status_code=400,
-            content={
-                "error": f"Missing required columns: {', '.join(missing_columns)}",
-                "filename": file.filename,
-                "type": "tool_consumption"
-            }
-        )
-
-    with Session(engine) as session:
-        users = session.exec(select(User)).all()
-        users = {user.number: user.id for user in users}
+        raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
 
-        machines = session.exec(select(Machine)).all()
-        machines = {str(machine.cost_center): machine for machine in machines}
+def import_tool_consumption(path: str, sheet_names: str, header_row: int, load_mode: str, progress, watermark: dt = None) -> dict:
+    """Import a tool consumption file, runs in an upload job worker"""
+    wb = load_workbook(path)
+    try:
+        validate_sheet_names(wb, sheet_names)
+        necessary_columns = ['TransDate', 'Qty', 'ExtValue', 'CPN', 'Desc1', 'Employee', 'CostCenter'] # , 'Transaction Type', 'Product'
+        validate_columns(wb, sheet_names, header_row, necessary_columns)
+        progress.expect(count_excel_rows(wb, sheet_names, header_row))
+
+        with Session(engine) as session:
+            lookups = load_consumption_lookups(session)
+            tools = {number.upper(): (tool_id, float(price or 0))
+                     for tool_id, number, price in session.exec(select(Tool.id, Tool.number, Tool.price)).all()}
+
+            manufacturer = session.exec(select(Manufacturer).where(Manufacturer.name=='Undefined')).first()
+            tool_type = session.exec(select(ToolType).where(ToolType.name=='Undefined')).first()
+
+            result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+            rows_read = 0
+            latest = None
+            for rows in iter_excel_rows(wb, sheet_names, header_row, chunk_size_for(load_mode)):
+                rows_read += len(rows)
+                df = pd.DataFrame(rows)
+                if watermark is not None:
+                    # Rows before the watermark were imported by an earlier upload, invalid dates are still reported
+                    trans_dates = pd.to_datetime(df['TransDate'], errors='coerce')
+                    imported = trans_dates < watermark
+                    result['skipped'] += int(imported.sum())
+                    result['total_records'] += int(imported.sum())
+                    df = df[~imported]
+                    if df.empty:
+                        progress.update(result, rows_read)
+                        continue
+                df['tool_number'] = tool_numbers(df['CPN'])
 
-        tools = session.exec(select(Tool)).all()
-        tools = {tool.number.upper(): tool for tool in tools}
+                # Create the tools that aren't known yet in one statement before resolving the chunk
+                unknown_tools = df.loc[df['tool_number'].notna() & ~df['tool_number'].isin(list(tools)), ['tool_number', 'Desc1']]
+                if not unknown_tools.empty:
+                    tools.update(create_missing_tools(session, unknown_tools.drop_duplicates('tool_number'),
+                                                      manufacturer.id, tool_type.id))
 
-        workpieces = session.exec(select(Workpiece)).all()
-        workpieces = {workpiece.description: workpiece.id for workpiece in workpieces}
-        
-        manufacturer = session.exec(select(Manufacturer).where(Manufacturer.name=='Undefined')).first()
-        tool_type = session.exec(select(ToolType).where(ToolType.name=='Undefined')).first()
+                lookups['tools'] = pd.DataFrame(
+                    [(number, tool_id, price) for number, (tool_id, price) in tools.items()],
+                    columns=['tool_number', 'tool_id', 'tool_price']
+                )
+                consumptions, errors = resolve_tool_consumption(df, lookups)
+
+                result['bad_data'] += len(errors)
+                result['total_records'] += len(errors)
+                result['errors'].extend(errors['error'].tolist())
+
+                # Latest price and consumed quantity per tool of this chunk, applied with one UPDATE
+                per_tool = consumptions.groupby('tool_id').agg(price=('price', 'last'), quantity=('quantity', 'sum'))
+                update_tool_stock(session, per_tool)
+                numbers_by_id = {tool_id: number for number, (tool_id, _) in tools.items()}
+                for tool_id, price, _ in per_tool.itertuples():
+                    tools[numbers_by_id[int(tool_id)]] = (int(tool_id), float(price))
+
+                records = frame_to_records(consumptions[CONSUMPTION_COLUMNS])
+                if records:
+                    result = write_to_db(records, ToolConsumption, ToolConsumptionCreate, session, result, load_mode)
+                    chunk_latest = consumptions['datetime'].max().to_pydatetime()
+                    latest = chunk_latest if latest is None else max(latest, chunk_latest)
+                progress.update(result, rows_read)
+
+            session.commit()
+    finally:
+        wb.close()
+
+    result['watermark'] = latest
+    return result
 
-        # Prepare all valid records
-        records = []
-        result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
-        for _, row in df.iterrows():
-            try:
-                user_id = None
-                if row.get('Employee'):
+def import_parts_produced(path: str, sheet_names: str, header_row: int, load_mode: str, progress, watermark: dt = None) -> dict:
+    """Import a parts production file, runs in an upload job worker"""
+    wb = load_workbook(path)
+    try:
+        progress.expect(count_excel_rows(wb, sheet_names, header_row))
+
+        with Session(engine) as session:
+            # users = session.exec(select(User)).all()
+            workpieces = session.exec(select(Workpiece)).all()
+            workpieces = {workpiece.material: workpiece.id for workpiece in workpieces}
+
+            # Prepare all valid records
+            records = []
+            result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+            rows_read = 0
+            latest = None
+            for rows in iter_excel_rows(wb, sheet_names, header_row, chunk_size_for(load_mode)):
+                rows_read += len(rows)
+                for row in rows:
                     try:
-                        user_number = row['Employee'].split('-')[1]
-                    except IndexError:
-                        user_number = None
-                    user_id = users.get(user_number, None)
-                
-                machine, machine_id = None, None
-                if row.get('CostCenter'):
-                    cost_center = str(row['CostCenter'])
-                    machine = machines[cost_center]
-                    machine_id = machine.id
-
-                tool = tools.get(str(row['CPN']).strip("\n").upper())
-                if tool is None:
-                    new_tool = Tool(
-                        number=row['CPN'].upper(),
-                        # manufacturer_name=row['Description'], # not in the data yet
-                        name=row['Desc1'],
-                        manufacturer_id=manufacturer.id,
-                        tool_type_id=tool_type.id
-                    )
+                        document_date = to_datetime(row['Document Date'])
+                    except Exception:
+                        document_date = None  # reported by the validation below
+                    if watermark is not None and document_date is not None and document_date < watermark:
+                        # Imported by an earlier upload
+                        result['skipped'] += 1
+                        result['total_records'] += 1
+                        continue
                     try:
-                        session.add(new_tool)
-                        session.commit()
-                        session.refresh(new_tool)
-                        tools[new_tool.number] = new_tool
+                        records.append({
+                            'quantity': row['Qty in unit of entry'],
+                            'vendor': row['Vendor'],
+                            'batch': row['Batch'],
+                            'customer': row['Customer'],
+                            'order': row['Order'],
+                            'document_number': row['Material Document'],
+                            'date': row['Document Date'],
+                            'time': row['Time of Entry'],
+                            'value': row['Amt.in loc.cur.'],
+                            'workpiece_id': workpieces[row['Material']],
+                        })
                     except Exception as e:
                         print(e)
-                        tool = None
-                        session.rollback()
-                                        
-                workpiece_id = None
-                if row.get('Product'):
-                    workpiece_id = workpieces.get(row['Product'], None)
-
-                recipe_id, tool_position_id = None, None
-
-                if machine and tool and workpiece_id:
-                    for recipe in machine.recipes:
-                        if recipe.workpiece_id == workpiece_id:
-                            recipe_id = recipe.id
-                            for tool_position in recipe.tool_positions:
-                                if tool_position.tool_id == tool.id:
-                                    tool_position_id = tool_position.id
-                                    break
-                            if recipe_id:
-                                break
-
-                records.append({
-                    'datetime': row['TransDate'],
-                    'number': row['TransactionId'] if row.get('TransactionId') else None,
-                    'consumption_type': "ISSUE", # row['Transaction Type'], # hardcoded for now untill data contains transaction type
-                    'quantity': row['Qty'],
-                    'value': float(row['ExtValue']) if row.get('ExtValue') and row['ExtValue'] > 0 else tool.price * row['Qty'],
-                    'price': float(row['ExtValue']) / row["Qty"] if row.get('ExtValue') and row['ExtValue'] > 0 else tool.price,
-                    'user_id': user_id,
-                    'machine_id': machine_id,
-                    'tool_id': tool.id,
-                    'recipe_id': recipe_id,
-                    'tool_position_id': tool_position_id,
-                    'workpiece_id': workpiece_id,
-                })
-                tool.price = float(row['ExtValue']) / row["Qty"] if row.get('ExtValue') and row['ExtValue'] > 0 else tool.price
-                if not tool.inventory:
-                    tool.inventory = 0
-                tool.inventory -= row['Qty']
-            except Exception as e:
-                print(e)
-                result['bad_data'] += 1
-                result['errors'].append(str(e))
-
-            if len(records) > 100:
-                result = await write_to_db(records, ToolConsumption, ToolConsumptionCreate, session, result)
-                records = []
-        
-        # Insert all records in a single operation, ignoring duplicates
-        if records:
-            result = await write_to_db(records, ToolConsumption, ToolConsumptionCreate, session, result)
+                        result['bad_data'] += 1
+                        result['errors'].append(str(e))
+                        result['total_records'] += 1
+
+                # Write each chunk read from the workbook as one batch
+                if records:
+                    result = write_to_db(records, OrderCompletion, OrderCompletionCreate, session, result, load_mode)
+                    dates = [to_datetime(record['date']) for record in records if record['date'] is not None]
+                    if dates:
+                        latest = max(dates) if latest is None else max(latest, *dates)
+                    records = []
+                progress.update(result, rows_read)
+    finally:
+        wb.close()
+
+    result['watermark'] = latest
+    return result
 
-        session.commit()
-        
+def import_tool_orders(path: str, sheet_names: str, header_row: int, load_mode: str, progress, watermark: dt = None) -> dict:
+    """Import a tool orders file, runs in an upload job worker"""
+    wb = load_workbook(path)
+    try:
+        necessary_columns = [
+            'PONumber', 'POLine', 'POSuffix', 'OrderQty', 'DueDate',
+            'OrderDate', 'custpart', 'c_description', 'c_description1',
+            'VendorNumber', 'VendorName', 'OpenCost', 'TotalCost'
+        ]
+        validate_columns(wb, sheet_names, header_row, necessary_columns)
+        progress.expect(count_excel_rows(wb, sheet_names, header_row))
+
+        with Session(engine) as session:
+            tools = session.exec(select(Tool)).all()
+            tools = {tool.number.upper(): tool.id for tool in tools}
+
+            manufacturers = session.exec(select(Manufacturer)).all()
+            manufacturers = {int(manufacturer.number): manufacturer.id for manufacturer in manufacturers if manufacturer.number}
+
+            unknown_tool_type = session.exec(select(ToolType).where(ToolType.name=='Undefined')).first()
+
+            # Prepare all valid records
+            records = []
+            result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+            rows_read = 0
+
+            for rows in iter_excel_rows(wb, sheet_names, header_row, chunk_size_for(load_mode)):
+                rows_read += len(rows)
+                for row in rows:
+                    if not row.get('OrderQty', False):
+                        continue
+                    try:
+                        tool_id = tools.get(str(row.get('custpart', '')).upper())
+                        manufacturer_id = manufacturers.get(row.get('VendorNumber'))
 
-    return JSONResponse(
-        content={"filename": file.filename, "type": "tool_consumption", 'result': result},
-        status_code=200
-    )
+                        if not manufacturer_id:
+                            new_manufacturer = Manufacturer(
+                                name=row['VendorName'],
+                                number=row['VendorNumber'],
+                            )
+                            try:
+                                session.add(new_manufacturer)
+                                session.commit()
+                                session.refresh(new_manufacturer)
+                                manufacturer_id = new_manufacturer.id
+                                manufacturers[int(new_manufacturer.number)] = manufacturer_id
+                            except Exception as e:
+                                print(e)
+                                manufacturer_id = manufacturers['000000'] # default value if manufacturer is not found
+                                result['bad_data'] += 1
+                                result['errors'].append(str(e))
+                                session.rollback()
 
+                        if not tool_id:
+                            new_tool = Tool(
+                                number=str(row['custpart']).upper(),
+                                manufacturer_name=f"{row['c_description']} - {row['c_description1']}",
+                                name=f"{row['c_description']} - {row['c_description1']}",
+                                manufacturer_id=manufacturer_id,
+                                tool_type_id=unknown_tool_type.id
+                            )
+                            try:
+                                session.add(new_tool)
+                                session.commit()
+                                session.refresh(new_tool)
+                                tool_id = new_tool.id
+                                tools[new_tool.number] = tool_id
+                            except Exception as e:
+                                print(e)
+                                tool_id = None
+                                result['bad_data'] += 1
+                                result['errors'].append(str(e))
+                                session.rollback()
+                                continue
 
-@router.post("/parts-produced")
-async def upload_parts_produced(
-    file: UploadFile = File(...),
-    sheet_names: str = Form(None),
-    header_row: int = Form(None)
-) -> JSONResponse:
-    """Handle parts production file upload"""
-    print(f'Processing parts production file: {file.filename}')
+                        records.append({
+                            'tool_id': tool_id,
+                            'quantity': row['OrderQty'],
+                            'number': str(row['PONumber']),
+                            'suffix': str(row['POSuffix']),
+                            'line': str(row['POLine']),
+                            'order_date': row['OrderDate'],
+                            'estimated_delivery_date': row['DueDate'],
+                            'tool_price': float(row.get('OpenCost') or 0),
+                            'gross_price': float(row.get('TotalCost') or 0),
+                        })
+                    except Exception as e:
+                        print(e)
 
-    df = await read_excel(file, sheet_names, header_row)
+                # Write each chunk read from the workbook as one batch
+                if records:
+                    result = write_to_db(records, ToolOrder, ToolOrderCreate, session, result, load_mode)
+                    records = []
+                progress.update(result, rows_read)
+    finally:
+        wb.close()
 
-    if df is None:
-        return JSONResponse(
-            content={"filename": file.filename, "type": "parts_produced", "error": "Failed to read file"},
-            status_code=400
-        )
-        
-    with Session(engine) as session:
-        # users = session.exec(select(User)).all()
-        workpieces = session.exec(select(Workpiece)).all()
-        workpieces = {workpiece.material: workpiece.id for workpiece in workpieces}
-        
-        # Prepare all valid records
-        records = []
-        result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
-        for _, row in df.iterrows():
-            try:
-                records.append({
-                    'quantity': row['Qty in unit of entry'],
-                    'vendor': row['Vendor'],
-                    'batch': row['Batch'],
-                    'customer': row['Customer'],
-                    'order': row['Order'],
-                    'document_number': row['Material Document'],
-                    'date': row['Document Date'],
-                    'time': row['Time of Entry'],
-                    'value': row['Amt.in loc.cur.'],
-                    'workpiece_id': workpieces[row['Material']],
-                })
-            except Exception as e:
-                print(e)
-                result['bad_data'] += 1
-                result['errors'].append(str(e))
-                result['total_records'] += 1
-
-            if len(records) > 100:
-                result = await write_to_db(records, OrderCompletion, OrderCompletionCreate, session, result)
-                records = []
-        
-        # Insert all records in a single operation, ignoring duplicates
-        if records:
-            result = await write_to_db(records, OrderCompletion, OrderCompletionCreate, session, result)
+    return result
 
-    return JSONResponse(
-        content={"filename": file.filename, "type": "parts_produced", 'result': result},
-        status_code=200
-    )
+def import_tool_deliveries(path: str, sheet_names: str, header_row: int, load_mode: str, progress, watermark: dt = None) -> dict:
+    """Import a tool deliveries file, runs in an upload job worker"""
+    wb = load_workbook(path)
+    try:
+        necessary_columns = ['PONumber', 'POLine', 'custpart', 'OrderQty', 'DueDate', 'OrderDate', 'ReceiptDate', 'ReceivedQty']
+        validate_columns(wb, sheet_names, header_row, necessary_columns)
+        progress.expect(count_excel_rows(wb, sheet_names, header_row))
 
+        with Session(engine) as session:
+            orders = session.exec(select(ToolOrder)).all()
+            orders = {f'{order.number}-{order.suffix}-{order.line}': order.id for order in orders}
 
-@router.post("/tool-orders")
-async def upload_tool_orders(
-    file: UploadFile = File(...),
-    sheet_names: str = Form(None),
-    header_row: int = Form(None)
-) -> JSONResponse:
-    """Handle tool orders file upload"""
-    print(f'Processing tool orders file: {file.filename}')
+            tools = session.exec(select(Tool)).all()
+            tools = {tool.number: tool.id for tool in tools}
 
-    df = await read_excel(file, sheet_names, header_row)
+            unknown_manufacturer = session.exec(select(Manufacturer).where(Manufacturer.name == 'Undefined')).first()
+            unknown_tool_type = session.exec(select(ToolType).where(ToolType.name == 'Undefined')).first()
 
-    if df is None:
-        return JSONResponse(
-            content={"filename": file.filename, "type": "tool_order", "error": "Failed to read file"},
-            status_code=400
-        )
-    
-    necessary_columns = [
-        'PONumber', 'POLine', 'POSuffix', 'OrderQty', 'DueDate', 
-        'OrderDate', 'custpart', 'c_description', 'c_description1', 
-        'VendorNumber', 'VendorName', 'OpenCost', 'TotalCost'
-    ]
-    missing_columns = [col for col in necessary_columns if col not in df.columns]
-    if missing_columns:
-        return JSONResponse(
-            status_code=400,
-            content={
-                "error": f"Missing required columns: {', '.join(missing_columns)}",
-                "filename": file.filename,
-                "type": "tool_order"
-            }
-        )
+            # Prepare all valid records
+            records = []
+            result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+            rows_read = 0
 
-    with Session(engine) as session:
-        tools = session.exec(select(Tool)).all()
-        tools = {tool.number.upper(): tool.id for tool in tools}
-        
-        manufacturers = session.exec(select(Manufacturer)).all()
-        manufacturers = {int(manufacturer.number): manufacturer.id for manufacturer in manufacturers if manufacturer.number}
-
-        unknown_tool_type = session.exec(select(ToolType).where(ToolType.name=='Undefined')).first()
-        
-        # Prepare all valid records
-        records = []
-        result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
-
-        for _, row in df.iterrows():
-            if not row.get('OrderQty', False):
-                continue
-            try:
-                tool_id = tools.get(str(row.get('custpart', '')).upper())
-                manufacturer_id = manufacturers.get(row.get('VendorNumber'))
-
-                if not manufacturer_id:
-                    new_manufacturer = Manufacturer(
-                        name=row['VendorName'],
-                        number=row['VendorNumber'],
-                    )
-                    try:
-                        session.add(new_manufacturer)
-                        session.commit()
-                        session.refresh(new_manufacturer)
-                        manufacturer_id = new_manufacturer.id
-                        manufacturers[int(new_manufacturer.number)] = manufacturer_id
-                    except Exception as e:
-                        print(e)
-                        manufacturer_id = manufacturers['000000'] # default value if manufacturer is not found
-                        result['bad_data'] += 1
-                        result['errors'].append(str(e))
-                        session.rollback()
-
-                if not tool_id:
-                    new_tool = Tool(
-                        number=str(row['custpart']).upper(),
-                        manufacturer_name=f"{row['c_description']} - {row['c_description1']}",
-                        name=f"{row['c_description']} - {row['c_description1']}",
-                        manufacturer_id=manufacturer_id,
-                        tool_type_id=unknown_tool_type.id
-                    )
+            for rows in iter_excel_rows(wb, sheet_names, header_row, chunk_size_for(load_mode)):
+                rows_read += len(rows)
+                for row in rows:
                     try:
-                        session.add(new_tool)
-                        session.commit()
-                        session.refresh(new_tool)
-                        tool_id = new_tool.id
-                        tools[new_tool.number] = tool_id
+                        order_id = orders.get(f"{row.get('PONumber', '')}-{row.get('POLine', '')}")
+
+                        if not order_id:
+                            try:
+                                tool_id=tools.get(str(row['custpart']).upper())
+                                if not tool_id:
+                                    new_tool = Tool(
+                                        name=f"{row['PartDescription2']} - {row['PartDescription1']}",
+                                        number=str(row['custpart']).upper(),
+                                        tool_type_id=unknown_tool_type.id,
+                                        manufacturer_id=unknown_manufacturer.id
+                                    )
+                                    try:
+                                        session.add(new_tool)
+                                        session.commit()
+                                        session.refresh(new_tool)
+                                        tool_id = new_tool.id
+                                        tools[new_tool.number] = tool_id
+                                    except Exception as e:
+                                        result['bad_data'] += 1
+                                        result['errors'].append(str(e))
+                                        session.rollback()
+                                        continue
+
+                                new_order = ToolOrder(
+                                    tool_id=tool_id,
+                                    number=row['PONumber'].split('-')[0],
+                                    suffix=row['PONumber'].split('-')[1],
+                                    line=str(row['POLine']),
+                                    quantity=row['OrderQty'],
+                                    order_date=row['OrderDate'],
+                                    estimated_delivery_date=row['DueDate'],
+                                )
+                                session.add(new_order)
+                                session.commit()
+                                session.refresh(new_order)
+                                order_id = new_order.id
+                                orders[f"{new_order.number}-{new_order.suffix}-{new_order.line}"] = order_id
+                            except Exception as e:
+                                print(e)
+                                result['bad_data'] += 1
+                                result['errors'].append(str(e))
+                                session.rollback()
+                                continue
+
+                        records.append({
+                            'order_id': order_id,
+                            'quantity': row['ReceivedQty'],
+                            'delivery_date': row['ReceiptDate'],
+                        })
                     except Exception as e:
                         print(e)
-                        tool_id = None
+
+                # Write each chunk read from the workbook as one batch
+                if records:
+                    result = write_to_db(records, OrderDelivery, OrderDeliveryCreate, session, result, load_mode)
+                    records = []
+                progress.update(result, rows_read)
+    finally:
+        wb.close()
+
+    return result
+
+def import_tool_inventory(path: str, sheet_names: str, header_row: int, load_mode: str, progress, watermark: dt = None) -> dict:
+    """Import a tool inventory file, runs in an upload job worker"""
+    wb = load_workbook(path)
+    try:
+        progress.expect(count_excel_rows(wb, sheet_names, header_row))
+
+        with Session(engine) as session:
+            tools = session.exec(select(Tool)).all()
+            tools = {tool.number: tool for tool in tools}
+
+            # Prepare all valid records
+            result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+            rows_read = 0
+
+            for rows in iter_excel_rows(wb, sheet_names, header_row):
+                rows_read += len(rows)
+                for row in rows:
+                    tool = tools.get(row.get('Part Number', ''))
+
+                    if not tool:
                         result['bad_data'] += 1
-                        result['errors'].append(str(e))
-                        session.rollback()
+                        result['errors'].append(f"Tool {row.get('Part Number', '')} not found")
                         continue
 
-                records.append({
-                    'tool_id': tool_id,
-                    'quantity': row['OrderQty'],
-                    'number': str(row['PONumber']),
-                    'suffix': str(row['POSuffix']),
-                    'line': str(row['POLine']),
-                    'order_date': row['OrderDate'],
-                    'estimated_delivery_date': row['DueDate'],
-                    'tool_price': float(row.get('OpenCost', 0)),
-                    'gross_price': float(row.get('TotalCost', 0)),
-                })
-            except Exception as e:
-                print(e)
-
-            if len(records) > 100:
-                result = await write_to_db(records, ToolOrder, ToolOrderCreate, session, result)
-                records = []
-        
-        # Insert all records in a single operation, ignoring duplicates
-        if records:
-            result = await write_to_db(records, ToolOrder, ToolOrderCreate, session, result)
+                    tool.inventory = row.get('Total', 0)
+                    result['inserted'] += 1
+                    result['total_records'] += 1
+                progress.update(result, rows_read)
 
-    return JSONResponse(
-        content={"filename": file.filename, "type": "tool_order", 'result': result},
-        status_code=200
-    )
+            session.commit()
+    finally:
+        wb.close()
 
+    return result
 
-@router.post("/tool-delivery")
-async def upload_tool_deliveries(
-    file: UploadFile = File(...),
-    sheet_names: str = Form(None),
-    header_row: int = Form(None)
-) -> JSONResponse:
-    """Handle tool deliveries file upload"""
-    print(f'Processing tool deliveries file: {file.filename}')
+# Labels above the workpiece blocks of the hourly tracker, and the shift labels below each block
+PRODUCTION_BLOCK_LABELS = ['inner', 'outer']
+PRODUCTION_BLOCK_END_MARKERS = ['1st', '2nd', '3rd']
+# Header names of the hourly tracker columns, matched case-insensitively
+PRODUCTION_COLUMNS = {
+    'hour': ['hour', 'time', 'hours'],
+    'start_time': ['start time', 'from'],
+    'end_time': ['end time', 'to'],
+    'target': ['target', 'plan', 'goal'],
+    'started': ['started', 'start', 'input', 'loaded'],
+    'finished': ['finished', 'actual', 'output', 'good', 'completed'],
+    'comment': ['comment', 'comments', 'notes', 'remarks'],
+    'line': ['line'],
+    'workpiece': ['part', 'part number', 'material', 'workpiece'],
+    'date': ['date'],
+}
+
+def find_production_blocks(ws) -> list:
+    """
+    Find the inner/outer blocks of an hourly tracker sheet in a single pass over its rows.
+
+    A block starts below an 'inner'/'outer' label and ends above the first '1st'/'2nd'/'3rd' shift cell at or
+    right of the label's column, a shift cell right of the label also is the block's last column. Blocks can
+    sit side by side, each one then ends before the next label. The latest date seen above a block is used as
+    its production date.
+    """
+    open_blocks, blocks = [], []
+    latest_date = None
+    for values in ws.iter_rows(values_only=True):
+        closed = []
+        for column, value in enumerate(values):
+            if isinstance(value, str) and any(marker in value.lower() for marker in PRODUCTION_BLOCK_END_MARKERS):
+                # The marker closes the nearest open block to its left
+                block = max((block for block in open_blocks if block['column'] <= column),
+                            key=lambda block: block['column'], default=None)
+                if block is not None and block not in closed:
+                    if column > block['column']:
+                        block['rows'] = [row[:column - block['column'] + 1] for row in block['rows']]
+                    closed.append(block)
+            elif isinstance(value, date) and value.year >= 2000:
+                latest_date = value.date() if isinstance(value, dt) else value
+
+        for block in open_blocks:
+            if block not in closed:
+                block['rows'].append(values[block['column']:block['end']])
+        for block in closed:
+            open_blocks.remove(block)
+            blocks.append(block)
+
+        labels = [(column, value.strip().lower()) for column, value in enumerate(values)
+                  if isinstance(value, str) and value.strip().lower() in PRODUCTION_BLOCK_LABELS]
+        for index, (column, label) in enumerate(labels):
+            end = labels[index + 1][0] if index + 1 < len(labels) else None
+            open_blocks.append({'label': label, 'column': column, 'end': end, 'date': latest_date, 'rows': []})
+
+    return blocks
+
+def production_block_header(block: dict) -> list:
+    """Column keys of a block, from its two header rows, the second row falls back to the first"""
+    if len(block['rows']) < 2:
+        return []
+    first, second = block['rows'][0], block['rows'][1]
+    header = []
+    for index, name in enumerate(second):
+        if name is None and index < len(first):
+            name = first[index]
+        name = str(name).strip().lower() if name is not None else ''
+        header.append(next((key for key, aliases in PRODUCTION_COLUMNS.items() if name in aliases), None))
+    return header
+
+def parse_clock(value) -> time:
+    """A time of day from a time value, an Excel day fraction, an hour number or text like '6', '6:30' or '2pm'"""
+    if isinstance(value, dt):
+        return value.time()
+    if isinstance(value, time):
+        return value
+    if isinstance(value, (int, float)):
+        minutes = round(value * 1440) if 0 <= value < 1 else int(value) * 60
+        return time((minutes // 60) % 24, minutes % 60)
+    match = re.fullmatch(r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', str(value).strip().lower())
+    if not match:
+        raise ValueError(f"Invalid time: {value}")
+    hour, minute = int(match.group(1)), int(match.group(2) or 0)
+    if match.group(3) == 'pm' and hour < 12:
+        hour += 12
+    elif match.group(3) == 'am' and hour == 12:
+        hour = 0
+    return time(hour % 24, minute)
+
+def parse_hour_range(value) -> tuple:
+    """Start and end time of an hour cell like '6:00 - 7:00' or '6-7', a single time covers one hour"""
+    if isinstance(value, str):
+        parts = [part.strip() for part in value.replace('–', '-').split('-') if part.strip()]
+        if not parts:
+            raise ValueError(f"Invalid hour: {value}")
+        start = parse_clock(parts[0])
+        if len(parts) > 1:
+            return start, parse_clock(parts[1])
+    else:
+        start = parse_clock(value)
+    return start, (dt.combine(date.min, start) + timedelta(hours=1)).time()
+
+def parse_sheet_date(sheet_name: str) -> date:
+    """Date in a sheet name like '10-17-2025' or '10.17.25', None if there is none"""
+    match = re.search(r'\d{1,4}[-./]\d{1,2}[-./]\d{2,4}', sheet_name)
+    if match:
+        text = re.sub(r'[./]', '-', match.group())
+        for format in ('%m-%d-%Y', '%m-%d-%y', '%Y-%m-%d'):
+            try:
+                return dt.strptime(text, format).date()
+            except ValueError:
+                continue
+    return None
+
+def load_production_lookups(session: Session) -> dict:
+    """Lines and workpieces to resolve the production blocks with"""
+    workpieces = session.exec(select(Workpiece.id, Workpiece.name, Workpiece.description, Workpiece.material)).all()
+    by_name = {}
+    for workpiece_id, *names in workpieces:
+        for name in names:
+            if name:
+                by_name.setdefault(str(name).strip().lower(), workpiece_id)
+    return {
+        'lines': {name.lower(): line_id for line_id, name in session.exec(select(Line.id, Line.name)).all()},
+        'workpieces': workpieces,
+        'workpieces_by_name': by_name,
+        'workpiece_lines': set(session.exec(select(WorkpieceLine.workpiece_id, WorkpieceLine.line_id)).all()),
+    }
+
+def find_line_id(value, sheet_name: str, lookups: dict):
+    """Line of a row's line cell, or the line named in the sheet name"""
+    if value is not None:
+        return lookups['lines'].get(str(value).strip().lower())
+    sheet_name = sheet_name.lower()
+    return next((line_id for name, line_id in sorted(lookups['lines'].items(), key=lambda item: -len(item[0]))
+                 if name in sheet_name), None)
+
+def find_workpiece_id(value, label: str, line_id, lookups: dict):
+    """Workpiece of a row's part cell, or the workpiece named after the block label, preferably one of the line"""
+    if value is not None:
+        return lookups['workpieces_by_name'].get(str(value).strip().lower())
+    candidates = [workpiece_id for workpiece_id, *names in lookups['workpieces']
+                  if any(name and label in str(name).lower() for name in names)]
+    on_line = [workpiece_id for workpiece_id in candidates if (workpiece_id, line_id) in lookups['workpiece_lines']]
+    return (on_line or candidates or [None])[0]
+
+def cell_int(value) -> int:
+    if value is None or value == '':
+        return 0
+    return int(round(float(value)))
+
+def production_block_records(block: dict, sheet_name: str, lookups: dict) -> tuple:
+    """Map the hour rows of a block to Production records, returns the records and the errors of invalid rows"""
+    header = production_block_header(block)
+    records, errors = [], []
+    for values in block['rows'][2:]:
+        row = {key: value for key, value in zip(header, values) if key is not None}
+        hour = row.get('hour', row.get('start_time'))
+        # Blank, total and not yet filled in rows
+        if hour is None or (isinstance(hour, str) and not re.search(r'\d', hour)):
+            continue
+        if all(row.get(key) in (None, '') for key in ('target', 'started', 'finished')):
+            continue
+        try:
+            start_time, end_time = parse_hour_range(hour)
+            if row.get('start_time') is not None and row.get('end_time') is not None:
+                start_time, end_time = parse_clock(row['start_time']), parse_clock(row['end_time'])
+            production_date = to_date(row['date']) if row.get('date') is not None else block['date'] or parse_sheet_date(sheet_name)
+            if production_date is None:
+                raise ValueError(f"No date found for the {block['label']} block")
+            line_id = find_line_id(row.get('line'), sheet_name, lookups)
+            workpiece_id = find_workpiece_id(row.get('workpiece'), block['label'], line_id, lookups)
+            if workpiece_id is None:
+                raise ValueError(f"Unknown workpiece: {row.get('workpiece') or block['label']}")
+            finished = cell_int(row.get('finished'))
+            # Trackers without a started column only count finished parts
+            started = cell_int(row.get('started')) if 'started' in row else finished
+            records.append({
+                'date': production_date,
+                'start_time': start_time,
+                'end_time': end_time,
+                'workpiece_id': workpiece_id,
+                'line_id': line_id,
+                'quantity': finished,
+                'target': cell_int(row.get('target')),
+                'started': started,
+                'finished': finished,
+                'comment': str(row['comment']) if row.get('comment') not in (None, '') else None,
+            })
+        except Exception as e:
+            errors.append(f"{block['label']} {hour}: {e}")
+    return records, errors
+
+def write_productions(session: Session, records: list, result: dict) -> dict:
+    """Upsert production records by date, start time, workpiece and line in one statement"""
+    # A slot listed twice in the upload is written once, the later row wins
+    records = list({(record['date'], record['start_time'], record['workpiece_id'], record['line_id']): record
+                    for record in records}.values())
+    if records:
+        statement = insert(Production).values(records)
+        session.exec(statement.on_conflict_do_update(
+            constraint='uq_production_slot',
+            set_={column: statement.excluded[column]
+                  for column in ('end_time', 'quantity', 'target', 'started', 'finished', 'comment')}
+        ))
+        session.commit()
+        result['total_records'] += len(records)
+        result['inserted'] += len(records)
+    return result
 
-    df = await read_excel(file, sheet_names, header_row)
+def import_hourly_production(path: str, sheet_names: str, header_row: int, load_mode: str, progress, watermark: dt = None) -> dict:
+    """Import the inner/outer blocks of hourly tracker sheets as Production rows, runs in an upload job worker"""
+    wb = load_workbook(path)
+    try:
+        progress.expect(count_excel_rows(wb, sheet_names))
+
+        with Session(engine) as session:
+            lookups = load_production_lookups(session)
+            result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+            rows_read = 0
+            for sheet_name in get_sheet_list(wb, sheet_names):
+                ws = wb[sheet_name]
+                records = []
+                for block in find_production_blocks(ws):
+                    block_records, errors = production_block_records(block, sheet_name, lookups)
+                    records.extend(block_records)
+                    result['bad_data'] += len(errors)
+                    result['total_records'] += len(errors)
+                    result['errors'].extend(errors)
+                result = write_productions(session, records, result)
+                rows_read += ws.max_row or 0
+                progress.update(result, rows_read)
+    finally:
+        wb.close()
 
-    if df is None:
+    return result
+
+upload_jobs.register('tool-consumption', import_tool_consumption)
+upload_jobs.register('parts-produced', import_parts_produced)
+upload_jobs.register('tool-orders', import_tool_orders)
+upload_jobs.register('tool-delivery', import_tool_deliveries)
+# Inventory counts are a snapshot that is meant to be applied again, even from the same file
+upload_jobs.register('tool-inventory', import_tool_inventory, ledger=False)
+upload_jobs.register('hourlyProduction', import_hourly_production, ledger=False)
+
+async def queue_upload(upload_type: str, file: UploadFile, sheet_names: str = None, header_row: int = None,
+                       load_mode: str = 'insert', force: bool = False) -> JSONResponse:
+    """Store the upload and queue its import, the response only carries the job id to poll"""
+    if not file.filename.lower().endswith('.xlsx'):
         return JSONResponse(
-            content={"filename": file.filename, "type": "tool_delivery", "error": "Failed to read file"},
-            status_code=400
+            status_code=400,
+            content={"error": "Unsupported file type or failed to read file", "filename": file.filename}
         )
 
-    necessary_columns = ['PONumber', 'POLine', 'custpart', 'OrderQty', 'DueDate', 'OrderDate', 'ReceiptDate', 'ReceivedQty']
-    missing_columns = [col for col in necessary_columns if col not in df.columns]
-    if missing_columns:
+    content = await file.read()
+    job_id, imported = await asyncio.to_thread(
+        upload_jobs.create, upload_type, file.filename, content, sheet_names, header_row, load_mode, force
+    )
+    if imported is not None:
+        # Exact re-upload, nothing to import
         return JSONResponse(
-            status_code=400,
             content={
-                "error": f"Missing required columns: {', '.join(missing_columns)}",
                 "filename": file.filename,
-                "type": "tool_delivery"
-            }
+                "type": upload_type,
+                "duplicate": True,
+                "imported_at": imported.created_at.isoformat(),
+                "imported_filename": imported.filename,
+                "result": {'total_records': imported.total_records, 'inserted': 0,
+                           'skipped': imported.total_records, 'bad_data': 0, 'errors': []},
+            },
+            status_code=200
         )
+    return JSONResponse(
+        content={"filename": file.filename, "type": upload_type, "job_id": job_id},
+        status_code=202
+    )
 
+def upload_job_to_dict(job: UploadJob) -> dict:
+    return {
+        'id': job.id,
+        'type': job.upload_type,
+        'filename': job.filename,
+        'load_mode': job.load_mode,
+        'status': job.status,
+        'rows_total': job.rows_total,
+        'rows_read': job.rows_read,
+        'result': {
+            'total_records': job.total_records,
+            'inserted': job.inserted,
+            'skipped': job.skipped,
+            'bad_data': job.bad_data,
+            'errors': job.errors or [],
+        },
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+@router.get("/jobs")
+async def list_upload_jobs(limit: int = 20):
+    """The most recent upload jobs, newest first"""
     with Session(engine) as session:
-        orders = session.exec(select(ToolOrder)).all()
-        orders = {f'{order.number}-{order.suffix}-{order.line}': order.id for order in orders}
-        
-        tools = session.exec(select(Tool)).all()
-        tools = {tool.number: tool.id for tool in tools}
+        jobs = session.exec(select(UploadJob).order_by(UploadJob.id.desc()).limit(limit)).all()
+        return [upload_job_to_dict(job) for job in jobs]
 
-        unknown_manufacturer = session.exec(select(Manufacturer).where(Manufacturer.name == 'Undefined')).first()
-        unknown_tool_type = session.exec(select(ToolType).where(ToolType.name == 'Undefined')).first()
+@router.get("/jobs/{job_id}")
+async def get_upload_job(job_id: int):
+    """Status, progress and result counts of an upload job"""
+    with Session(engine) as session:
+        job = session.get(UploadJob, job_id)
+        if job is None:
+            return JSONResponse(status_code=404, content={"error": f"Upload job {job_id} not found"})
+        return upload_job_to_dict(job)
 
-        # Prepare all valid records
-        records = []
-        result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+@router.post("/tool-consumption")
+async def upload_tool_consumption(
+    file: UploadFile = File(...),
+    sheet_names: str = Form(None),
+    header_row: int = Form(None),
+    load_mode: str = Form('insert'),
+    force: bool = Form(False)
+)-> JSONResponse:
+    """Queue a tool consumption file upload
 
-        for _, row in df.iterrows():
-            try:
-                order_id = orders.get(f"{row.get('PONumber', '')}-{row.get('POLine', '')}")
+    Returns:
+        dict: A dictionary containing the following keys:
+            - filename (str): The name of the uploaded file.
+            - type (str): The type of the upload, e.g., "tool-consumption".
+            - job_id (int): The id of the upload job, its progress and result counts are
+              available at /upload/jobs/{job_id}.
+        If the same file was imported before (and force isn't set), no job is queued and the
+        response has "duplicate": true with the result of the earlier import instead.
+    """
+    print(f'Queueing tool consumption file: {file.filename}')
+    return await queue_upload('tool-consumption', file, sheet_names, header_row, load_mode, force)
 
-                if not order_id:
-                    try:
-                        tool_id=tools.get(str(row['custpart']).upper())
-                        if not tool_id:
-                            new_tool = Tool(
-                                name=f"{row['PartDescription2']} - {row['PartDescription1']}",
-                                number=str(row['custpart']).upper(),
-                                tool_type_id=unknown_tool_type.id,
-                                manufacturer_id=unknown_manufacturer.id
-                            )
-                            try:
-                                session.add(new_tool)
-                                session.commit()
-                                session.refresh(new_tool)
-                                tool_id = new_tool.id
-                                tools[new_tool.number] = tool_id
-                            except Exception as e:
-                                result['bad_data'] += 1
-                                result['errors'].append(str(e))
-                                session.rollback()
-                                continue
-                    
-                        new_order = ToolOrder(
-                            tool_id=tool_id,
-                            number=row['PONumber'].split('-')[0],
-                            suffix=row['PONumber'].split('-')[1],
-                            line=str(row['POLine']),
-                            quantity=row['OrderQty'],
-                            order_date=row['OrderDate'],
-                            estimated_delivery_date=row['DueDate'],
-                        )
-                        session.add(new_order)
-                        session.commit()
-                        session.refresh(new_order)
-                        order_id = new_order.id
-                        orders[f"{new_order.number}-{new_order.suffix}-{new_order.line}"] = order_id
-                    except Exception as e:
-                        print(e)
-                        result['bad_data'] += 1
-                        result['errors'].append(str(e))
-                        session.rollback()
-                        continue
 
-                records.append({
-                    'order_id': order_id,
-                    'quantity': row['ReceivedQty'],
-                    'delivery_date': row['ReceiptDate'],
-                })
-            except Exception as e:
-                print(e)
+@router.post("/parts-produced")
+async def upload_parts_produced(
+    file: UploadFile = File(...),
+    sheet_names: str = Form(None),
+    header_row: int = Form(None),
+    load_mode: str = Form('insert'),
+    force: bool = Form(False)
+) -> JSONResponse:
+    """Queue a parts production file upload"""
+    print(f'Queueing parts production file: {file.filename}')
+    return await queue_upload('parts-produced', file, sheet_names, header_row, load_mode, force)
+
 
-            if len(records) > 100:
-                result = await write_to_db(records, OrderDelivery, OrderDeliveryCreate, session, result)
-                records = []
+@router.post("/tool-orders")
+async def upload_tool_orders(
+    file: UploadFile = File(...),
+    sheet_names: str = Form(None),
+    header_row: int = Form(None),
+    load_mode: str = Form('insert'),
+    force: bool = Form(False)
+) -> JSONResponse:
+    """Queue a tool orders file upload"""
+    print(f'Queueing tool orders file: {file.filename}')
+    return await queue_upload('tool-orders', file, sheet_names, header_row, load_mode, force)
 
-        
-        # Insert all records in a single operation, ignoring duplicates
-        if records:
-            result = await write_to_db(records, OrderDelivery, OrderDeliveryCreate, session, result)
 
-    return JSONResponse(
-        content={"filename": file.filename, "type": "tool_delivery", 'result': result},
-        status_code=200
-    )
+@router.post("/tool-delivery")
+async def upload_tool_deliveries(
+    file: UploadFile = File(...),
+    sheet_names: str = Form(None),
+    header_row: int = Form(None),
+    load_mode: str = Form('insert'),
+    force: bool = Form(False)
+) -> JSONResponse:
+    """Queue a tool deliveries file upload"""
+    print(f'Queueing tool deliveries file: {file.filename}')
+    return await queue_upload('tool-delivery', file, sheet_names, header_row, load_mode, force)
 
 
 @router.post("/tool-inventory")
@@ -657,42 +1238,9 @@ async def upload_tool_inventory(
     sheet_names: str = Form(None),
     header_row: int = Form(None)
 ) -> JSONResponse:
-    """Handle tool inventory file upload"""
-    print(f'Processing tool inventory file: {file.filename}')
-
-    df = await read_excel(file, sheet_names, header_row)
-
-    if df is None:
-        return JSONResponse(
-            content={"filename": file.filename, "type": "tool_inventory", "error": "Failed to read file"},
-            status_code=400
-        )
-
-    with Session(engine) as session:      
-        tools = session.exec(select(Tool)).all()
-        tools = {tool.number: tool for tool in tools}
-
-        # Prepare all valid records
-        result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
-
-        for _, row in df.iterrows():
-            tool = tools.get(row.get('Part Number', ''))
-
-            if not tool:
-                result['bad_data'] += 1
-                result['errors'].append(f"Tool {row.get('Part Number', '')} not found")
-                continue
-
-            tool.inventory = row.get('Total', 0)
-            result['inserted'] += 1
-            result['total_records'] += 1
-            
-        session.commit()
-
-    return JSONResponse(
-        content={"filename": file.filename, "type": "tool_inventory", 'result': result},
-        status_code=200
-    )
+    """Queue a tool inventory file upload"""
+    print(f'Queueing tool inventory file: {file.filename}')
+    return await queue_upload('tool-inventory', file, sheet_names, header_row)
 
 
 @router.post("/hourlyProduction")
@@ -700,61 +1248,6 @@ async def upload_production(
     file: UploadFile = File(...),
     sheet_names: str = Form(None),
 ) -> JSONResponse:
-    try:
-        content = await file.read()
-        await file.seek(0)  # Reset file pointer for future reads
-        xlsx = io.BytesIO(content)
-        wb = openpyxl.load_workbook(xlsx, data_only=True)
-    except Exception as e:
-        print(f"Error loading Excel file: {e}")
-        return JSONResponse(
-            content={"filename": file.filename, "type": "production", "error": "Failed to read file"},
-            status_code=400
-        )
-    
-    # Read the selected sheet and find inners and outers
-    ws = wb[sheet_names]
-    locations = {}
-    workpiece_type = None
-    start, end = None, None
-    for row in ws.iter_rows():
-        for cell in row:
-            if isinstance(cell.value, str) and cell.value.lower() in ['inner', 'outer']:
-                workpiece_type = cell.value.lower()
-                start = (cell.column, cell.row + 1)
-            if start:
-                if cell.column < start[0]:
-                    continue
-                if isinstance(cell.value, str) and any(ordinal in cell.value.lower() for ordinal in ['1st', '2nd', '3rd']):
-                    end = (cell.column, cell.row - 1)
-                    break
-            if start and end:
-                locations[workpiece_type] = {
-                    'start': start,
-                    'end': end
-                }
-                start, end, workpiece_type = None, None, None
-            
-    # clean up the headers and create dataframes
-    for workpiece_type, loc in locations.items():
-        workpiece_values = []
-        for row in ws.iter_rows(min_row=loc['start'][1], max_row=loc['end'][1], min_col=loc['start'][0], max_col=loc['end'][0]):
-            row_values = []
-            for cell in row:
-                row_values.append(cell.value)
-            workpiece_values.append(row_values)
-        line_1 = workpiece_values.pop(0)
-        for i in range(len(workpiece_values[0])):
-            if workpiece_values[0][i] is None and line_1[i] is not None:
-                workpiece_values[0][i] = line_1[i]
-        locations[workpiece_type] = pd.DataFrame(workpiece_values[1:], columns=workpiece_values[0])
-
-    # Save data from dataframes in Database
-    with Session(engine) as session:
-        pass # TODO: implement saving logic
-
-    result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0}
-    return JSONResponse(
-        content={"filename": file.filename, "type": "hourly_production", 'result': result},
-        status_code=200
-    )
+    """Queue an hourly production file upload"""
+    print(f'Queueing hourly production file: {file.filename}')
+    return await queue_upload('hourlyProduction', file, sheet_names)
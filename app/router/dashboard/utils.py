@@ -1,7 +1,92 @@
 from datetime import datetime, timedelta
-from collections import defaultdict
 import numpy as np
 from typing import List, Tuple
+from sqlalchemy import Date, cast, distinct, func, literal_column
+from sqlmodel import Session, select
+
+def window_start(timestamp: datetime, window: str) -> datetime:
+    """Return the start (midnight) of the 'day', 'week' (Monday) or 'month' window containing timestamp"""
+    if window == 'day':
+        date = timestamp.date()
+    elif window == 'week':
+        # Get start of week (Monday)
+        date = timestamp.date() - timedelta(days=timestamp.weekday())
+    elif window == 'month':
+        date = timestamp.replace(day=1).date()
+    else:
+        raise ValueError(f"Invalid window type: {window}")
+    return datetime.combine(date, datetime.min.time())
+
+# Windows tried from fine to coarse until a series fits its point budget
+WINDOWS = ['day', 'week', 'month']
+
+def series_arrays(records: List[dict], timestamp_attr: str, value_attr: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Timestamps (datetime64[us]) and numeric values of a list of records"""
+    timestamps = np.array([record.get(timestamp_attr) for record in records], dtype='datetime64[us]')
+    values = np.array([record.get(value_attr) for record in records])
+    if not np.issubdtype(values.dtype, np.number):
+        # e.g. Decimal prices
+        values = values.astype(float)
+    return timestamps, values
+
+def window_keys(days: np.ndarray, window: str) -> np.ndarray:
+    """Start of the 'day', 'week' (Monday) or 'month' window of every datetime64[D] day"""
+    if window == 'day':
+        return days
+    if window == 'week':
+        # 1970-01-01 was a Thursday, so the weekday (Monday = 0) is (days since epoch + 3) % 7
+        return days - (days.astype(np.int64) + 3) % 7
+    if window == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Invalid window type: {window}")
+
+def condense_arrays(timestamps: np.ndarray, values: np.ndarray, max_points: int = None, window: str = None,
+                    average: bool = True) -> Tuple[np.ndarray, np.ndarray, str]:
+    """
+    Average (or sum) the values per time window in one pass over the arrays.
+
+    The days are made unique once, the window keys are derived from the unique days only, so trying the
+    windows costs nothing per point. Without a window the finest one that fits max_points is used, falling
+    back to 'month'.
+
+    Returns:
+        Window starts (datetime64[D]), their values and the window used
+    """
+    days, day_index = np.unique(timestamps.astype('datetime64[D]'), return_inverse=True)
+    for window in [window] if window else WINDOWS:
+        keys, key_index = np.unique(window_keys(days, window), return_inverse=True)
+        if max_points is None or len(keys) <= max_points:
+            break
+    # Map every point to its window through its day
+    index = key_index.reshape(-1)[day_index.reshape(-1)]
+    sums = np.bincount(index, weights=values, minlength=len(keys))
+    if average:
+        sums = sums / np.bincount(index, minlength=len(keys))
+    return keys, sums, window
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last point are kept, every bucket in between keeps the point spanning the largest triangle
+    with the point kept before it and the average of the next bucket, which preserves peaks and dips.
+    """
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    kept = np.empty(max_points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
 
 def condense_data_points(records: List[dict], 
                          timestamp_attr: str = 'timestamp', 
@@ -21,69 +106,92 @@ def condense_data_points(records: List[dict],
     Returns:
         List of (timestamp, average_value) tuples
     """
-    # Group records by time window
-    grouped_data = defaultdict(list)
-    for record in records:
-        timestamp = record.get(timestamp_attr)
-        value = record.get(value_attr)
-        
-        if window == 'day':
-            key = timestamp.date()
-        elif window == 'week':
-            # Get start of week (Monday)
-            key = timestamp.date() - timedelta(days=timestamp.weekday())
-        elif window == 'month':
-            key = timestamp.replace(day=1).date()
-        else:
-            raise ValueError(f"Invalid window type: {window}")
-        
-        grouped_data[key].append(value)
-    
-    # Calculate averages for each window
-    condensed_records = []
-    for date, values in sorted(grouped_data.items()):
-        if average and values:
-            result_value = np.mean(values)
-        else:
-            result_value = sum(values)
-        timestamp = datetime.combine(date, datetime.min.time())
-        condensed_records.append((timestamp, result_value))
-    
-    return condensed_records
+    if not records:
+        return []
+    timestamps, values = series_arrays(records, timestamp_attr, value_attr)
+    keys, condensed, _ = condense_arrays(timestamps, values, window=window, average=average)
+    return list(zip(keys.astype('datetime64[us]').tolist(), condensed.tolist()))
 
 def get_condensed_data(records: List[dict], 
                        max_points: int = 100, 
                        timestamp_attr: str = 'timestamp', 
                        value_attr: str = 'reached_life', 
-                       average: bool=True
+                       average: bool=True,
+                       mode: str = 'window'
                        ) -> List[Tuple[datetime, float]]:
     """
     Get condensed data points, automatically choosing the appropriate time window
     to keep the number of points under max_points.
     
     Args:
-        records: List of records with timestamp and value attributes
+        records: List of records with timestamp and value attributes, ordered by timestamp
         max_points: Maximum number of points to return
         timestamp_attr: Name of the timestamp attribute on records
         value_attr: Name of the value attribute to average
+        mode: 'window' averages (or sums) per day/week/month, 'lttb' keeps the max_points most
+              significant raw points instead, which preserves peaks
     
     Returns:
-        List of (timestamp, average_value) tuples
+        List of [isoformat timestamp, value] points and the window used
+        ('month' if the data didn't need condensing, None for 'lttb')
     """
-    # Start with raw data points
-    # condensed_data = [(getattr(record, timestamp_attr), getattr(record, value_attr)) 
-    condensed_data = [(record.get(timestamp_attr), record.get(value_attr))
-                      for record in records]
-    
-    # Condense data if needed
-    windows = ['day', 'week', 'month']
-    window_idx = 0
-    while len(condensed_data) > max_points and window_idx < len(windows):
-        condensed_data = condense_data_points(records, timestamp_attr, value_attr, windows[window_idx], average)
-        window_idx += 1
-
-    condensed_data_list = []
-    for data_point in condensed_data:
-        condensed_data_list.append([data_point[0].isoformat(), data_point[1]])
-
-    return condensed_data_list, windows[window_idx-1]
+    if len(records) <= max_points:
+        return [[record.get(timestamp_attr).isoformat(), record.get(value_attr)] for record in records], WINDOWS[-1]
+
+    timestamps, values = series_arrays(records, timestamp_attr, value_attr)
+    if mode == 'lttb':
+        seconds = (timestamps - timestamps[0]) / np.timedelta64(1, 's')
+        kept = lttb_indices(seconds, values.astype(float), max_points)
+        return [[records[i].get(timestamp_attr).isoformat(), records[i].get(value_attr)] for i in kept.tolist()], None
+    if mode != 'window':
+        raise ValueError(f"Invalid condensation mode: {mode}")
+
+    keys, condensed, window = condense_arrays(timestamps, values, max_points, average=average)
+    if not average and np.issubdtype(values.dtype, np.integer):
+        condensed = condensed.round().astype(np.int64)
+    return [list(point) for point in zip(np.datetime_as_string(keys.astype('datetime64[s]')).tolist(),
+                                         condensed.tolist())], window
+
+def date_bucket(column, window: str):
+    """date_trunc of a timestamp column to the start of its 'day', 'week' (Monday) or 'month' window"""
+    if window not in WINDOWS:
+        raise ValueError(f"Invalid window type: {window}")
+    # Inlined, a bound parameter would make the grouped expression differ from the selected one
+    return func.date_trunc(literal_column(f"'{window}'"), column)
+
+def choose_window(distinct_days: int, first: datetime, last: datetime, max_points: int) -> str:
+    """Finest window whose bucket count, estimated from the span of a series, fits max_points"""
+    span_days = (last.date() - first.date()).days
+    estimates = {
+        'day': distinct_days,
+        'week': min(distinct_days, (span_days + first.weekday()) // 7 + 1),
+        'month': min(distinct_days, (last.year - first.year) * 12 + last.month - first.month + 1),
+    }
+    return next((window for window in WINDOWS if estimates[window] <= max_points), WINDOWS[-1])
+
+def query_condensed_data(db: Session, timestamp_column, value_column, *criteria,
+                         max_points: int = 100, average: bool = True) -> Tuple[List[list], str]:
+    """
+    Condensed [isoformat timestamp, value] points of a series, aggregated by the database.
+
+    Same result shape as get_condensed_data, but only the points are downloaded: a count/min/max probe
+    picks the window and the buckets are averaged (or summed) in a date_trunc grouped query.
+
+    Args:
+        timestamp_column, value_column: Columns of the series
+        criteria: Where clauses selecting the rows of the series
+    """
+    count, distinct_days, first, last = db.exec(
+        select(func.count(), func.count(distinct(cast(timestamp_column, Date))),
+               func.min(timestamp_column), func.max(timestamp_column))
+        .where(*criteria)
+    ).one()
+    if count <= max_points:
+        rows = db.exec(select(timestamp_column, value_column).where(*criteria).order_by(timestamp_column)).all()
+        return [[timestamp.isoformat(), value] for timestamp, value in rows], WINDOWS[-1]
+
+    window = choose_window(distinct_days, first, last, max_points)
+    bucket = date_bucket(timestamp_column, window)
+    aggregate = func.avg(value_column) if average else func.sum(value_column)
+    rows = db.exec(select(bucket, aggregate).where(*criteria).group_by(bucket).order_by(bucket)).all()
+    return [[timestamp.isoformat(), float(value) if average else value] for timestamp, value in rows], window
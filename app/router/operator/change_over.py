@@ -1,28 +1,33 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from app.database_config import get_session
+from app.database_config import get_async_session
 from app.models import LogDevice, Machine, Recipe, ChangeOver, User, Workpiece, WorkpieceGroup
-from auth import get_current_device, get_current_operator
+from auth import get_async_current_device, get_async_current_operator
 
 router = APIRouter()
 
 @router.get("/machines")
-async def change_over_page(device: LogDevice = Depends(get_current_device), session: Session = Depends(get_session)):
+async def change_over_page(device: LogDevice = Depends(get_async_current_device), session: AsyncSession = Depends(get_async_session)):
     # Get all active machines for the current device
-    machines = session.exec(select(Machine).where(Machine.id.in_(device.machines), Machine.active)).all()
+    machines = (await session.exec(
+        select(Machine).where(Machine.id.in_([machine.id for machine in device.machines]), Machine.active)
+    )).all()
     
     return {"machines": machines}
 
 @router.get("/{machine_id}")
-async def get_recipes(machine_id: int, session: Session = Depends(get_session)):
+async def get_recipes(machine_id: int, session: AsyncSession = Depends(get_async_session)):
     # Get all active recipes for the selected machine
-    recipes = session.exec(select(Recipe)
-                           .where(Recipe.machine_id == machine_id, Recipe.active)
-                           .outerjoin(Recipe.workpiece)
-                           .outerjoin(Recipe.workpiece_group)
-                           .order_by(Workpiece.name.asc().nullsfirst(), Recipe.workpiece_group_id)
-                           ).all()
+    recipes = (await session.exec(select(Recipe)
+                                  .where(Recipe.machine_id == machine_id, Recipe.active)
+                                  .outerjoin(Recipe.workpiece)
+                                  .outerjoin(Recipe.workpiece_group)
+                                  .order_by(Workpiece.name.asc().nullsfirst(), Recipe.workpiece_group_id)
+                                  .options(selectinload(Recipe.workpiece), selectinload(Recipe.workpiece_group))
+                                  )).all()
     recipes_json = [
         {
             "id": recipe.id,
@@ -40,9 +45,9 @@ async def get_recipes(machine_id: int, session: Session = Depends(get_session)):
 @router.post("/")
 async def perform_change_over(
     request: Request,
-    current_operator: User = Depends(get_current_operator),
-    device: LogDevice = Depends(get_current_device),
-    session: Session = Depends(get_session)
+    current_operator: User = Depends(get_async_current_operator),
+    device: LogDevice = Depends(get_async_current_device),
+    session: AsyncSession = Depends(get_async_session)
 ):
     form_data = await request.form()
     machine_id = int(form_data['machine_id'])
@@ -54,8 +59,9 @@ async def perform_change_over(
         raise HTTPException(status_code=400, detail="Invalid machine selection")
 
     # Get the selected machine and recipe
-    machine = session.get(Machine, machine_id)
-    recipe = session.get(Recipe, recipe_id)
+    machine = await session.get(Machine, machine_id)
+    recipe = await session.get(Recipe, recipe_id,
+                               options=[selectinload(Recipe.workpiece), selectinload(Recipe.workpiece_group)])
 
     if not machine or not recipe:
         raise HTTPException(status_code=404, detail="Machine or recipe not found")
@@ -71,7 +77,7 @@ async def perform_change_over(
         performed_by=current_operator.id
     )
     session.add(change_over)
-    session.commit()
+    await session.commit()
 
     # Get the appropriate name (workpiece or group)
     workpiece_name = recipe.workpiece.name if recipe.workpiece else (recipe.workpiece_group.name if recipe.workpiece_group else 'N/A')
@@ -1,24 +1,31 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from auth import get_current_operator, get_current_device
+from auth import get_async_current_operator, get_async_current_device
 
 from datetime import datetime, timedelta
+import asyncio
+import json
 
-from app.database_config import get_session
+from app.database_config import get_async_session
 from app.models import ToolLife, Machine, ToolPosition, ChangeReason, User, LogDevice, Recipe, Note
+from app.broadcast import broadcast
+from app.router.dashboard.tool_lifes import tool_life_cache, TOOL_LIFE_CHANNEL
+from app.report_cube import refresh_report_cube_job
 
 router = APIRouter()
 
 @router.get("/")
 async def get_tool_life_data(machine_id: int, 
-                             db: Session = Depends(get_session)):
+                             db: AsyncSession = Depends(get_async_session)):
     
-    machine: Machine = db.exec(select(Machine)
+    machine: Machine = (await db.exec(select(Machine)
                       .where(Machine.id == machine_id)
-                    #   .options(joinedload(Machine.measureables))
-                      ).unique().one_or_none()
+                      .options(selectinload(Machine.measureables),
+                               selectinload(Machine.current_recipe).selectinload(Recipe.tool_positions))
+                      )).one_or_none()
     if not machine:
         raise HTTPException(status_code=404, detail="Machine not found or ambiguous")
 
@@ -27,14 +34,17 @@ async def get_tool_life_data(machine_id: int,
         raise HTTPException(status_code=404, detail="No current recipe for this machine")
 
     time_threshold = datetime.now() - timedelta(minutes=15)
-    recent_tool_lives = db.exec(
-        select(ToolLife)
+    recent_tool_lives = (await db.exec(
+        select(ToolLife.machine_channel, ToolLife.tool_position_id)
+        .join(ToolPosition, ToolPosition.id == ToolLife.tool_position_id)
         .where(ToolLife.machine_id == machine.id)
         .where(ToolLife.recipe_id == current_recipe.id)
         .where(ToolLife.timestamp >= time_threshold)
-    ).all()
+        .where(ToolPosition.selected)
+    )).all()
 
-    recent_tool_lives = [{"machine_channel": tl.machine_channel, "tool_position_id": tl.tool_position_id} for tl in recent_tool_lives if tl.tool_position.selected]
+    recent_tool_lives = [{"machine_channel": machine_channel, "tool_position_id": tool_position_id}
+                         for machine_channel, tool_position_id in recent_tool_lives]
 
     tool_positions = [position for position in current_recipe.tool_positions if position.selected]
     measureables = [measureable for measureable in machine.measureables if measureable.active]
@@ -50,9 +60,11 @@ async def get_tool_life_data(machine_id: int,
 @router.get("/change-reasons")
 async def get_change_reasons(
     tool_position_id: int,
-    db: Session = Depends(get_session)
+    db: AsyncSession = Depends(get_async_session)
 ):
-    tool_position = db.exec(select(ToolPosition).where(ToolPosition.id == tool_position_id)).first()
+    tool_position = (await db.exec(
+        select(ToolPosition).where(ToolPosition.id == tool_position_id).options(selectinload(ToolPosition.tool))
+    )).first()
     if not tool_position:
         raise HTTPException(status_code=404, detail="Tool position not found")
 
@@ -60,7 +72,7 @@ async def get_change_reasons(
     if not tool:
         raise HTTPException(status_code=404, detail="No tool associated with this position")
 
-    change_reasons = db.exec(select(ChangeReason).where(ChangeReason.tool_type_id == tool.tool_type_id)).all()
+    change_reasons = (await db.exec(select(ChangeReason).where(ChangeReason.tool_type_id == tool.tool_type_id))).all()
 
     return {
         "change_reasons": change_reasons
@@ -70,9 +82,9 @@ async def get_change_reasons(
 @router.post("/")
 async def log_tool_life(
     request: Request,
-    current_operator: User = Depends(get_current_operator),
-    device: LogDevice = Depends(get_current_device),
-    session: Session = Depends(get_session)
+    current_operator: User = Depends(get_async_current_operator),
+    device: LogDevice = Depends(get_async_current_device),
+    session: AsyncSession = Depends(get_async_session)
 ):
     form_data = await request.json()
 
@@ -82,19 +94,20 @@ async def log_tool_life(
     reached_life = int(form_data['reached_life'])
 
     # Get machine and verify it belongs to the device
-    machine = session.get(Machine, machine_id)
+    # The device's machines already are in the session, populate_existing loads the line for them as well
+    machine = await session.get(Machine, machine_id, options=[selectinload(Machine.line)], populate_existing=True)
     if not machine or machine.id not in [m.id for m in device.machines]:
         raise HTTPException(status_code=400, detail="Invalid machine selection")
 
     # Get tool position with recipe loaded
-    tool_position = session.exec(
+    tool_position = (await session.exec(
         select(ToolPosition)
         .where(ToolPosition.id == tool_position_id)
         .options(
             selectinload(ToolPosition.recipe).selectinload(Recipe.workpiece),
             selectinload(ToolPosition.recipe).selectinload(Recipe.workpiece_group)
         )
-    ).first()
+    )).first()
     
     if not tool_position:
         raise HTTPException(status_code=404, detail="Tool position not found")
@@ -124,7 +137,24 @@ async def log_tool_life(
     )
 
     session.add(tool_life)
-    session.commit()
+    await session.commit()
+
+    # New data for the tool life dashboards, connected clients get it pushed as a delta
+    tool_life_cache.invalidate()
+    asyncio.create_task(refresh_report_cube_job())
+    try:
+        await broadcast.publish(channel=TOOL_LIFE_CHANNEL, message=json.dumps({
+            "tool_id": tool_life.tool_id,
+            "machine_id": machine.id,
+            "line": machine.line.name if machine.line else None,
+            "machine": machine.name,
+            "machine_channel": tool_life.machine_channel,
+            "workpiece_id": workpiece_id,
+            "timestamp": tool_life.timestamp.isoformat(),
+            "reached_life": tool_life.reached_life
+        }))
+    except Exception as e:
+        print(f"Error publishing tool life {tool_life.id}: {e}")
 
     # Get the workpiece/group name for the response
     workpiece_name = 'N/A'
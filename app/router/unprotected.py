@@ -1,10 +1,13 @@
 from fastapi import APIRouter, Depends, Request
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import selectinload
 from datetime import datetime
 from fastapi.responses import JSONResponse
 from app.models import LogDevice, Heartbeat
 from app.models import User, Shift
-from app.database_config import get_session
+from app.database_config import get_async_session
+from app.heartbeats import heartbeat_buffer
 
 
 
@@ -12,13 +15,15 @@ router = APIRouter()
 
 
 @router.get("/usersByShift")
-async def users_by_shift(session: Session = Depends(get_session)):
-    users = session.exec(select(User).where(User.active).where(User.shift.has())).all()
+async def users_by_shift(session: AsyncSession = Depends(get_async_session)):
+    users = (await session.exec(
+        select(User).where(User.active).where(User.shift.has()).options(selectinload(User.shift))
+    )).all()
     users_by_shift = {}
     active_shift = None
     now = datetime.now().time()
 
-    shifts = session.exec(select(Shift).where(Shift.number < 4)).all()
+    shifts = (await session.exec(select(Shift).where(Shift.number < 4))).all()
     for shift in shifts:
         start_time = shift.start_time
         end_time = shift.end_time
@@ -52,7 +57,7 @@ async def users_by_shift(session: Session = Depends(get_session)):
 #     return JSONResponse(content={"message": "Heartbeat recorded successfully"}, status_code=200)
 
 @router.post("/heartbeat")
-async def heartbeat(request: Request, session: Session = Depends(get_session)):
+async def heartbeat(request: Request, session: AsyncSession = Depends(get_async_session)):
     try:
         # Try to get data from JSON body first
         data = await request.json()
@@ -68,15 +73,11 @@ async def heartbeat(request: Request, session: Session = Depends(get_session)):
     if not device_token:
         return JSONResponse(content={"error": "Log Device token not provided"}, status_code=400)
     
-    # Try to find device by token first
-    log_device = session.exec(select(LogDevice).filter(LogDevice.token == device_token)).one_or_none()
-    
-    # If not found, try to find by name (MAC address)
-    if log_device is None:
-        log_device = session.exec(select(LogDevice).filter(LogDevice.name == device_token)).one_or_none()
-    
+    # Resolve the device id from the token cache, the database is only asked on a cache miss
+    device_id = await heartbeat_buffer.resolve(session, device_token)
+
     # If still not found, return error
-    if log_device is None:
+    if device_id is None:
         return JSONResponse(content={"error": "Log Device not found"}, status_code=404)
 
     # Get client IP address using headers or fallback to request.client.host
@@ -88,15 +89,7 @@ async def heartbeat(request: Request, session: Session = Depends(get_session)):
         if not client_ip:
             client_ip = request.client.host if hasattr(request, 'client') else None
     
-    # Update the log device's IP address if it has changed
-    log_device.last_seen = datetime.now()
-    if client_ip and log_device.ip_address != client_ip:
-        log_device.ip_address = client_ip
-    session.add(log_device)
-    
-    # Create a new Heartbeat record
-    logged_heartbeat = Heartbeat(timestamp=datetime.now(), log_device_id=log_device.id)
-    session.add(logged_heartbeat)
-    session.commit()
+    # Buffer the heartbeat and last_seen/IP update, they are written in bulk by the heartbeat buffer
+    heartbeat_buffer.record(device_id, client_ip)
 
     return JSONResponse(content={"message": "Heartbeat recorded successfully", "success": True}, status_code=200)
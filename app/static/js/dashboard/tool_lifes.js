@@ -63,8 +63,32 @@ function updateChart(chartInstance, newOption, chartId) {
     chartInstance.resize();
 }
 
+// Merge a single new tool life point into an existing series without redrawing the chart
+function applySeriesUpsert({ graph_id, series_id, point }) {
+    const chartInstance = window.echartsInstances[graph_id];
+    if (!chartInstance) return;
+
+    const series = (chartInstance.getOption().series || []).find(s => s.id === series_id);
+    if (!series) return;
+
+    // Condensed series update their last window bucket, raw series get a new point
+    const seriesData = series.data.slice();
+    const last = seriesData[seriesData.length - 1];
+    if (last && last[0] === point[0]) {
+        seriesData[seriesData.length - 1] = point;
+    } else {
+        seriesData.push(point);
+    }
+    chartInstance.setOption({ series: [{ id: series_id, data: seriesData }] });
+}
+
 // Function to handle incoming WebSocket messages and update charts accordingly
 function handleWebSocketMessage(response) {
+    if (response.op === 'upsert') {
+        applySeriesUpsert(response);
+        return;
+    }
+
     const { graphs, data } = response;
     
     // First, make sure all chart containers exist in the DOM
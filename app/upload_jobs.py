@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from uuid import uuid4
+
+from dotenv import dotenv_values
+from sqlalchemy import update
+from sqlmodel import Session, select, func
+
+from app import event_listener  # noqa: F401, registers the ORM event listeners in the worker processes too
+from app.database_config import engine
+from app.models import UploadJob, UploadLedger
+from app.report_cube import refresh_report_cube
+
+env = dotenv_values('.env')
+
+# Uploaded files are kept here until their job has finished
+UPLOAD_DIR = Path(env.get('UPLOAD_DIR') or 'uploads')
+# Worker processes importing uploads, more than one lets uploads of different types run side by side
+UPLOAD_WORKERS = int(env.get('UPLOAD_WORKERS') or 1)
+# Seconds between progress writes of a running job
+UPLOAD_PROGRESS_SECONDS = 1
+# Validation errors kept on the job row
+UPLOAD_JOB_MAX_ERRORS = 100
+
+
+class UploadJobProgress:
+    """Passed to the importers, writes the running counts of a job to its row at most every `interval` seconds"""
+
+    def __init__(self, job_id: int, interval: float = UPLOAD_PROGRESS_SECONDS):
+        self.job_id = job_id
+        self.interval = interval
+        self.result = {'total_records': 0, 'inserted': 0, 'bad_data': 0, 'skipped': 0, 'errors': []}
+        self.rows_read = 0
+        self._written = 0.0
+
+    def expect(self, rows_total: int):
+        self._write(rows_total=rows_total)
+
+    def update(self, result: dict, rows_read: int):
+        self.result, self.rows_read = result, rows_read
+        if time.monotonic() - self._written >= self.interval:
+            self._write(**self._counts())
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self._write(**self._counts(), status=status, error=error, finished_at=datetime.now())
+
+    def _counts(self) -> dict:
+        return {
+            'rows_read': self.rows_read,
+            'total_records': self.result['total_records'],
+            'inserted': self.result['inserted'],
+            'skipped': self.result['skipped'],
+            'bad_data': self.result['bad_data'],
+            'errors': self.result['errors'][:UPLOAD_JOB_MAX_ERRORS],
+        }
+
+    def _write(self, **values):
+        with Session(engine) as session:
+            session.exec(update(UploadJob).where(UploadJob.id == self.job_id).values(**values))
+            session.commit()
+        self._written = time.monotonic()
+
+
+def record_in_ledger(job_id: int, result: dict):
+    """Add a finished job of a ledger upload type to the ledger, with the latest row date it imported"""
+    with Session(engine) as session:
+        job = session.get(UploadJob, job_id)
+        if job.content_hash is None:
+            return
+        session.add(UploadLedger(
+            content_hash=job.content_hash,
+            upload_type=job.upload_type,
+            sheet_names=job.sheet_names,
+            header_row=job.header_row,
+            filename=job.filename,
+            watermark=result.get('watermark'),
+            total_records=result['total_records'],
+            inserted=result['inserted'],
+            upload_job_id=job.id,
+        ))
+        session.commit()
+
+
+def run_upload_job(job_id: int, importer: Callable) -> str:
+    """Import an upload in a worker process, returns the final status of the job"""
+    with Session(engine) as session:
+        job = session.get(UploadJob, job_id)
+        job.status = 'running'
+        job.started_at = datetime.now()
+        session.commit()
+        path, sheet_names, header_row, load_mode, watermark = (
+            job.path, job.sheet_names, job.header_row, job.load_mode, job.watermark
+        )
+
+    print(f"Upload job {job_id}: importing {path}" + (f", rows from {watermark} on" if watermark else ""))
+    progress = UploadJobProgress(job_id)
+    try:
+        result = importer(path, sheet_names, header_row, load_mode, progress, watermark)
+        progress.update(result, progress.rows_read)
+        record_in_ledger(job_id, result)
+        progress.finish('done')
+        try:
+            # The reports read the imported rows from the daily fact cube
+            refresh_report_cube()
+        except Exception as e:
+            print(f"Upload job {job_id}: error refreshing the report cube: {e}")
+        print(f"Upload job {job_id}: done, {progress.result['inserted']} inserted, "
+              f"{progress.result['skipped']} skipped, {progress.result['bad_data']} bad")
+        return 'done'
+    except Exception as e:
+        traceback.print_exc()
+        progress.finish('failed', str(e))
+        return 'failed'
+    finally:
+        Path(path).unlink(missing_ok=True)
+
+
+class UploadJobRunner:
+    """
+    Run uploads as jobs in a process pool, so parsing and validating a large file neither blocks the event
+    loop nor holds the GIL of the web process.
+
+    The upload is stored in UPLOAD_DIR and recorded as an UploadJob row, the worker writes its progress to
+    that row, which is what the upload page polls. Queued jobs are resumed after a restart.
+    """
+
+    def __init__(self, workers: int = UPLOAD_WORKERS):
+        self.workers = workers
+        self.importers: Dict[str, Callable] = {}
+        self.ledger_types = set()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def register(self, upload_type: str, importer: Callable, ledger: bool = True):
+        """
+        Importers are called as importer(path, sheet_names, header_row, load_mode, progress, watermark) and
+        return the result counts. Uploads of ledger types are skipped if the same file was imported before.
+        """
+        self.importers[upload_type] = importer
+        if ledger:
+            self.ledger_types.add(upload_type)
+
+    def start(self):
+        # Spawned workers start with a fresh interpreter and database engine instead of a fork of the web process
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+        with Session(engine) as session:
+            # A running job was cut off by a restart, rerunning it could apply stock updates twice
+            session.exec(
+                update(UploadJob)
+                .where(UploadJob.status == 'running')
+                .values(status='failed', error='Interrupted by a server restart', finished_at=datetime.now())
+            )
+            session.commit()
+            queued = session.exec(
+                select(UploadJob.id, UploadJob.upload_type).where(UploadJob.status == 'queued').order_by(UploadJob.id)
+            ).all()
+        for job_id, upload_type in queued:
+            self.submit(job_id, upload_type)
+
+    async def stop(self):
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+
+    def create(self, upload_type: str, filename: str, content: bytes, sheet_names: Optional[str] = None,
+               header_row: Optional[int] = None, load_mode: str = 'insert',
+               force: bool = False) -> Tuple[Optional[int], Optional[UploadLedger]]:
+        """
+        Store the uploaded file, record the job and queue it, returns the job id.
+
+        For ledger upload types an exact re-upload (same content, sheets and header row) isn't queued, its
+        ledger entry is returned instead. Other files only import the rows from the latest watermark of the
+        upload type on. `force` imports the whole file regardless.
+        """
+        content_hash, watermark = None, None
+        if upload_type in self.ledger_types:
+            content_hash = hashlib.sha256(content).hexdigest()
+            if not force:
+                with Session(engine) as session:
+                    imported = session.exec(
+                        select(UploadLedger)
+                        .where(UploadLedger.content_hash == content_hash,
+                               UploadLedger.upload_type == upload_type,
+                               UploadLedger.sheet_names.is_not_distinct_from(sheet_names),
+                               UploadLedger.header_row.is_not_distinct_from(header_row))
+                        .order_by(UploadLedger.id.desc())
+                    ).first()
+                    if imported is not None:
+                        return None, imported
+                    watermark = session.exec(
+                        select(func.max(UploadLedger.watermark)).where(UploadLedger.upload_type == upload_type)
+                    ).one()
+
+        path = UPLOAD_DIR / f"{uuid4().hex}{Path(filename).suffix}"
+        path.write_bytes(content)
+        with Session(engine) as session:
+            job = UploadJob(
+                upload_type=upload_type,
+                filename=filename,
+                path=str(path),
+                content_hash=content_hash,
+                sheet_names=sheet_names,
+                header_row=header_row,
+                load_mode=load_mode,
+                watermark=watermark,
+            )
+            session.add(job)
+            session.commit()
+            job_id = job.id
+        self.submit(job_id, upload_type)
+        return job_id, None
+
+    def submit(self, job_id: int, upload_type: str):
+        future = self._executor.submit(run_upload_job, job_id, self.importers[upload_type])
+        future.add_done_callback(lambda future: self._job_done(job_id, future))
+
+    def _job_done(self, job_id: int, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            # The worker died (e.g. out of memory) before it could record the failure itself
+            print(f"Upload job {job_id} crashed: {error}")
+            with Session(engine) as session:
+                session.exec(
+                    update(UploadJob)
+                    .where(UploadJob.id == job_id, UploadJob.status.in_(['queued', 'running']))
+                    .values(status='failed', error=str(error) or 'Worker process crashed', finished_at=datetime.now())
+                )
+                session.commit()
+
+
+upload_jobs = UploadJobRunner()
@@ -1,12 +1,14 @@
 from fastapi import HTTPException, Depends, Cookie, Request, status
 from fastapi.responses import JSONResponse
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import selectinload
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from app.database_config import get_session, engine
+from app.database_config import get_session, get_async_session
 from app.models import LogDevice
 from app.models import User, UserRole
+from app.heartbeats import heartbeat_buffer
 from dotenv import dotenv_values
 
 
@@ -18,84 +20,85 @@ def create_token(data: dict):
     return encoded_jwt
 
 
-async def get_current_device(device_token: str = Cookie(None)):
-    with Session(engine) as session:
-        if not device_token:
-            raise HTTPException(status_code=401, detail="Device token missing")
-        try:
-            payload = jwt.decode(device_token, env['SECRET_KEY'], algorithms=[env['ALGORITHM']])
-            device_name: str = payload.get("sub")
-            if device_name is None:
-                raise HTTPException(status_code=401, detail="Invalid device token")
-            device: LogDevice = session.exec(select(LogDevice)
-                                   .where(LogDevice.name == device_name)
-                                   .options(selectinload(LogDevice.machines))).one_or_none()
-            if device is None or device.token != device_token:
-                raise HTTPException(status_code=401, detail="Device not found or token mismatch")
-            
-            # Check if token is expired in database
-            if device.token_expiry < datetime.now():
-                raise HTTPException(status_code=401, detail="Device token expired")
-            
-            # Refresh expiration time in database
-            device.token_expiry = datetime.now() + timedelta(days=int(env['DEVICE_TOKEN_EXPIRE_DAYS']))
-            print("Device Expiry updated/extended")
-            session.commit()
-            session.refresh(device)
-            return device
-        
-        except JWTError:
-            raise HTTPException(status_code=401, detail="Invalid device token")
-
-
-async def get_current_operator(request: Request):
-    with Session(engine) as session:
-        operator_token = request.cookies.get("operator_token")
-        try:
-            if not operator_token:
-                raise HTTPException(
-                    status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-                    headers={'Location': '/login'}
-                )
-            payload = jwt.decode(operator_token, env['SECRET_KEY'], algorithms=[env['ALGORITHM']])
-            operator_cred: str = payload.get("sub")
-            if operator_cred is None:
-                raise HTTPException(
-                    status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-                    headers={'Location': '/login'}
-                )
-            initials, pin = operator_cred.split(':')
-            operator = session.exec(
-                select(User)
-                .where(User.pin == pin)
-                .where(User.initials == initials)
-            ).one_or_none()
-            
-            if operator is None or operator.token != operator_token:
-                raise HTTPException(
-                    status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-                    headers={'Location': '/login'}
-                )
-            
-            # Check if token is expired in database
-            if operator.token_expiry < datetime.now():
-                raise HTTPException(
-                    status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-                    headers={'Location': '/login'}
-                )
-            
-            # Refresh expiration time in database
-            operator.token_expiry = datetime.now() + timedelta(minutes=int(env['OPERATOR_TOKEN_EXPIRE_MINUTES']))
-            session.commit()
-            session.refresh(operator)
-            print("Operator Expiry updated/extended")
-            return operator
-
-        except JWTError as e:
-            raise HTTPException(
-                status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-                headers={'Location': '/login'}
-            )
+# The auth dependencies come in two variants that share the request's session with the handler: the sync ones
+# for the routers on get_session and the async ones for the kiosk routers on get_async_session. Mixing them
+# would check out a connection from each pool per request. Only the queries and the commit differ between them.
+
+DEVICE_AUTH_ERRORS = {
+    'missing': "Device token missing",
+    'invalid': "Invalid device token",
+    'mismatch': "Device not found or token mismatch",
+    'expired': "Device token expired",
+}
+
+
+def device_auth_error(reason: str) -> HTTPException:
+    return HTTPException(status_code=401, detail=DEVICE_AUTH_ERRORS[reason])
+
+
+def operator_auth_error(reason: str) -> HTTPException:
+    # Operators are sent to the login page whatever the reason
+    return HTTPException(
+        status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+        headers={'Location': '/login'}
+    )
+
+
+def token_subject(token: str, auth_error) -> str:
+    """Subject of a token cookie, raises auth_error if the token is missing or invalid"""
+    if not token:
+        raise auth_error('missing')
+    try:
+        payload = jwt.decode(token, env['SECRET_KEY'], algorithms=[env['ALGORITHM']])
+    except JWTError:
+        raise auth_error('invalid')
+    subject: str = payload.get("sub")
+    if subject is None:
+        raise auth_error('invalid')
+    return subject
+
+
+def extend_token(row, token: str, lifetime: timedelta, auth_error):
+    """Check the token of a loaded device or operator against the database and extend its expiry, the caller commits"""
+    if row is None or row.token != token:
+        raise auth_error('mismatch')
+
+    # Check if token is expired in database
+    if row.token_expiry < datetime.now():
+        raise auth_error('expired')
+
+    # Refresh expiration time in database
+    row.token_expiry = datetime.now() + lifetime
+
+
+def device_statement(device_token: str):
+    device_name = token_subject(device_token, device_auth_error)
+    return select(LogDevice).where(LogDevice.name == device_name).options(selectinload(LogDevice.machines))
+
+
+def operator_statement(operator_token: str):
+    initials, pin = token_subject(operator_token, operator_auth_error).split(':')
+    return select(User).where(User.pin == pin).where(User.initials == initials)
+
+
+async def get_current_device(device_token: str = Cookie(None), session: Session = Depends(get_session)):
+    device: LogDevice = session.exec(device_statement(device_token)).one_or_none()
+    extend_token(device, device_token, timedelta(days=int(env['DEVICE_TOKEN_EXPIRE_DAYS'])), device_auth_error)
+    print("Device Expiry updated/extended")
+    session.commit()
+    session.refresh(device)
+    return device
+
+
+async def get_current_operator(request: Request, session: Session = Depends(get_session)):
+    operator_token = request.cookies.get("operator_token")
+    operator = session.exec(operator_statement(operator_token)).one_or_none()
+    extend_token(operator, operator_token, timedelta(minutes=int(env['OPERATOR_TOKEN_EXPIRE_MINUTES'])),
+                 operator_auth_error)
+    session.commit()
+    session.refresh(operator)
+    print("Operator Expiry updated/extended")
+    return operator
 
 
 def require_role(required_role: UserRole):
@@ -106,6 +109,33 @@ def require_role(required_role: UserRole):
     return check_role
 
 
+async def get_async_current_device(device_token: str = Cookie(None), session: AsyncSession = Depends(get_async_session)):
+    device: LogDevice = (await session.exec(device_statement(device_token))).one_or_none()
+    extend_token(device, device_token, timedelta(days=int(env['DEVICE_TOKEN_EXPIRE_DAYS'])), device_auth_error)
+    print("Device Expiry updated/extended")
+    # Not expired on commit, the machines stay loaded for the handler
+    await session.commit()
+    return device
+
+
+async def get_async_current_operator(request: Request, session: AsyncSession = Depends(get_async_session)):
+    operator_token = request.cookies.get("operator_token")
+    operator = (await session.exec(operator_statement(operator_token))).one_or_none()
+    extend_token(operator, operator_token, timedelta(minutes=int(env['OPERATOR_TOKEN_EXPIRE_MINUTES'])),
+                 operator_auth_error)
+    await session.commit()
+    print("Operator Expiry updated/extended")
+    return operator
+
+
+def require_async_role(required_role: UserRole):
+    async def check_role(request: Request, user: User = Depends(get_async_current_operator)):
+        if user.role < required_role:
+            raise HTTPException(status_code=401, detail="Forbidden: Insufficient permissions")
+        return user
+    return check_role
+
+
 async def authenticate_or_create_device(device_name: str, db: Session = Depends(get_session)):
     log_device = db.exec(select(LogDevice).where(LogDevice.name == device_name)).one_or_none()
     if log_device is None:
@@ -123,6 +153,8 @@ async def authenticate_or_create_device(device_name: str, db: Session = Depends(
     log_device.token_expiry = datetime.now() + timedelta(days=int(env['DEVICE_TOKEN_EXPIRE_DAYS']))
     log_device.last_seen = datetime.now()
     db.commit()
+    # Heartbeats with the replaced token must not resolve from the cache anymore
+    heartbeat_buffer.forget_device(log_device.id)
 
     response = JSONResponse(content={"message": "Device authenticated"})
     response.set_cookie(
@@ -137,23 +169,22 @@ async def authenticate_or_create_device(device_name: str, db: Session = Depends(
     return response
 
 
-async def authenticate_operator(initials: str, pin: str):
-    with Session(engine) as session:
-        operator = session.exec(select(User).where(User.initials == initials, User.pin == pin)).one_or_none()
-        if operator is None:
-            raise HTTPException(status_code=401, detail="Invalid initials or PIN")
-        
-        if not operator.active:
-            raise HTTPException(status_code=401, detail="Account is deactivated")
+async def authenticate_operator(initials: str, pin: str, session: Session):
+    operator = session.exec(select(User).where(User.initials == initials, User.pin == pin)).one_or_none()
+    if operator is None:
+        raise HTTPException(status_code=401, detail="Invalid initials or PIN")
+    
+    if not operator.active:
+        raise HTTPException(status_code=401, detail="Account is deactivated")
 
-        # Create token without expiration in JWT
-        access_token = create_token(
-            data={"sub": f'{operator.initials}:{operator.pin}'}
-        )
+    # Create token without expiration in JWT
+    access_token = create_token(
+        data={"sub": f'{operator.initials}:{operator.pin}'}
+    )
 
-        operator.token = access_token
-        operator.token_expiry = datetime.now() + timedelta(minutes=int(env['OPERATOR_TOKEN_EXPIRE_MINUTES']))
-        session.commit()
+    operator.token = access_token
+    operator.token_expiry = datetime.now() + timedelta(minutes=int(env['OPERATOR_TOKEN_EXPIRE_MINUTES']))
+    session.commit()
 
     response = JSONResponse(content={"message": "Operator authenticated", "redirect": "/"})
     response.set_cookie(
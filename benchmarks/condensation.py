@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the time series condensation of the dashboards.
+
+Condenses synthetic tool life series of --points points spread over --days days with the previous per-window
+Python grouping and with the NumPy kernel in both modes, and prints the time per call:
+
+    uv run python benchmarks/condensation.py --points 1000 100000 1000000
+
+No database is needed.
+"""
+import argparse
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.router.dashboard.utils import get_condensed_data, window_start  # noqa: E402
+
+MAX_POINTS = 100
+
+
+def previous_condensation(records: list, max_points: int = MAX_POINTS):
+    """The condensation before the NumPy kernel: regroup all records per window until the points fit"""
+    condensed = [(record['timestamp'], record['reached_life']) for record in records]
+    windows = ['day', 'week', 'month']
+    window_idx = 0
+    while len(condensed) > max_points and window_idx < len(windows):
+        grouped = defaultdict(list)
+        for record in records:
+            grouped[window_start(record['timestamp'], windows[window_idx])].append(record['reached_life'])
+        condensed = [(timestamp, np.mean(values)) for timestamp, values in sorted(grouped.items())]
+        window_idx += 1
+    return [[timestamp.isoformat(), value] for timestamp, value in condensed], windows[window_idx - 1]
+
+
+def make_records(points: int, days: int, seed: int = 42) -> list:
+    random.seed(seed)
+    start = datetime(2020, 1, 1)
+    seconds = sorted(random.randrange(days * 86400) for _ in range(points))
+    return [{'timestamp': start + timedelta(seconds=s), 'reached_life': random.randint(100, 5000)} for s in seconds]
+
+
+def timed(function, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run(point_counts: list, days: int):
+    for points in point_counts:
+        records = make_records(points, days)
+        previous = timed(previous_condensation, records)
+        window = timed(get_condensed_data, records, MAX_POINTS)
+        lttb = timed(get_condensed_data, records, MAX_POINTS, mode='lttb')
+        print(f"{points:>9} points: previous {previous * 1000:9.1f}ms, window {window * 1000:9.1f}ms "
+              f"({previous / window:5.1f}x), lttb {lttb * 1000:9.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--days", type=int, default=5 * 365)
+    args = parser.parse_args()
+    run(args.points, args.days)
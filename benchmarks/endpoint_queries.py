@@ -0,0 +1,65 @@
+"""
+Statement budget check of the dashboard endpoints.
+
+Calls each endpoint of ENDPOINT_BUDGETS on a running server, reads the statement count from the Server-Timing
+header the monitoring middleware adds and fails if an endpoint runs more statements than its budget, which
+catches relationship loads that crept back into a loop:
+
+    uv run python benchmarks/endpoint_queries.py --url http://localhost:8000 --days 365
+
+Statements that depend on the amount of data show up as a count that grows with --days.
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.query_stats import statement_count  # noqa: E402
+
+# (method, path, uses the dashboard filter): maximum number of statements
+ENDPOINT_BUDGETS = {
+    ('GET', '/dashboard/tools/api/unique_tools', True): 8,
+    ('GET', '/dashboard/tools/api/cpu', True): 12,
+    ('GET', '/dashboard/opportunities/api/ranked', True): 12,
+    ('GET', '/dashboard/reports/api/data', True): 24,
+    ('POST', '/dashboard/reliability/api/log_reliability', False): 4,
+    ('GET', '/dashboard/api/filter-options', False): 6,
+}
+
+
+def run(url: str, days: int) -> bool:
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    filter_params = {'start_date': start_date.isoformat(), 'end_date': end_date.isoformat(),
+                     'selected_operations': '[]', 'selected_products': '[]'}
+
+    passed = True
+    with httpx.Client(base_url=url, timeout=120) as client:
+        for (method, path, filtered), budget in ENDPOINT_BUDGETS.items():
+            if method == 'POST':
+                response = client.post(path, json={'start_date': start_date.isoformat(),
+                                                   'end_date': end_date.isoformat()})
+            else:
+                response = client.get(path, params=filter_params if filtered else None)
+            count = statement_count(response.headers)
+            if count is None:
+                print(f"{method} {path}: no Server-Timing header, is REQUEST_LOGGING switched off?")
+                passed = False
+                continue
+            ok = response.status_code < 400 and count <= budget
+            passed = passed and ok
+            print(f"{method:>4} {path:<45} {response.status_code} {count:4} statements (budget {budget:3})"
+                  f"{'' if ok else '  <- failed'}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.url, args.days) else 1)
@@ -0,0 +1,101 @@
+"""
+Event loop lag of the server under mixed dashboard and kiosk load.
+
+While `--dashboards` clients keep requesting the cost per piece report and `--tablets` tablets send heartbeats
+and machine list requests (see kiosk_pool.py), a probe requests /health every few milliseconds. /health doesn't
+touch the database, so its latency above the idle baseline is the time the event loop was blocked:
+
+    uv run python benchmarks/event_loop_lag.py --url http://localhost:8000 --initials AB --pin 1234
+
+Run it against a server on the commit before the async engine and on this one to compare.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from kiosk_pool import DEVICE_PREFIX, delete_devices, register, tablet
+
+PROBE_SECONDS = 0.02
+
+
+def percentiles(values: list) -> str:
+    quantiles = statistics.quantiles(values, n=100)
+    return (f"p50 {quantiles[49] * 1000:8.2f} ms  p99 {quantiles[98] * 1000:8.2f} ms  "
+            f"max {max(values) * 1000:8.2f} ms")
+
+
+async def probe(client: httpx.AsyncClient, latencies: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(PROBE_SECONDS)
+
+
+async def dashboard(client: httpx.AsyncClient, days: int, latencies: list, stop: asyncio.Event):
+    end_date = datetime.now()
+    params = {'start_date': (end_date - timedelta(days=days)).isoformat(), 'end_date': end_date.isoformat(),
+              'selected_operations': '[]', 'selected_products': '[]'}
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get("/dashboard/tools/api/cpu", params=params)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+
+async def run(url: str, dashboards: int, tablets: int, rounds: int, days: int, initials: str, pin: str):
+    async with httpx.AsyncClient(base_url=url, timeout=300) as client:
+        idle = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, idle, stop))
+        await asyncio.sleep(2)
+        stop.set()
+        await task
+
+        response = await client.post("/authenticateOperator", data={"initials": initials, "pin": pin})
+        response.raise_for_status()
+        clients = await asyncio.gather(*(register(url, f"{DEVICE_PREFIX}{n}", response.cookies["operator_token"])
+                                         for n in range(tablets)))
+
+        loaded, report_latencies = [], []
+        kiosk_latencies = {'heartbeat': [], 'machines': []}
+        stop = asyncio.Event()
+        background = [asyncio.create_task(probe(client, loaded, stop))]
+        background += [asyncio.create_task(dashboard(client, days, report_latencies, stop)) for _ in range(dashboards)]
+        try:
+            await asyncio.gather(*(tablet(tablet_client, rounds, kiosk_latencies) for tablet_client in clients))
+        finally:
+            stop.set()
+            await asyncio.gather(*background)
+            await asyncio.gather(*(tablet_client.aclose() for tablet_client in clients))
+
+    print(f"{'probe idle':>16}: {percentiles(idle)}")
+    print(f"{'probe loaded':>16}: {percentiles(loaded)}")
+    print(f"{'event loop lag':>16}: p99 {(statistics.quantiles(loaded, n=100)[98] - statistics.median(idle)) * 1000:.2f} ms")
+    for name, values in kiosk_latencies.items():
+        print(f"{name:>16}: {percentiles(values)}")
+    if report_latencies:
+        print(f"{'cpu report':>16}: {percentiles(report_latencies)} ({len(report_latencies)} requests)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--dashboards", type=int, default=4)
+    parser.add_argument("--tablets", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--initials", required=True, help="Operator the tablets are logged in as")
+    parser.add_argument("--pin", required=True)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args.url, args.dashboards, args.tablets, args.rounds, args.days, args.initials, args.pin))
+    finally:
+        # Heartbeats are deleted with their devices (ON DELETE CASCADE), wait for the last flush first
+        time.sleep(10)
+        delete_devices()
@@ -0,0 +1,78 @@
+"""
+Load test for the heartbeat endpoint, simulating a fleet of log devices.
+
+Creates `--devices` LogDevice rows named bench-device-<n> (removed again afterwards) and lets each of them
+send `--rounds` heartbeats against a running server, identified by name like a device without a token:
+
+    uv run python benchmarks/heartbeats.py --url http://localhost:8000 --devices 1000 --rounds 5
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import delete, insert
+from sqlmodel import Session
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.models import LogDevice  # noqa: E402
+
+DEVICE_PREFIX = "bench-device-"
+
+
+async def device(client: httpx.AsyncClient, url: str, name: str, rounds: int, latencies: list):
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = await client.post(f"{url}/unprotected/heartbeat", json={"device_token": name})
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+
+async def run(url: str, devices: int, rounds: int, concurrency: int):
+    names = [f"{DEVICE_PREFIX}{n}" for n in range(devices)]
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(device(client, url, name, rounds, latencies) for name in names))
+        duration = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} heartbeats from {devices} devices in {duration:.2f}s ({len(latencies) / duration:.0f}/s)")
+    print(f"p50: {quantiles[49] * 1000:.2f} ms")
+    print(f"p99: {quantiles[98] * 1000:.2f} ms")
+
+
+def create_devices(devices: int):
+    with Session(engine) as session:
+        session.execute(insert(LogDevice), [{"name": f"{DEVICE_PREFIX}{n}", "active": True} for n in range(devices)])
+        session.commit()
+
+
+def delete_devices():
+    with Session(engine) as session:
+        session.execute(delete(LogDevice).where(LogDevice.name.startswith(DEVICE_PREFIX)))
+        session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    delete_devices()
+    create_devices(args.devices)
+    try:
+        asyncio.run(run(args.url, args.devices, args.rounds, args.concurrency))
+    finally:
+        # Heartbeats are deleted with their devices (ON DELETE CASCADE), wait for the last flush first
+        time.sleep(10)
+        delete_devices()
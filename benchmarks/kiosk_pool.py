@@ -0,0 +1,114 @@
+"""
+Concurrency benchmark of the kiosk requests against the database connection pool.
+
+Registers `--tablets` log devices named bench-tablet-<n> (removed again afterwards), logs in the given operator
+once and lets every tablet send `--rounds` heartbeats and machine list requests against a running server, like
+the tablets on the shop floor do. The pool occupancy of the server is polled meanwhile:
+
+    uv run python benchmarks/kiosk_pool.py --url http://localhost:8000 --tablets 200 --initials AB --pin 1234
+
+Run it with different DB_POOL_SIZE/DB_MAX_OVERFLOW settings in the .env file to size the pool. A peak equal to
+the pool maximum means requests waited for a connection.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from sqlalchemy import delete
+from sqlmodel import Session
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.models import LogDevice  # noqa: E402
+
+DEVICE_PREFIX = "bench-tablet-"
+POOL_POLL_SECONDS = 0.05
+
+
+async def register(url: str, name: str, operator_token: str) -> httpx.AsyncClient:
+    """Client of one tablet, with the device and operator cookies a logged in tablet has"""
+    client = httpx.AsyncClient(base_url=url, timeout=60)
+    response = await client.post("/authenticateDevice", json={"device_name": name})
+    response.raise_for_status()
+    client.cookies.set("operator_token", operator_token)
+    return client
+
+
+async def tablet(client: httpx.AsyncClient, rounds: int, latencies: dict):
+    device_token = client.cookies.get("device_token")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        response = await client.post("/unprotected/heartbeat", json={"device_token": device_token})
+        latencies['heartbeat'].append(time.perf_counter() - start)
+        response.raise_for_status()
+
+        start = time.perf_counter()
+        response = await client.get("/operator/change_over/machines")
+        latencies['machines'].append(time.perf_counter() - start)
+        response.raise_for_status()
+
+
+async def poll_pool(client: httpx.AsyncClient, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        response = await client.get("/dashboard/api/requests/pool")
+        samples.append(response.json())
+        await asyncio.sleep(POOL_POLL_SECONDS)
+
+
+async def run(url: str, tablets: int, rounds: int, initials: str, pin: str):
+    async with httpx.AsyncClient(base_url=url, timeout=60) as monitor:
+        response = await monitor.post("/authenticateOperator", data={"initials": initials, "pin": pin})
+        response.raise_for_status()
+        operator_token = response.cookies["operator_token"]
+
+        clients = await asyncio.gather(*(register(url, f"{DEVICE_PREFIX}{n}", operator_token) for n in range(tablets)))
+        latencies = {'heartbeat': [], 'machines': []}
+        samples, stop = [], asyncio.Event()
+        poller = asyncio.create_task(poll_pool(monitor, samples, stop))
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(tablet(client, rounds, latencies) for client in clients))
+            duration = time.perf_counter() - start
+        finally:
+            stop.set()
+            await poller
+            await asyncio.gather(*(client.aclose() for client in clients))
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total} requests from {tablets} tablets in {duration:.2f}s ({total / duration:.0f} req/s)")
+    for name, values in latencies.items():
+        quantiles = statistics.quantiles(values, n=100)
+        print(f"{name:>10}: p50 {quantiles[49] * 1000:8.2f} ms  p99 {quantiles[98] * 1000:8.2f} ms  "
+              f"max {max(values) * 1000:8.2f} ms")
+    if samples:
+        peak = max(sample['checked_out'] for sample in samples)
+        print(f"pool: peak {peak} of {samples[-1]['max']} connections checked out, "
+              f"mean {statistics.mean(sample['checked_out'] for sample in samples):.1f}")
+
+
+def delete_devices():
+    with Session(engine) as session:
+        session.execute(delete(LogDevice).where(LogDevice.name.startswith(DEVICE_PREFIX)))
+        session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--tablets", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--initials", required=True, help="Operator the tablets are logged in as")
+    parser.add_argument("--pin", required=True)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args.url, args.tablets, args.rounds, args.initials, args.pin))
+    finally:
+        # Heartbeats are deleted with their devices (ON DELETE CASCADE), wait for the last flush first
+        time.sleep(10)
+        delete_devices()
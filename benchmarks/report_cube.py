@@ -0,0 +1,79 @@
+"""
+Benchmark of the daily fact cube behind the reports.
+
+Refreshes the cube, then computes the cost per piece rollup of the reports for the last --days days once from the
+fact tables and once from the cube, and times the reliability aggregates of all machines:
+
+    uv run python benchmarks/report_cube.py --days 365
+
+The cube is backfilled by the migrations, the refresh only picks up the rows added since. test_report_cube.py
+checks with pytest that both rollups give the same totals.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlmodel import Session
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.report_cube import refresh_report_cube  # noqa: E402
+from app.router.dashboard.filters import DashboardFilter  # noqa: E402
+from app.router.dashboard.reliability import load_reliability  # noqa: E402
+from app.router.dashboard.tools import compute_cpu  # noqa: E402
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+# Values of a tool entry of compute_cpu that are summed from the consumption and tool life facts
+CPU_TOTALS = ['weekly_consumption', 'cost_per_piece', 'average_life', 'percent_consumptions_recorded', 'total_records']
+
+
+def cpu_totals(cpu: dict) -> dict:
+    """{(line, product, operation, position, tool id): totals} of a compute_cpu rollup"""
+    return {
+        (line, product, operation, position, tool['tool_id']): tuple(tool[name] for name in CPU_TOTALS)
+        for line, line_entry in cpu.items()
+        for product, product_entry in line_entry['products'].items()
+        for operation, operation_entry in product_entry['operations'].items()
+        for position, position_entry in operation_entry['tool_positions'].items()
+        for tool in position_entry['tools']
+    }
+
+
+def cpu_differences(dashboard_filter: DashboardFilter, db: Session) -> list:
+    """Tool entries whose totals differ between the fact tables and the cube, as (key, facts, cube)"""
+    facts = cpu_totals(compute_cpu(dashboard_filter, db))
+    cube = cpu_totals(compute_cpu(dashboard_filter, db, from_cube=True))
+    return [(key, facts.get(key), cube.get(key)) for key in sorted(facts.keys() | cube.keys(), key=str)
+            if facts.get(key) != cube.get(key)]
+
+
+def run(days: int):
+    result, duration = timed(refresh_report_cube)
+    print(f"refresh: {result['days']} days, {result['rows']} rows in {duration:.2f}s")
+
+    end_date = datetime.now()
+    dashboard_filter = DashboardFilter(start_date=end_date - timedelta(days=days), end_date=end_date)
+    with Session(engine) as db:
+        for from_cube in (False, True):
+            cpu, duration = timed(compute_cpu, dashboard_filter, db, from_cube=from_cube)
+            print(f"cpu {'cube' if from_cube else 'facts':>5}: {len(cpu)} lines in {duration:.3f}s")
+        differences = cpu_differences(dashboard_filter, db)
+        print(f"cpu totals: {'equal' if not differences else f'{len(differences)} tools differ, e.g. {differences[0]}'}")
+        machines, duration = timed(load_reliability, db, dashboard_filter.start_date, end_date)
+        print(f"reliability: {len(machines)} machines in {duration:.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+    run(args.days)
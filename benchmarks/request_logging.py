@@ -0,0 +1,49 @@
+"""
+Load test for the request logging middleware.
+
+Start the server twice, once as usual and once with REQUEST_LOGGING=0 in the .env file, and run this
+script against each to compare the p50/p99 latencies with and without request logging:
+
+    uv run python benchmarks/request_logging.py --url http://localhost:8000/health --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, url: str, count: int, latencies: list):
+    for _ in range(count):
+        start = time.perf_counter()
+        response = await client.get(url)
+        latencies.append(time.perf_counter() - start)
+        response.raise_for_status()
+
+
+async def run(url: str, requests: int, concurrency: int):
+    latencies = []
+    async with httpx.AsyncClient(timeout=30) as client:
+        # Warm up connections before measuring
+        await asyncio.gather(*(client.get(url) for _ in range(concurrency)))
+
+        start = time.perf_counter()
+        per_worker = requests // concurrency
+        await asyncio.gather(*(worker(client, url, per_worker, latencies) for _ in range(concurrency)))
+        duration = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} requests in {duration:.2f}s ({len(latencies) / duration:.0f} req/s)")
+    print(f"p50: {quantiles[49] * 1000:.2f} ms")
+    print(f"p99: {quantiles[98] * 1000:.2f} ms")
+    print(f"max: {max(latencies) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000/health")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.requests, args.concurrency))
@@ -0,0 +1,43 @@
+"""
+Checks that the cost per piece rollup gives the same totals from the fact tables and from the daily fact cube,
+see report_cube.py:
+
+    uv run pytest benchmarks
+
+Skipped without a DATABASE_URL in the .env file or a reachable database.
+"""
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from dotenv import dotenv_values
+
+if not dotenv_values('.env').get('DATABASE_URL'):
+    pytest.skip("needs a DATABASE_URL in the .env file", allow_module_level=True)
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.report_cube import refresh_report_cube  # noqa: E402
+from app.router.dashboard.filters import DashboardFilter  # noqa: E402
+from report_cube import cpu_differences  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def refreshed_cube():
+    try:
+        refresh_report_cube()
+    except OperationalError as e:
+        pytest.skip(f"database not reachable: {e}")
+
+
+@pytest.mark.parametrize("days", [7, 30, 365])
+def test_cpu_totals_from_cube_match_facts(refreshed_cube, days):
+    end_date = datetime.now()
+    dashboard_filter = DashboardFilter(start_date=end_date - timedelta(days=days), end_date=end_date)
+    with Session(engine) as db:
+        assert cpu_differences(dashboard_filter, db) == []
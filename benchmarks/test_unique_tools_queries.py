@@ -0,0 +1,46 @@
+"""
+Pins the statement count of `get_unique_tool_data`, see unique_tools_queries.py:
+
+    uv run pytest benchmarks
+
+Skipped without a DATABASE_URL in the .env file, a reachable database or a recipe to select.
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from dotenv import dotenv_values
+
+if not dotenv_values('.env').get('DATABASE_URL'):
+    pytest.skip("needs a DATABASE_URL in the .env file", allow_module_level=True)
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.query_stats import assert_max_queries  # noqa: E402
+from app.router.dashboard import filters  # noqa: E402
+from app.router.dashboard.tools import get_unique_tool_data  # noqa: E402
+from unique_tools_queries import MAX_STATEMENTS, selection_cases  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def cases():
+    try:
+        cases = selection_cases(days=365)
+    except OperationalError as e:
+        pytest.skip(f"database not reachable: {e}")
+    if not cases:
+        pytest.skip("needs at least one recipe in the database")
+    return cases
+
+
+def test_unique_tools_statement_count(cases):
+    for name, dashboard_filter in cases:
+        # Count the selection resolution as well
+        filters._resolved.clear()
+        with Session(engine) as db, assert_max_queries(MAX_STATEMENTS, f"unique tools of {name}"):
+            asyncio.run(get_unique_tool_data(dashboard_filter=dashboard_filter, db=db))
@@ -0,0 +1,104 @@
+"""
+Benchmark fixture for the tool consumption upload.
+
+Generates an ERP consumption export with `--rows` rows from the tools, machines, users and workpieces in the
+database and uploads it to a running server, printing how long the import took:
+
+    uv run python benchmarks/tool_consumption.py --url http://localhost:8000 --rows 200000
+
+Use --output to only write the fixture file, e.g. to upload it through the dashboard, and --repeat to upload
+the same file again, which the upload ledger should skip.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import openpyxl
+from sqlmodel import Session, select
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.models import Machine, Tool, User, Workpiece  # noqa: E402
+
+HEADER = ['TransDate', 'TransactionId', 'Qty', 'ExtValue', 'CPN', 'Desc1', 'Employee', 'CostCenter', 'Product']
+
+
+def write_fixture(path: Path, rows: int, seed: int = 42):
+    random.seed(seed)
+    with Session(engine) as session:
+        tools = session.exec(select(Tool.number, Tool.name)).all() or [('BENCH-TOOL', 'Benchmark tool')]
+        cost_centers = session.exec(select(Machine.cost_center)).all() or [None]
+        users = [number for number in session.exec(select(User.number)).all() if number] or ['0']
+        products = [description for description in session.exec(select(Workpiece.description)).all() if description] or [None]
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Consumption')
+    ws.append(HEADER)
+    start = datetime.now() - timedelta(days=365)
+    for n in range(rows):
+        number, name = random.choice(tools)
+        quantity = random.randint(1, 10)
+        ws.append([
+            start + timedelta(seconds=n * 150),  # unique per tool and time
+            100000 + n,
+            quantity,
+            round(quantity * random.uniform(5, 200), 2) if random.random() > 0.1 else 0,
+            number,
+            name,
+            f"EMP-{random.choice(users)}",
+            random.choice(cost_centers),
+            random.choice(products),
+        ])
+    wb.save(path)
+
+
+def upload(url: str, path: Path):
+    """Upload the fixture and wait for its upload job, the duration includes queueing and importing"""
+    start = time.perf_counter()
+    with open(path, 'rb') as file:
+        response = httpx.post(
+            f"{url}/dashboard/upload/tool-consumption",
+            files={'file': (path.name, file, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')},
+            data={'sheet_names': 'Consumption', 'header_row': 0},
+            timeout=None,
+        )
+    response.raise_for_status()
+    if response.json().get('duplicate'):
+        print(f"Uploaded {path.name} in {time.perf_counter() - start:.2f}s: already imported, skipped")
+        return
+    job_id = response.json()['job_id']
+
+    while True:
+        job = httpx.get(f"{url}/dashboard/upload/jobs/{job_id}").json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.5)
+    duration = time.perf_counter() - start
+    if job['status'] == 'failed':
+        print(f"Upload job {job_id} failed after {duration:.2f}s: {job['error']}")
+        return
+    result = job['result']
+    print(f"Uploaded {path.name} in {duration:.2f}s: {result.get('inserted')} inserted, "
+          f"{result.get('skipped')} skipped, {result.get('bad_data')} bad")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--repeat", type=int, default=0, help="upload the same file this many more times")
+    args = parser.parse_args()
+
+    path = args.output or Path(f"tool_consumption_{args.rows}.xlsx")
+    start = time.perf_counter()
+    write_fixture(path, args.rows)
+    print(f"Wrote {args.rows} rows to {path} in {time.perf_counter() - start:.2f}s")
+    if args.output is None:
+        for _ in range(1 + args.repeat):
+            upload(args.url, path)
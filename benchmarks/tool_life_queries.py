@@ -0,0 +1,138 @@
+"""
+Statement count and duration of the tool life dashboard on a large data set.
+
+Seeds `--tools` tools named bench-tool-<n> with `--rows` tool lifes spread over the last `--span` days on the
+active machines of the database (removed again afterwards, the tool lifes with their tools), then builds the
+graph list and chart data for the last `--days` days twice: with one ToolLife query per tool and lazy loaded
+machine lines like before the set-based queries, and with query_tool_life_buckets:
+
+    uv run python benchmarks/tool_life_queries.py --tools 10000 --rows 5000000 --days 90
+
+Run it against a copy of the database, the report cube picks up the seeded rows if it is refreshed meanwhile.
+Use --skip-before to only measure the current queries, the per tool variant takes long on the full data set.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import delete, insert, text
+from sqlmodel import Session, select
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.models import Machine, Manufacturer, Tool, ToolLife, ToolType  # noqa: E402
+from app.query_stats import count_queries  # noqa: E402
+from app.router.dashboard.filters import DashboardFilter  # noqa: E402
+from app.router.dashboard.tool_lifes import (  # noqa: E402
+    build_tool_life_data, build_tool_life_graphs, filter_tool_life_statement, query_tool_life_buckets,
+)
+
+TOOL_PREFIX = "bench-tool-"
+
+
+def create_tools(tools: int) -> list:
+    with Session(engine) as session:
+        tool_type_id = session.exec(select(ToolType.id)).first()
+        manufacturer_id = session.exec(select(Manufacturer.id)).first()
+        if tool_type_id is None or manufacturer_id is None:
+            sys.exit("A tool type and a manufacturer are needed to create the benchmark tools")
+        session.execute(insert(Tool), [{
+            "name": f"{TOOL_PREFIX}{n}",
+            "number": f"{TOOL_PREFIX}{n}",
+            "tool_type_id": tool_type_id,
+            "manufacturer_id": manufacturer_id,
+            "price": 10,
+        } for n in range(tools)])
+        session.commit()
+        return session.exec(select(Tool.id).where(Tool.name.startswith(TOOL_PREFIX))).all()
+
+
+def create_tool_lifes(tool_ids: list, rows: int, span: int):
+    """Generate the tool lifes on the server, round robin over the tools and the machines with a line"""
+    with Session(engine) as session:
+        machine_ids = session.exec(select(Machine.id).where(Machine.active == True, Machine.line_id != None)).all()
+        if not machine_ids:
+            sys.exit("Active machines with a line are needed to log the benchmark tool lifes on")
+        session.execute(text("""
+            INSERT INTO toollife (reached_life, machine_channel, timestamp, tool_settings, additional_measurements,
+                                  tool_count, tool_id, machine_id)
+            SELECT 100 + (n * 7919) % 900, n % 2, :start + (n * :step) * interval '1 second', '{}', '{}',
+                   1, (:tool_ids)[1 + n % :tools], (:machine_ids)[1 + (n / :tools) % :machines]
+            FROM generate_series(0, :rows - 1) AS n
+        """), {
+            "start": datetime.now() - timedelta(days=span),
+            "step": span * 86400 / rows,
+            "tool_ids": list(tool_ids),
+            "tools": len(tool_ids),
+            "machine_ids": list(machine_ids),
+            "machines": len(machine_ids),
+            "rows": rows,
+        })
+        session.commit()
+
+
+def delete_tools():
+    with Session(engine) as session:
+        # The tool lifes are deleted with their tools (ON DELETE CASCADE)
+        session.execute(delete(Tool).where(Tool.name.startswith(TOOL_PREFIX)))
+        session.commit()
+
+
+def per_tool_queries(db: Session, dashboard_filter: DashboardFilter) -> int:
+    """The access pattern before query_tool_life_buckets: one query per active tool, machine lines loaded lazily"""
+    records, machine_keys = 0, set()
+    for tool in db.exec(select(Tool).where(Tool.active == True)).all():
+        statement = filter_tool_life_statement(select(ToolLife).where(ToolLife.tool_id == tool.id), dashboard_filter, db)
+        for tool_life in db.exec(statement.order_by(ToolLife.timestamp.asc())):
+            machine_keys.add(f"{tool_life.machine.line.name}_{tool_life.machine.name}")
+            records += 1
+    return records
+
+
+def set_based_queries(db: Session, dashboard_filter: DashboardFilter) -> int:
+    buckets = query_tool_life_buckets(db, dashboard_filter)
+    build_tool_life_graphs(buckets)
+    build_tool_life_data(db, buckets)
+    return sum(len(points) for tool in buckets.values() for channels in tool['machines'].values()
+               for points in channels.values())
+
+
+def measure(name: str, function, dashboard_filter: DashboardFilter):
+    with Session(engine) as db, count_queries() as stats:
+        start = time.perf_counter()
+        records = function(db, dashboard_filter)
+        duration = time.perf_counter() - start
+    print(f"{name:>10}: {records} tool lifes, {stats.count:6} statements in {duration:8.2f}s "
+          f"({stats.seconds:.2f}s in the database)")
+
+
+def run(tools: int, rows: int, span: int, days: int, skip_before: bool):
+    start = time.perf_counter()
+    tool_ids = create_tools(tools)
+    create_tool_lifes(tool_ids, rows, span)
+    print(f"seeded {len(tool_ids)} tools and {rows} tool lifes in {time.perf_counter() - start:.1f}s")
+
+    end_date = datetime.now()
+    dashboard_filter = DashboardFilter(start_date=end_date - timedelta(days=days), end_date=end_date)
+    if not skip_before:
+        measure("per tool", per_tool_queries, dashboard_filter)
+    measure("set based", set_based_queries, dashboard_filter)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tools", type=int, default=10000)
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--span", type=int, default=730, help="Days the seeded tool lifes are spread over")
+    parser.add_argument("--days", type=int, default=90, help="Days of the dashboard filter")
+    parser.add_argument("--skip-before", action="store_true")
+    args = parser.parse_args()
+
+    delete_tools()
+    try:
+        run(args.tools, args.rows, args.span, args.days, args.skip_before)
+    finally:
+        delete_tools()
@@ -0,0 +1,92 @@
+"""
+Statement count check of the unique tools endpoint.
+
+Calls `get_unique_tool_data` for every product in the database and once for all products, counts the SQL
+statements each call emits and fails if any call needs more than --max-statements, so the count stays constant
+regardless of how many tools a selection lists:
+
+    uv run python benchmarks/unique_tools_queries.py --days 365
+
+The resolved selections are dropped before every call, so their queries are counted as well. The same check
+runs with pytest from the repository root: uv run pytest benchmarks
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.models import Recipe  # noqa: E402
+from app.router.dashboard import filters  # noqa: E402
+from app.router.dashboard.filters import DashboardFilter  # noqa: E402
+from app.router.dashboard.tools import get_unique_tool_data  # noqa: E402
+
+# Selection resolution (2), tools with their type and manufacturer, recipes, workpieces, lines,
+# consumption and tool life aggregates
+MAX_STATEMENTS = 8
+
+statements = []
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+
+
+def measure(dashboard_filter: DashboardFilter) -> tuple:
+    filters._resolved.clear()
+    with Session(engine) as db:
+        statements.clear()
+        start = time.perf_counter()
+        tools = asyncio.run(get_unique_tool_data(dashboard_filter=dashboard_filter, db=db))
+        return len(tools), len(statements), time.perf_counter() - start
+
+
+def selection_cases(days: int) -> list:
+    """(name, filter) of every product with its operations and of all products, empty without recipes"""
+    with Session(engine) as db:
+        selections = db.exec(select(Recipe.workpiece_id, Recipe.machine_id).where(Recipe.workpiece_id != None)).all()
+    if not selections:
+        return []
+
+    products = {}
+    for product_id, machine_id in selections:
+        products.setdefault(product_id, set()).add(machine_id)
+    end_date = datetime.now()
+    start_date = end_date - timedelta(days=days)
+    cases = [(f"product {product_id}", [product_id], machines) for product_id, machines in products.items()]
+    cases.append(("all products", list(products), {machine_id for _, machine_id in selections}))
+    return [(name, DashboardFilter(start_date=start_date, end_date=end_date,
+                                   operations=list(machine_ids), products=product_ids))
+            for name, product_ids, machine_ids in cases]
+
+
+def run(days: int, max_statements: int) -> bool:
+    cases = selection_cases(days)
+    if not cases:
+        print("The check needs at least one recipe in the database")
+        return False
+
+    passed = True
+    for name, dashboard_filter in cases:
+        tool_count, statement_count, duration = measure(dashboard_filter)
+        ok = statement_count <= max_statements
+        passed = passed and ok
+        print(f"{name:>16}: {tool_count:5} tools, {statement_count:3} statements, {duration * 1000:8.1f}ms"
+              f"{'' if ok else '  <- too many statements'}")
+    return passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--max-statements", type=int, default=MAX_STATEMENTS)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.days, args.max_statements) else 1)
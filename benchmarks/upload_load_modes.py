@@ -0,0 +1,93 @@
+"""
+Benchmark of the upload load modes.
+
+Writes synthetic ToolConsumption rows through `write_to_db` once with the standard multi-row INSERT and once
+with the COPY staging table, in the chunk sizes the upload endpoints use, and prints the time per mode:
+
+    uv run python benchmarks/upload_load_modes.py --rows 10000 100000 1000000
+
+The rows are dated far in the future so they never collide with real data and are deleted again afterwards.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+
+from sqlmodel import Session, delete, select
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.database_config import engine  # noqa: E402
+from app.models import Tool, ToolConsumption, ToolConsumptionCreate  # noqa: E402
+from app.router.dashboard.upload import chunk_size_for, write_to_db  # noqa: E402
+
+LOAD_MODES = ['insert', 'copy']
+BENCHMARK_START = datetime(2200, 1, 1)
+
+
+def make_records(tool_id: int, rows: int, seed: int = 42):
+    random.seed(seed)
+    records = []
+    for n in range(rows):
+        quantity = random.randint(1, 10)
+        price = Decimal(f"{random.uniform(5, 200):.2f}")
+        records.append({
+            'datetime': BENCHMARK_START + timedelta(seconds=n),
+            'number': 100000 + n,
+            'consumption_type': 'consumption',
+            'quantity': quantity,
+            'value': price * quantity,
+            'price': price,
+            'machine_id': None,
+            'tool_id': tool_id,
+            'recipe_id': None,
+            'tool_position_id': None,
+            'user_id': None,
+            'workpiece_id': None,
+        })
+    return records
+
+
+def remove_records():
+    with Session(engine) as session:
+        session.exec(delete(ToolConsumption).where(ToolConsumption.datetime >= BENCHMARK_START))
+        session.commit()
+
+
+def load(records: list, load_mode: str) -> dict:
+    result = {'total_records': 0, 'inserted': 0, 'skipped': 0, 'bad_data': 0, 'errors': []}
+    chunk_size = chunk_size_for(load_mode)
+    with Session(engine) as session:
+        for start in range(0, len(records), chunk_size):
+            result = write_to_db(records[start:start + chunk_size], ToolConsumption, ToolConsumptionCreate,
+                                 session, result, load_mode)
+    return result
+
+
+def run(row_counts: list):
+    with Session(engine) as session:
+        tool_id = session.exec(select(Tool.id)).first()
+    if tool_id is None:
+        print("The benchmark needs at least one tool in the database")
+        return
+
+    for rows in row_counts:
+        records = make_records(tool_id, rows)
+        for load_mode in LOAD_MODES:
+            remove_records()
+            start = time.perf_counter()
+            result = load(records, load_mode)
+            duration = time.perf_counter() - start
+            print(f"{rows:>9} rows {load_mode:>6}: {duration:8.2f}s ({rows / duration:,.0f} rows/s), "
+                  f"{result['inserted']} inserted, {result['skipped']} skipped, {result['bad_data']} bad")
+        remove_records()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+    run(args.rows)